@@ -0,0 +1,189 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Throughput (assets/second) of nrml_utils.writer.ExposureWriter on a
+synthetic exposure txt file, serializing the same assets through the
+lxml tree, the streaming mode and an ExposureTable. The same runs are
+made with PreviousExposureWriter, which serializes every asset the way
+the writer did before the emitter table, for comparison.
+"""
+
+import os
+import sys
+import argparse
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'nrml_utils'))
+
+from lxml import etree
+
+from nrml_utils.reader import ExposureTxtReader
+from nrml_utils.writer import (
+    ASSET, ASSET_CHILD_INDENT, ASSET_INDENT, EXPOSURE_LIST, GML_ID,
+    GML_POINT, GML_POS, GML_SRS_ATTR_NAME, GML_SRS_EPSG_4326, QNAMES, SITE,
+    TAXONOMY, AREA, COCO, DEDUCTIBLE, LIMIT, NUMBER, OCCUPANTS, RECO, STCO,
+    ExposureWriter, _escape_attrib, _escape_text)
+
+from synthetic import write_exposure_txt
+
+
+class PreviousExposureWriter(ExposureWriter):
+    """
+    ExposureWriter checking every optional field of every asset and
+    building its tags as it goes, like before the emitter table.
+    """
+
+    OPTIONAL_FIELDS = [
+        ('area', AREA, None),
+        ('coco', COCO, None),
+        ('deductible', DEDUCTIBLE, None),
+        ('limit', LIMIT, None),
+        ('number', NUMBER, None),
+        ('occupantDay', OCCUPANTS, 'day'),
+        ('occupantNight', OCCUPANTS, 'night'),
+        ('reco', RECO, None),
+        ('stco', STCO, None)]
+
+    def _asset_fragment(self, i, asset, emitters):
+        parts = [ASSET_INDENT, '<%s %s="asset_%s">' % (
+            QNAMES[ASSET], QNAMES[GML_ID], i)]
+
+        if (self._value_defined_for(asset, 'lon') and
+            self._value_defined_for(asset, 'lat')):
+            pos = _escape_text(" ".join([asset['lon'], asset['lat']]))
+            parts.extend([
+                ASSET_CHILD_INDENT, '<%s>' % QNAMES[SITE],
+                ASSET_CHILD_INDENT, '  <%s %s="%s">' % (
+                    QNAMES[GML_POINT], GML_SRS_ATTR_NAME,
+                    GML_SRS_EPSG_4326),
+                ASSET_CHILD_INDENT, '    <%s>%s</%s>' % (
+                    QNAMES[GML_POS], pos, QNAMES[GML_POS]),
+                ASSET_CHILD_INDENT, '  </%s>' % QNAMES[GML_POINT],
+                ASSET_CHILD_INDENT, '</%s>' % QNAMES[SITE]])
+        else:
+            raise RuntimeError('lon and lat are compulsory values for an '
+                               'asset')
+
+        for field, tag, description in self.OPTIONAL_FIELDS:
+            if self._value_defined_for(asset, field):
+                if description is None:
+                    start_tag = '<%s>' % QNAMES[tag]
+                else:
+                    start_tag = '<%s description="%s">' % (
+                        QNAMES[tag], _escape_attrib(description))
+                parts.extend([ASSET_CHILD_INDENT, start_tag,
+                              _escape_text(asset[field]),
+                              '</%s>' % QNAMES[tag]])
+
+        if self._value_defined_for(asset, 'taxonomy'):
+            parts.extend([ASSET_CHILD_INDENT, '<%s>' % QNAMES[TAXONOMY],
+                          _escape_text(asset['taxonomy']),
+                          '</%s>' % QNAMES[TAXONOMY]])
+        else:
+            raise RuntimeError('taxonomy is a compulsory value for '
+                               'an asset')
+
+        parts.extend([ASSET_INDENT, '</%s>' % QNAMES[ASSET]])
+        return ''.join(parts)
+
+    def _write_assets(self, root_elem, assets, fields=None):
+        exp_list = root_elem.find('.//%s' % EXPOSURE_LIST)
+        for i, asset in enumerate(assets, start=1):
+            asset_elem = etree.SubElement(exp_list, ASSET)
+            asset_elem.attrib[GML_ID] = 'asset_%s' % i
+
+            if (self._value_defined_for(asset, 'lon') and
+                self._value_defined_for(asset, 'lat')):
+                site_elem = etree.SubElement(asset_elem, SITE)
+                point_elem = etree.SubElement(site_elem, GML_POINT)
+                point_elem.attrib[GML_SRS_ATTR_NAME] = GML_SRS_EPSG_4326
+                pos_elem = etree.SubElement(point_elem, GML_POS)
+                pos_elem.text = " ".join([asset['lon'], asset['lat']])
+            else:
+                raise RuntimeError('lon and lat are compulsory values for an '
+                                   'asset')
+
+            for field, tag, description in self.OPTIONAL_FIELDS:
+                if self._value_defined_for(asset, field):
+                    child_elem = etree.SubElement(asset_elem, tag)
+                    child_elem.text = asset[field]
+                    if description is not None:
+                        child_elem.attrib['description'] = description
+
+            if self._value_defined_for(asset, 'taxonomy'):
+                taxonomy_elem = etree.SubElement(asset_elem, TAXONOMY)
+                taxonomy_elem.text = asset['taxonomy']
+            else:
+                raise RuntimeError('taxonomy is a compulsory value for '
+                                   'an asset')
+        return root_elem
+
+
+def timed(function, *args, **kwargs):
+    started_at = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - started_at
+
+
+def run(input_filename, output_filename, assets):
+    with open(input_filename) as txtfile:
+        reader = ExposureTxtReader(txtfile)
+        metadata = reader.metadata
+        asset_list, read_time = timed(reader.readassets)
+        table = reader.readtable()
+    print('read (dicts): %.0f assets/s' % (assets / read_time))
+
+    for mode, data, streaming in [('tree', asset_list, False),
+                                  ('streaming', asset_list, True),
+                                  ('table', table, True)]:
+        for name, writer in [('current', ExposureWriter()),
+                             ('previous', PreviousExposureWriter())]:
+            _, elapsed = timed(writer.serialize, output_filename, metadata,
+                               data, streaming=streaming)
+            print('serialize (%s, %s): %.0f assets/s' % (
+                mode, name, assets / elapsed))
+
+
+def cmd_parser():
+
+    parser = argparse.ArgumentParser(prog='exposure_writer')
+
+    parser.add_argument('-n', '--assets',
+        type=int,
+        default=1000000,
+        dest='assets',
+        help='Number of synthetic assets (default: 1000000)')
+
+    return parser
+
+
+def main():
+    args = cmd_parser().parse_args()
+    tmpdir = tempfile.mkdtemp()
+    input_filename = os.path.join(tmpdir, 'exposure.txt')
+    output_filename = os.path.join(tmpdir, 'exposure.xml')
+    try:
+        write_exposure_txt(input_filename, args.assets)
+        run(input_filename, output_filename, args.assets)
+    finally:
+        for filename in (input_filename, output_filename):
+            if os.path.exists(filename):
+                os.remove(filename)
+        os.rmdir(tmpdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Benchmark suite of the txt to NRML converters.
+
+Every converter runs on deterministic synthetic inputs of each of the
+requested sizes, in a fresh process, and the wall time, records per
+second and peak RSS of each of its stages (read, transform, serialize)
+are written to a JSON file, to be compared across commits.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import traceback
+import subprocess
+from multiprocessing import Process, Queue
+
+import synthetic
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir)
+sys.path[:0] = [INPUT_DIR, os.path.join(INPUT_DIR, 'nrml_utils')]
+
+SIZES = [10000, 100000, 1000000, 10000000]
+DEFAULT_SIZES = SIZES[:2]
+
+
+# Converters: each one is a generator function taking the synthetic
+# input paths and the output path, that yields the name of a stage as
+# soon as the stage is over. Modules are imported there, so that their
+# import happens in the measured process.
+
+def exposure(paths, output):
+    from nrml_utils.reader import ExposureTxtReader
+    from nrml_utils.writer import ExposureWriter
+
+    with open(paths['input']) as txtfile:
+        reader = ExposureTxtReader(txtfile)
+        metadata = reader.metadata
+        assets = reader.readassets()
+    yield 'read'
+    ExposureWriter().serialize(output, metadata, assets)
+    yield 'serialize'
+
+
+def exposure_table(paths, output):
+    from nrml_utils.reader import ExposureTxtReader
+    from nrml_utils.writer import ExposureWriter
+
+    with open(paths['input']) as txtfile:
+        reader = ExposureTxtReader(txtfile)
+        metadata = reader.metadata
+        table = reader.readtable()
+    yield 'read'
+    table.validate()
+    yield 'transform'
+    ExposureWriter().serialize(output, metadata, table, streaming=True)
+    yield 'serialize'
+
+
+def exposure_txt2nrml(paths, output):
+    # the conversion of the script, reading and writing in one pass
+    from nrml_utils.pipeline import convert_exposure
+
+    convert_exposure(paths['input'], output)
+    yield 'serialize'
+
+
+def eqrm(paths, output):
+    import eqrm_csv2NRML
+
+    with open(paths['metadata']) as metadata_file, \
+            open(paths['input']) as input_file:
+        reader = eqrm_csv2NRML.ExposureTxtReader(metadata_file, input_file)
+        metadata = reader.metadata
+        assets = reader.readassets()
+    bldg_mapping = eqrm_csv2NRML.read_bldg_mapping(paths['mapping'],
+                                                   cache=False)
+    yield 'read'
+    eqrm_csv2NRML.ExposureWriter(bldg_mapping).serialize(
+        output, metadata, assets)
+    yield 'serialize'
+
+
+def eqrm_chunks(paths, output):
+    import eqrm_csv2NRML
+
+    bldg_mapping = eqrm_csv2NRML.read_bldg_mapping(paths['mapping'],
+                                                   cache=False)
+    yield 'read'
+    with open(paths['metadata']) as metadata_file, \
+            open(paths['input']) as input_file:
+        reader = eqrm_csv2NRML.ExposureTxtReader(metadata_file, input_file)
+        eqrm_csv2NRML.ExposureWriter(bldg_mapping).serialize_chunks(
+            output, reader.metadata, reader.iter_chunks())
+    yield 'serialize'
+
+
+def vulnerability(paths, output):
+    import vulnerabilityTxt2NRML
+
+    with open(paths['input']) as input_file:
+        reader = vulnerabilityTxt2NRML.VulnerabilityTxtReader(input_file)
+        metadata = reader.metadata
+        definitions = reader.readvulnerability()
+    yield 'read'
+    vulnerabilityTxt2NRML.VulnerabilityWriter().serialize(
+        output, metadata, definitions)
+    yield 'serialize'
+
+
+def fragility(paths, output):
+    import fragilityTxt2NRML
+
+    with open(paths['input']) as input_file:
+        reader = fragilityTxt2NRML.FragilityTxtReader(input_file)
+        metadata = reader.metadata
+        definitions = reader.readfragility()
+    yield 'read'
+    fragilityTxt2NRML.FragilityWriter().serialize(
+        output, metadata, definitions)
+    yield 'serialize'
+
+
+def site_model(paths, output):
+    import create_sitemodel
+
+    with open(paths['input']) as input_file:
+        reader = create_sitemodel.SiteModelTxtReader(input_file)
+        metadata = reader.metadata
+        sites = reader.readassets()
+    yield 'read'
+    create_sitemodel.SiteModelWriter().serialize(output, metadata, sites)
+    yield 'serialize'
+
+
+def esri(paths, output):
+    import esri2nrml
+
+    metadata = esri2nrml.read_metadata(paths['metadata'])
+    data = esri2nrml.read_binary_data(paths['input'], metadata)
+    yield 'read'
+    assets = list(esri2nrml.asset_iterator(metadata, data))
+    yield 'transform'
+    writer = esri2nrml.ExposureModelWriter('POP')
+    for asset_data in assets:
+        writer.add(asset_data)
+    writer.serialize(output)
+    yield 'serialize'
+
+
+def esri_streaming(paths, output):
+    import esri2nrml
+
+    metadata = esri2nrml.read_metadata(paths['metadata'])
+    data = esri2nrml.read_binary_data(paths['input'], metadata)
+    yield 'read'
+    esri2nrml.ExposureModelWriter('POP').serialize_blocks(
+        output, esri2nrml.asset_blocks(metadata, data))
+    yield 'serialize'
+
+
+def _input(workdir, size, name):
+    return os.path.join(workdir, '%s_%s' % (size, name))
+
+
+CONVERTERS = {
+    'exposure': (exposure, lambda workdir, size: dict(
+        input=_input(workdir, size, 'exposure.txt'))),
+    'exposure-table': (exposure_table, lambda workdir, size: dict(
+        input=_input(workdir, size, 'exposure.txt'))),
+    'exposureTxt2NRML': (exposure_txt2nrml, lambda workdir, size: dict(
+        input=_input(workdir, size, 'exposure.txt'))),
+    'eqrm_csv2NRML': (eqrm, lambda workdir, size: dict(
+        input=_input(workdir, size, 'nexis.csv'),
+        metadata=_input(workdir, size, 'nexis_header.txt'),
+        mapping=_input(workdir, size, 'bldg_class_mapping.csv'))),
+    'eqrm_csv2NRML-chunks': (eqrm_chunks, lambda workdir, size: dict(
+        input=_input(workdir, size, 'nexis.csv'),
+        metadata=_input(workdir, size, 'nexis_header.txt'),
+        mapping=_input(workdir, size, 'bldg_class_mapping.csv'))),
+    'vulnerabilityTxt2NRML': (vulnerability, lambda workdir, size: dict(
+        input=_input(workdir, size, 'vulnerability.txt'))),
+    'fragilityTxt2NRML': (fragility, lambda workdir, size: dict(
+        input=_input(workdir, size, 'fragility.txt'))),
+    'create_sitemodel': (site_model, lambda workdir, size: dict(
+        input=_input(workdir, size, 'site_model.csv'))),
+    'esri2nrml': (esri, lambda workdir, size: dict(
+        input=_input(workdir, size, 'landscan.bil'),
+        metadata=_input(workdir, size, 'landscan.ini'))),
+    'esri2nrml-streaming': (esri_streaming, lambda workdir, size: dict(
+        input=_input(workdir, size, 'landscan.bil'),
+        metadata=_input(workdir, size, 'landscan.ini'))),
+}
+
+
+def generate(paths, size):
+    """
+    Write the synthetic inputs in paths, unless they already exist.
+    """
+    if all(os.path.exists(path) for path in paths.values()):
+        return
+    name = os.path.basename(paths['input']).split('_', 1)[1]
+    if name == 'exposure.txt':
+        synthetic.write_exposure_txt(paths['input'], size)
+    elif name == 'nexis.csv':
+        synthetic.write_eqrm_csv(paths['input'], paths['metadata'],
+                                 paths['mapping'], size)
+    elif name == 'vulnerability.txt':
+        synthetic.write_vulnerability_txt(paths['input'], size)
+    elif name == 'fragility.txt':
+        synthetic.write_fragility_txt(paths['input'], size)
+    elif name == 'site_model.csv':
+        synthetic.write_site_model_csv(paths['input'], size)
+    elif name == 'landscan.bil':
+        synthetic.write_esri_raster(paths['input'], paths['metadata'], size)
+
+
+def peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on Mac OS X, kilobytes on Linux
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def _measure(converter, paths, output, size, queue):
+    stages = []
+    try:
+        os.chdir(os.path.dirname(output))
+        started_at = time.time()
+        for stage in converter(paths, output):
+            now = time.time()
+            stages.append(dict(stage=stage, wall_time=now - started_at,
+                               records_per_second=size / (now - started_at),
+                               peak_rss_kb=peak_rss_kb()))
+            started_at = time.time()
+        queue.put(dict(stages=stages))
+    except Exception:
+        queue.put(dict(stages=stages, error=traceback.format_exc()))
+
+
+def measure(name, size, workdir):
+    """
+    Run converter name on the synthetic input of the given size in a
+    new process and return the measures of its stages. peak_rss_kb is
+    the peak of the process up to the end of each stage.
+    """
+    converter, input_paths = CONVERTERS[name]
+    paths = input_paths(workdir, size)
+    generate(paths, size)
+    output_dir = tempfile.mkdtemp(dir=workdir)
+    output = os.path.join(output_dir, 'output.xml')
+    queue = Queue()
+    process = Process(target=_measure,
+                      args=(converter, paths, output, size, queue))
+    process.start()
+    process.join()
+    shutil.rmtree(output_dir)
+    if queue.empty():
+        return dict(stages=[], error='exit code %s' % process.exitcode)
+    return queue.get()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=INPUT_DIR).strip().decode()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def cmd_parser():
+
+    parser = argparse.ArgumentParser(prog='suite',
+        description='Benchmark the txt to NRML converters')
+
+    parser.add_argument('-c', '--converters',
+        nargs='+',
+        choices=sorted(CONVERTERS),
+        default=sorted(CONVERTERS),
+        dest='converters',
+        help='Converters to benchmark (default: all)')
+
+    parser.add_argument('-s', '--sizes',
+        nargs='+',
+        type=int,
+        default=DEFAULT_SIZES,
+        dest='sizes',
+        help='Numbers of records of the synthetic inputs (default: %s; '
+             'the full ladder is %s)' % (
+                 ' '.join(map(str, DEFAULT_SIZES)),
+                 ' '.join(map(str, SIZES))))
+
+    parser.add_argument('-w', '--workdir',
+        dest='workdir',
+        help='Directory where the synthetic inputs are generated and '
+             'kept between runs (default: a temporary directory)')
+
+    parser.add_argument('-o', '--output-file',
+        dest='output_file',
+        default='benchmark_results.json',
+        help='JSON results file (default: benchmark_results.json)')
+
+    return parser
+
+
+def main():
+    args = cmd_parser().parse_args()
+    workdir = args.workdir or tempfile.mkdtemp()
+    if not os.path.isdir(workdir):
+        os.makedirs(workdir)
+
+    results = []
+    try:
+        for name in args.converters:
+            for size in args.sizes:
+                result = measure(name, size, workdir)
+                result.update(converter=name, records=size)
+                results.append(result)
+                for stage in result['stages']:
+                    print('%-22s %9d %-10s %8.2fs %10.0f rec/s %9d KB' % (
+                        name, size, stage['stage'], stage['wall_time'],
+                        stage['records_per_second'], stage['peak_rss_kb']))
+                if 'error' in result:
+                    print('%-22s %9d failed: %s' % (
+                        name, size, result['error'].strip().splitlines()[-1]))
+    finally:
+        if args.workdir is None:
+            shutil.rmtree(workdir)
+
+    with open(args.output_file, 'w') as output_file:
+        json.dump(dict(revision=git_revision(),
+                       python=platform.python_version(),
+                       platform=platform.platform(),
+                       date=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       results=results),
+                  output_file, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Deterministic synthetic inputs for the txt to NRML converters.
+
+Every generator takes the number of records to write and a seed, so
+that the same call always writes the same bytes.
+"""
+
+import math
+import random
+import struct
+
+EXPOSURE_HEADER = (
+    'expModId,assetCategory,description,stcoType,stcoUnit,areaType,'
+    'areaUnit,cocoType,cocoUnit,recoType,recoUnit,taxonomySource\n'
+    'SYN01,buildings,synthetic exposure,aggregated,USD,per_asset,SQM,'
+    'aggregated,USD,aggregated,USD,synthetic\n\n'
+    'lon,lat,taxonomy,stco,number,area,reco,coco,occupantDay,'
+    'occupantNight,deductible,limit\n')
+TAXONOMIES = ['RC_MR_LC', 'RC_LR_HC', 'URM_LR', 'W1_LR', 'S_HR_MC']
+
+EQRM_METADATA = (
+    'expModId,category,description,taxonomySource,stcoType,stcoUnit,'
+    'areaType,areaUnit\n'
+    'SYN_exposure,buildings,synthetic exposure,NEXIS,per_area,AUD,'
+    'aggregated,SQM\n')
+EQRM_HEADER = (
+    'LID,LATITUDE,LONGITUDE,GCC_CODE,SA1_CODE,LGA_CODE,LGA_NAME,SUBURB,'
+    'POSTCODE,HAZUS_STRUCTURE_CLASSIFICATION,GA_STRUCTURE_CLASSIFICATION,'
+    'STRUCTURE_CATEGORY,HAZUS_USAGE,FCB_USAGE,SITE_CLASS,YEAR_BUILT,'
+    'CONTENTS_COST_DENSITY,BUILDING_COST_DENSITY,FLOOR_AREA,POPULATION,'
+    'SURVEY_FACTOR\n')
+EQRM_CLASSES = [('URML', 'URMLDBTILE'), ('W1', 'W1TIMBERMETAL'),
+                ('C1L', 'C1LSOFT'), ('S1L', 'S1LMEAN'), ('W1', 'W1BVTILE')]
+EQRM_MAPPING = [('URMLDBTILE', 'URML'), ('W1TIMBERMETAL', 'W1TM'),
+                ('C1LSOFT', 'C1L'), ('S1LMEAN', 'S1L'), ('W1BVTILE', 'W1BV')]
+YEAR_RANGES = ['1891 - 1913', '1914 - 1946', '1947 - 1961', '1962 - 1981',
+               '1977 - 1981', '1992 - 1996', '1997 - 2001', '2002 - 2011']
+
+IMLS = [0.0, 0.06, 0.07, 0.09, 0.11, 0.13, 0.16, 0.19, 0.23, 0.27, 0.33,
+        0.4, 0.48, 0.58, 0.7, 0.84, 1.02]
+LIMIT_STATES = ['slight', 'moderate', 'extensive', 'complete']
+VS30_VALUES = [115, 180, 270, 412, 560, 760, 1100]
+
+
+def _curve(rnd, size):
+    values = sorted(rnd.random() for _ in range(size))
+    return ','.join('%.6f' % value for value in values)
+
+
+def write_exposure_txt(filename, records, seed=42):
+    """
+    Exposure txt for nrml_utils and exposureTxt2NRML. deductible,
+    limit and occupantNight are empty for every asset.
+    """
+    rnd = random.Random(seed)
+    with open(filename, 'w') as txtfile:
+        txtfile.write(EXPOSURE_HEADER)
+        for _ in range(records):
+            txtfile.write('%.4f,%.4f,%s,%d,%d,%d,%d,%d,%d,,,\n' % (
+                rnd.uniform(-180, 180), rnd.uniform(-90, 90),
+                rnd.choice(TAXONOMIES), rnd.randint(1000, 1000000),
+                rnd.randint(1, 100), rnd.randint(50, 5000),
+                rnd.randint(1000, 100000), rnd.randint(1000, 100000),
+                rnd.randint(0, 50)))
+
+
+def write_eqrm_csv(filename, metadata_filename, mapping_filename, records,
+                   seed=42):
+    """
+    NEXIS/EQRM exposure csv, its metadata file and the building class
+    mapping for eqrm_csv2NRML.
+    """
+    rnd = random.Random(seed)
+    with open(metadata_filename, 'w') as metadata_file:
+        metadata_file.write(EQRM_METADATA)
+    with open(mapping_filename, 'w') as mapping_file:
+        mapping_file.write('NEXIS_CONS,MAPPING2\n')
+        for ga_class, mapping in EQRM_MAPPING:
+            mapping_file.write('%s,%s\n' % (ga_class, mapping))
+    with open(filename, 'w') as csvfile:
+        csvfile.write(EQRM_HEADER)
+        for i in range(records):
+            hazus_class, ga_class = rnd.choice(EQRM_CLASSES)
+            csvfile.write(
+                'SYN_%09d,%.10f,%.9f,5GPER,%d,55110.00000000,Synthetic (C),'
+                'SUBURB%d,6%03d,%s,%s,Building,RES1,111,CD,%s,297.0000,'
+                '%.4f,%.2f,%.8f,1\n' % (
+                    i, rnd.uniform(-35, -30), rnd.uniform(115, 116),
+                    50201102101 + rnd.randint(0, 999), rnd.randint(0, 99),
+                    rnd.randint(0, 999), hazus_class, ga_class,
+                    rnd.choice(YEAR_RANGES), rnd.uniform(1000, 2000),
+                    rnd.uniform(50, 500), rnd.uniform(0, 5)))
+
+
+def write_vulnerability_txt(filename, records, seed=42):
+    """
+    Vulnerability txt for vulnerabilityTxt2NRML, one function per record.
+    """
+    rnd = random.Random(seed)
+    imls = ','.join('%s' % iml for iml in IMLS)
+    with open(filename, 'w') as txtfile:
+        txtfile.write('SYN_vulnerability,buildings,structural,'
+                      'synthetic vulnerability model\n\n')
+        for i in range(records):
+            txtfile.write('VF_%d,LN,%s\n%s\n%s\n%s\n' % (
+                i, rnd.choice(['PGA', 'SA(0.3)', 'SA(1.0)']), imls,
+                _curve(rnd, len(IMLS)),
+                ','.join(['%.2f' % rnd.uniform(0, 1)] * len(IMLS))))
+
+
+def write_fragility_txt(filename, records, seed=42):
+    """
+    Discrete fragility txt for fragilityTxt2NRML, one function per record.
+    """
+    rnd = random.Random(seed)
+    imls = ','.join('%s' % iml for iml in IMLS[1:8])
+    with open(filename, 'w') as txtfile:
+        txtfile.write('SYN_fragility,buildings,structural,'
+                      'synthetic fragility model\n%s\n\n'
+                      % ','.join(LIMIT_STATES))
+        for i in range(records):
+            txtfile.write('FF_%d,discrete,PGA,0.05\n%s\n' % (i, imls))
+            for _ in LIMIT_STATES:
+                txtfile.write('%s\n' % _curve(rnd, 7))
+
+
+def write_site_model_csv(filename, records, seed=42):
+    """
+    Site model csv for create_sitemodel, with a mix of the tabulated
+    and arbitrary vs30 values.
+    """
+    rnd = random.Random(seed)
+    with open(filename, 'w') as csvfile:
+        csvfile.write('lon,lat,vs30\n')
+        for _ in range(records):
+            if rnd.random() < 0.5:
+                vs30 = rnd.choice(VS30_VALUES)
+            else:
+                vs30 = rnd.uniform(100, 1500)
+            csvfile.write('%.9f,%.9f,%.1f\n' % (
+                rnd.uniform(110, 155), rnd.uniform(-45, -10), vs30))
+
+
+def write_esri_raster(filename, ini_filename, records, seed=42,
+                      nodata=-9999):
+    """
+    LandScan-like int16 LSB binary grid of about records cells, with
+    its .ini metadata, for esri2nrml. Two thirds of the cells are
+    nodata or zero, like the offshore and empty cells of a real grid.
+    """
+    rnd = random.Random(seed)
+    ncols = int(math.ceil(math.sqrt(records)))
+    nrows = int(math.ceil(float(records) / ncols))
+    cellsize = 30.0 / 3600
+    with open(ini_filename, 'w') as ini:
+        ini.write('[georeference]\nnrows = %d\nncols = %d\n'
+                  'xmin = %.10f\nymin = %.10f\nxmax = %.10f\nymax = %.10f\n'
+                  '\n[data]\nnodatavalue = %d\n' % (
+                      nrows, ncols, 100.0, -10.0 - nrows * cellsize,
+                      100.0 + ncols * cellsize, -10.0, nodata))
+    with open(filename, 'wb') as data:
+        for _ in range(nrows):
+            row = []
+            for _ in range(ncols):
+                draw = rnd.random()
+                if draw < 0.4:
+                    row.append(nodata)
+                elif draw < 0.67:
+                    row.append(0)
+                else:
+                    row.append(rnd.randint(1, 5000))
+            data.write(struct.pack('<%dh' % ncols, *row))
+    return nrows, ncols
@@ -20,9 +20,22 @@ taking an exposure portfolio in a fixed txt format.
 import os
 import sys
 import math
+import re
+import struct
+import zlib
 import argparse
+from io import BytesIO
+from itertools import chain, islice
 from lxml import etree
-from csv import DictReader
+from csv import DictReader, reader as csv_reader
+from xml.sax.saxutils import escape
+import numpy
+
+# the shared nrml_utils package is kept next to the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'nrml_utils'))
+from nrml_utils.arguments import bbox_argument
+from nrml_utils.compression import is_compressed, open_file
 
 NRML_NS = 'http://openquake.org/xmlns/nrml/0.5'
 GML_NS = 'http://www.opengis.net/gml'
@@ -45,16 +58,55 @@ VS30TYPE = 'vs30Type'
 
 NO_VALUE = ''
 
+# Streaming serialization: the sites, written from a template at the
+# indentation lxml gives them
+SITES_PLACEHOLDER = 'sites'
+SITE = ('\n    <site lon="%s" lat="%s" vs30="%s" vs30Type="inferred" '
+        'z1pt0="%s" z2pt5="%s" backarc="false"/>')
+SITE_BLOCK_SIZE = 10000
+_ATTRIB_ENTITIES = {'"': '&quot;', '\t': '&#9;', '\n': '&#10;', '\r': '&#13;'}
+_ATTRIB_SPECIALS = re.compile('[&<>"\t\n\r]')
 
-def create_z1pt0_z2pt5_dic():
-
-    _dic = {}
-    for value in [115, 180, 270, 412, 560, 760, 1100]:
+# Vs30 rasters: numpy dtypes of the BIL pixel types and of the GeoTIFF
+# (SampleFormat, BitsPerSample), the TIFF field types as (struct
+# format, size) and the TIFF tags read
+BIL_PIXEL_TYPES = {'UNSIGNEDINT': 'u', 'SIGNEDINT': 'i', 'FLOAT': 'f'}
+TIFF_SAMPLE_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+TIFF_TYPES = {1: ('B', 1), 2: ('c', 1), 3: ('H', 2), 4: ('I', 4),
+              5: ('II', 8), 6: ('b', 1), 7: ('B', 1), 8: ('h', 2),
+              9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8)}
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PREDICTOR = 317
+TILE_WIDTH = 322
+TILE_LENGTH = 323
+TILE_OFFSETS = 324
+TILE_BYTE_COUNTS = 325
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+GEO_KEY_DIRECTORY = 34735
+GDAL_NODATA = 42113
+# no compression, deflate and the old deflate code
+TIFF_COMPRESSIONS = (1, 8, 32946)
+GT_RASTER_TYPE = 1025
+RASTER_PIXEL_IS_POINT = 2
+RASTER_EXTENSIONS = ('.asc', '.bil', '.tif', '.tiff')
 
-        z1pt0, z2pt5 = est_z1pt0_z2pt5_given_v30(value)
-        _dic[value] = {'z1pt0': z1pt0, 'z2pt5': z2pt5}
-
-    return _dic
+# Exposure sites: the location columns of the exposure txt and of the
+# EQRM csv, and the decimals of the coordinates snapped to a grid whose
+# spacing is not the inverse of an integer
+LOCATION_FIELDNAMES = [('lon', 'lat'), ('LONGITUDE', 'LATITUDE')]
+SNAP_DECIMALS = 10
+# Precision of the z1pt0 and z2pt5 attributes, the one of str(float)
+# in python 2, which the site models were first written with
+Z_FORMAT = '%.12g'
 
 
 def est_z1pt0_z2pt5_given_v30(vs30):
@@ -70,6 +122,64 @@ def est_z1pt0_z2pt5_given_v30(vs30):
     return z1pt0, z2pt5
 
 
+def est_z1pt0_z2pt5_given_v30s(vs30):
+    """
+    Same as est_z1pt0_z2pt5_given_v30, for an array of vs30 values.
+    """
+    vs30 = numpy.asarray(vs30, dtype=numpy.float64)
+
+    # CHIOU and YOUNGS (2014)
+    a = numpy.power(vs30, 4) + math.pow(571, 4)
+    b = math.pow(1360, 4) + math.pow(571, 4)
+    z1pt0 = numpy.exp(-7.15/4.0*numpy.log(a/b))  # in m
+
+    # KAKLAMANOS et al. (2011)
+    z2pt5 = 0.001 * (519 + 3.59 * z1pt0)  # m -> km
+
+    return z1pt0, z2pt5
+
+
+def z1pt0_z2pt5_strings(vs30_values):
+    """
+    Return the z1pt0 and z2pt5 of each of the vs30 strings, formatted
+    as site attributes with 12 significant digits (see Z_FORMAT). The
+    vs30 values are truncated to integers, so each distinct one is
+    computed and formatted once.
+    """
+    try:
+        vs30 = numpy.array(vs30_values, dtype=numpy.float64)
+    except ValueError:
+        raise RuntimeError('vs30 must be a number')
+    if not numpy.isfinite(vs30).all():
+        raise RuntimeError('vs30 must be a finite number')
+    values, inverse = numpy.unique(numpy.trunc(vs30), return_inverse=True)
+    z1pt0, z2pt5 = est_z1pt0_z2pt5_given_v30s(values)
+    return [numpy.array([_format_z(value) for value in z.tolist()],
+                        dtype=object)[inverse].tolist()
+            for z in (z1pt0, z2pt5)]
+
+
+def _format_z(value):
+    # as str formats a float in python 2, whatever the interpreter: 12
+    # significant digits, and a decimal point
+    text = Z_FORMAT % value
+    if not set(text).intersection('.en'):
+        text += '.0'
+    return text
+
+
+def _escape_attrib(value):
+    if _ATTRIB_SPECIALS.search(value) is None:
+        return value
+    return escape(value, _ATTRIB_ENTITIES)
+
+
+def _to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
 class SiteModelTxtReader(object):
 
     SITES_FIELDNAMES = ['lon', 'lat', 'vs30']
@@ -102,16 +212,99 @@ class SiteModelTxtReader(object):
         reader = DictReader(self.txtfile, fieldnames=self.SITES_FIELDNAMES)
         return [asset for asset in reader]
 
+    def readcolumns(self):
+        """
+        Read the sites as a dict of the stripped lon, lat and vs30
+        columns, as SiteModelWriter.serialize_columns takes them.
+        """
+        self._move_to_assets_definitions()
+        size = len(self.SITES_FIELDNAMES)
+        rows = []
+        for row in csv_reader(self.txtfile):
+            # csv gives blank lines as empty rows, they are not sites
+            if not row:
+                continue
+            if len(row) < size:
+                raise RuntimeError('a site is made of {} fields, not '
+                                   '{}'.format(size, len(row)))
+            rows.append([value.strip() for value in row[:size]])
+        columns = list(zip(*rows)) or [()] * size
+        return dict(zip(self.SITES_FIELDNAMES, columns))
+
 
 class SiteModelWriter(object):
 
     def serialize(self, filename, metadata, assets):
+        """
+        Write the site model of the site dicts to filename, see
+        serialize_columns.
+        """
+        columns = dict(
+            (field, [asset[field].strip() for asset in assets])
+            for field in SiteModelTxtReader.SITES_FIELDNAMES)
+        self.serialize_columns(filename, metadata, columns)
+
+    def serialize_columns(self, filename, metadata, columns):
+        """
+        Write the site model of the lon, lat and vs30 columns of
+        strings to filename, see serialize_blocks.
+        """
+        self.serialize_blocks(filename, metadata, [columns])
+
+    def serialize_blocks(self, filename, metadata, blocks):
+        """
+        Write the site model of an iterable of blocks of sites, each
+        one a dict of lon, lat and vs30 columns of strings, to filename,
+        keeping one block at a time in memory. The z1pt0 and z2pt5 of
+        the sites of a block are computed at once (see
+        z1pt0_z2pt5_strings) and the sites are written from a template.
+        """
+        blocks = (block for block in blocks if len(block['vs30']))
+        first_block = next(blocks, None)
+        if first_block is None:
+            # an empty siteModel is serialized as a self-closing
+            # element, leave it to lxml.
+            tree = etree.ElementTree(self._write_header(metadata))
+            with open_file(filename, 'w') as output_file:
+                tree.write(output_file, xml_declaration=True,
+                    encoding='utf-8', pretty_print=True)
+            return
+
+        head, tail = self._header_fragments(metadata)
+        with open_file(filename, 'wb') as output_file:
+            output_file.write(head)
+            for block in chain([first_block], blocks):
+                self._write_block(output_file, block)
+            output_file.write(tail)
+
+    def _write_block(self, output_file, columns):
+        z1pt0, z2pt5 = z1pt0_z2pt5_strings(columns['vs30'])
+        attributes = []
+        for field in SiteModelTxtReader.SITES_FIELDNAMES:
+            values = columns[field]
+            # escaping is only needed if some value of the column has
+            # a special character
+            if _ATTRIB_SPECIALS.search(''.join(values)) is not None:
+                values = [_escape_attrib(value) for value in values]
+            attributes.append(values)
+        sites = iter(zip(*(attributes + [z1pt0, z2pt5])))
+        for start in range(0, len(z1pt0), SITE_BLOCK_SIZE):
+            output_file.write(_to_bytes(''.join(
+                SITE % site for site in islice(sites, SITE_BLOCK_SIZE))))
+
+    def _header_fragments(self, metadata):
+        # The document around the sites is serialized by lxml, with a
+        # placeholder comment where the sites go, so that the
+        # declaration, namespaces and indentation are unchanged.
         root_elem = self._write_header(metadata)
-        root_elem = self._write_assets(root_elem, assets)
-        tree = etree.ElementTree(root_elem)
-        with open(filename, 'w') as output_file:
-            tree.write(output_file, xml_declaration=True,
-                encoding='utf-8', pretty_print=True)
+        root_elem.find('.//%s' % SITE_MODEL).append(
+            etree.Comment(SITES_PLACEHOLDER))
+        output = BytesIO()
+        etree.ElementTree(root_elem).write(output, xml_declaration=True,
+            encoding='utf-8', pretty_print=True)
+        placeholder = etree.tostring(etree.Comment(SITES_PLACEHOLDER))
+        head, tail = output.getvalue().split(placeholder)
+        return head.rstrip(), tail
 
     def _value_defined_for(self, dict, attrib):
         return dict[attrib] != NO_VALUE
@@ -136,30 +329,616 @@ class SiteModelWriter(object):
 
         return root_elem
 
-    def _write_assets(self, root_elem, assets):
-        exp_list = root_elem.find('.//%s' % SITE_MODEL)
-        for i, asset in enumerate(assets, start=1):
-            asset_elem = etree.SubElement(exp_list, SITE_LIST)
-            asset_elem.attrib[LON] = '%s' % asset['lon'].strip()
-            asset_elem.attrib[LAT] = '%s' % asset['lat'].strip()
-            asset_elem.attrib[VS30] = '%s' % asset['vs30'].strip()
-            asset_elem.attrib[VS30TYPE] = 'inferred'
-
-            vs30 = int(float(asset['vs30']))
-            try:
-                _dic = z1pt0_z2pt5_dic[vs30]
-            except KeyError:
-                z1pt0, z2pt5 = est_z1pt0_z2pt5_given_v30(vs30)
+
+class Vs30Grid(object):
+    """
+    A Vs30 raster of nrows x ncols cells of xdim x ydim degrees, the
+    upper left corner of the first one being at (xmin, ymax). Cells
+    equal to nodata (None if there is no such value) have no Vs30.
+    Subclasses read the rows with rows(start, stop, step), yielding
+    the index and the values of every step-th row from start to stop.
+    """
+
+    nodata = None
+
+    def window(self, bbox=None):
+        """
+        Return the slices of the rows and of the columns of the cells
+        whose centre is in bbox, as (west, south, east, north), or of
+        all the cells without bbox.
+        """
+        if bbox is None:
+            return slice(0, self.nrows), slice(0, self.ncols)
+        min_lon, min_lat, max_lon, max_lat = bbox
+        cols = self._clip(
+            int(math.ceil((min_lon - self.xmin) / self.xdim - 0.5)),
+            int(math.floor((max_lon - self.xmin) / self.xdim - 0.5)) + 1,
+            self.ncols)
+        rows = self._clip(
+            int(math.ceil((self.ymax - max_lat) / self.ydim - 0.5)),
+            int(math.floor((self.ymax - min_lat) / self.ydim - 0.5)) + 1,
+            self.nrows)
+        return rows, cols
+
+    @staticmethod
+    def _clip(start, stop, size):
+        start = min(max(start, 0), size)
+        return slice(start, min(max(stop, start), size))
+
+    def sample(self, lons, lats):
+        """
+        Return the Vs30 strings of the cells of the points of the lons
+        and lats arrays, None for the points out of the grid or on a
+        cell without Vs30. Only the rows from the first to the last one
+        with a point are read.
+        """
+        cols = numpy.floor((lons - self.xmin) / self.xdim).astype(int)
+        rows = numpy.floor((self.ymax - lats) / self.ydim).astype(int)
+        vs30 = numpy.empty(len(lons), dtype=object)
+        inside = numpy.flatnonzero((cols >= 0) & (cols < self.ncols) &
+                                   (rows >= 0) & (rows < self.nrows))
+        if not len(inside):
+            return vs30.tolist()
+        inside = inside[numpy.argsort(rows[inside], kind='mergesort')]
+        needed, starts = numpy.unique(rows[inside], return_index=True)
+        points = dict(zip(needed.tolist(),
+                          numpy.split(inside, starts[1:])))
+        for row, values in self.rows(needed[0], needed[-1] + 1):
+            if row in points:
+                row_points = points[row]
+                values = values[cols[row_points]]
+                valid = _has_vs30(values, self.nodata)
+                vs30[row_points[valid]] = _format_vs30(values[valid])
+        return vs30.tolist()
+
+
+class AsciiGrid(Vs30Grid):
+    """
+    ESRI ASCII grid, with one row of values per line. The file is read
+    a line at a time, and only the lines of the rows read are split.
+    The values are kept as they are written.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        header = {}
+        self.header_lines = 0
+        with open_file(filename) as grid_file:
+            for line in grid_file:
+                if not isinstance(line, str):
+                    line = line.decode('ascii')
+                fields = line.split()
+                if not fields or not fields[0][:1].isalpha():
+                    break
+                header[fields[0].lower()] = fields[1]
+                self.header_lines += 1
+        try:
+            self.nrows = int(header['nrows'])
+            self.ncols = int(header['ncols'])
+            self.xdim = self.ydim = float(header['cellsize'])
+            if 'xllcenter' in header:
+                self.xmin = float(header['xllcenter']) - self.xdim / 2
+                ymin = float(header['yllcenter']) - self.ydim / 2
             else:
-                z1pt0, z2pt5 = _dic['z1pt0'], _dic['z2pt5']
+                self.xmin = float(header['xllcorner'])
+                ymin = float(header['yllcorner'])
+        except (KeyError, ValueError):
+            raise RuntimeError('{} has not a valid ESRI ASCII grid '
+                               'header'.format(filename))
+        self.ymax = ymin + self.nrows * self.ydim
+        if 'nodata_value' in header:
+            self.nodata = float(header['nodata_value'])
 
-            asset_elem.attrib[Z1PT0] = '{}'.format(z1pt0)
-            asset_elem.attrib[Z2PT5] = '{}'.format(z2pt5)
-            asset_elem.attrib['backarc'] = 'false'
+    def rows(self, start, stop, step=1):
+        with open_file(self.filename) as grid_file:
+            lines = islice(grid_file, self.header_lines + start,
+                           self.header_lines + stop, step)
+            for row, line in zip(range(start, stop, step), lines):
+                if not isinstance(line, str):
+                    line = line.decode('ascii')
+                values = numpy.array(line.split())
+                if len(values) != self.ncols:
+                    raise RuntimeError('row {} of {} has {} values, not '
+                                       '{}'.format(row, self.filename,
+                                                   len(values), self.ncols))
+                yield row, values
 
-        return root_elem
 
-z1pt0_z2pt5_dic = create_z1pt0_z2pt5_dic()
+class BilGrid(Vs30Grid):
+    """
+    Single band ESRI BIL grid, described by the .hdr file next to it
+    and memory-mapped, so that only the rows read are loaded.
+    """
+
+    def __init__(self, filename):
+        header = {}
+        with open('{}.hdr'.format(os.path.splitext(filename)[0])) as hdr:
+            for line in hdr:
+                fields = line.split()
+                if len(fields) >= 2:
+                    header[fields[0].upper()] = fields[1]
+        try:
+            self.nrows = int(header['NROWS'])
+            self.ncols = int(header['NCOLS'])
+            self.xdim = float(header['XDIM'])
+            self.ydim = float(header['YDIM'])
+            # ULXMAP and ULYMAP are the centre of the upper left cell
+            self.xmin = float(header['ULXMAP']) - self.xdim / 2
+            self.ymax = float(header['ULYMAP']) + self.ydim / 2
+            nbits = int(header.get('NBITS', 8))
+            pixel_type = header.get('PIXELTYPE', 'UNSIGNEDINT').upper()
+            kind = BIL_PIXEL_TYPES[pixel_type]
+            skip = int(header.get('SKIPBYTES', 0))
+        except (KeyError, ValueError):
+            raise RuntimeError('{} has not a valid BIL header'.format(
+                filename))
+        if int(header.get('NBANDS', 1)) != 1:
+            raise RuntimeError('{} has more than one band'.format(filename))
+        if nbits not in (8, 16, 32, 64) or (kind == 'f' and nbits < 32):
+            raise RuntimeError('{} has {}-bit {} cells, only 8 to 64-bit '
+                               'integers and 32 or 64-bit floats are '
+                               'supported'.format(filename, nbits,
+                                                  pixel_type))
+        if 'NODATA' in header:
+            self.nodata = float(header['NODATA'])
+        byteorder = '>' if header.get('BYTEORDER', 'I').upper() in (
+            'M', 'MSBFIRST') else '<'
+        self.data = numpy.memmap(
+            filename, dtype='{}{}{}'.format(byteorder, kind, nbits // 8),
+            mode='r', offset=skip, shape=(self.nrows, self.ncols))
+
+    def rows(self, start, stop, step=1):
+        for row in range(start, stop, step):
+            yield row, self.data[row]
+
+
+class GeoTiff(Vs30Grid):
+    """
+    Single band GeoTIFF, striped or tiled, uncompressed or deflated,
+    read a strip or a row of tiles at a time. The georeference comes
+    from its ModelPixelScale and ModelTiepoint tags, the nodata value
+    from the GDAL_NODATA tag.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as tiff:
+            self.order = {b'II': '<', b'MM': '>'}.get(tiff.read(2))
+            if self.order is None or self._unpack(tiff, 'H') != (42,):
+                raise RuntimeError('{} is not a TIFF file (BigTIFF files '
+                                   'are not supported)'.format(filename))
+            tiff.seek(self._unpack(tiff, 'I')[0])
+            tags = self._read_ifd(tiff)
+
+        self.ncols = tags[IMAGE_WIDTH][0]
+        self.nrows = tags[IMAGE_LENGTH][0]
+        kind = TIFF_SAMPLE_FORMATS.get(tags.get(SAMPLE_FORMAT, (1,))[0])
+        self.compression = tags.get(COMPRESSION, (1,))[0]
+        self.predictor = tags.get(PREDICTOR, (1,))[0]
+        if (tags.get(SAMPLES_PER_PIXEL, (1,))[0] != 1 or kind is None or
+                self.compression not in TIFF_COMPRESSIONS or
+                self.predictor not in (1, 2) or
+                (self.predictor == 2 and kind == 'f')):
+            raise RuntimeError('{} must be a single band GeoTIFF, '
+                               'uncompressed or deflated'.format(filename))
+        self.dtype = numpy.dtype('{}{}{}'.format(
+            self.order, kind, tags[BITS_PER_SAMPLE][0] // 8))
+
+        if TILE_OFFSETS in tags:
+            self.block_width = tags[TILE_WIDTH][0]
+            self.block_rows = tags[TILE_LENGTH][0]
+            self.offsets = tags[TILE_OFFSETS]
+            self.byte_counts = tags[TILE_BYTE_COUNTS]
+        else:
+            self.block_width = self.ncols
+            self.block_rows = min(tags.get(ROWS_PER_STRIP, (self.nrows,))[0],
+                                  self.nrows)
+            self.offsets = tags[STRIP_OFFSETS]
+            self.byte_counts = tags[STRIP_BYTE_COUNTS]
+        self.blocks_across = -(-self.ncols // self.block_width)
+
+        try:
+            xdim, ydim = tags[MODEL_PIXEL_SCALE][:2]
+            i, j, _, x, y, _ = tags[MODEL_TIEPOINT][:6]
+        except KeyError:
+            raise RuntimeError('{} is not georeferenced'.format(filename))
+        self.xdim, self.ydim = xdim, ydim
+        self.xmin = x - i * xdim
+        self.ymax = y + j * ydim
+        if self._pixel_is_point(tags.get(GEO_KEY_DIRECTORY, ())):
+            # the tiepoint is the centre of the cell, not its corner
+            self.xmin -= xdim / 2
+            self.ymax += ydim / 2
+        if GDAL_NODATA in tags:
+            self.nodata = float(tags[GDAL_NODATA])
+
+    def _unpack(self, tiff, fmt):
+        size = struct.calcsize(fmt)
+        return struct.unpack(self.order + fmt, tiff.read(size))
+
+    def _read_ifd(self, tiff):
+        tags = {}
+        for _ in range(self._unpack(tiff, 'H')[0]):
+            tag, field_type, count, value = self._unpack(tiff, 'HHI4s')
+            if field_type not in TIFF_TYPES:
+                continue
+            fmt, size = TIFF_TYPES[field_type]
+            if size * count > 4:
+                position = tiff.tell()
+                tiff.seek(struct.unpack(self.order + 'I', value)[0])
+                value = tiff.read(size * count)
+                tiff.seek(position)
+            if field_type == 2:
+                tags[tag] = value[:count].rstrip(b'\0').decode('ascii')
+            else:
+                tags[tag] = struct.unpack(self.order + fmt * count,
+                                          value[:size * count])
+        return tags
+
+    @staticmethod
+    def _pixel_is_point(geo_keys):
+        # keys of 4 shorts (id, location, count, value) after a header
+        # of 4 shorts
+        for key in range(4, len(geo_keys) - 3, 4):
+            if geo_keys[key] == GT_RASTER_TYPE:
+                return geo_keys[key + 3] == RASTER_PIXEL_IS_POINT
+        return False
+
+    def _read_block(self, tiff, index, rows):
+        tiff.seek(self.offsets[index])
+        data = tiff.read(self.byte_counts[index])
+        if self.compression != 1:
+            data = zlib.decompress(data)
+        block = numpy.frombuffer(data, dtype=self.dtype)[
+            :rows * self.block_width].reshape(rows, self.block_width)
+        if self.predictor == 2:
+            # horizontal differencing, undone in the integer dtype
+            block = numpy.cumsum(block, axis=1, dtype=self.dtype)
+        return block
+
+    def _read_band(self, tiff, band):
+        # the rows of a strip, or of a row of tiles
+        if self.blocks_across == 1 and self.block_width == self.ncols:
+            rows = min(self.block_rows, self.nrows - band * self.block_rows)
+            return self._read_block(tiff, band, rows)
+        first = band * self.blocks_across
+        return numpy.hstack([
+            self._read_block(tiff, index, self.block_rows)
+            for index in range(first, first + self.blocks_across)
+        ])[:, :self.ncols]
+
+    def rows(self, start, stop, step=1):
+        band = None
+        with open(self.filename, 'rb') as tiff:
+            for row in range(start, stop, step):
+                if row // self.block_rows != band:
+                    band = row // self.block_rows
+                    values = self._read_band(tiff, band)
+                yield row, values[row - band * self.block_rows]
+
+
+def _has_vs30(values, nodata):
+    # the cells with a positive Vs30
+    vs30 = values.astype(numpy.float64)
+    with numpy.errstate(invalid='ignore'):
+        valid = numpy.isfinite(vs30) & (vs30 > 0)
+    if nodata is not None:
+        valid &= vs30 != nodata
+    return valid
+
+
+def _format_vs30(values):
+    if values.dtype.kind in 'SU':
+        # ASCII grid values are kept as written
+        return [str(value) for value in values.tolist()]
+    return ['{}'.format(value) for value in values.tolist()]
+
+
+def open_raster(filename):
+    """
+    Return the Vs30Grid of an ESRI ASCII grid (.asc, compressed or
+    not), of an ESRI BIL grid (.bil) or of a GeoTIFF (.tif, .tiff).
+    """
+    name = filename
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    extension = os.path.splitext(name)[1].lower()
+    if extension == '.asc':
+        return AsciiGrid(filename)
+    if extension == '.bil' and not is_compressed(filename):
+        return BilGrid(filename)
+    if extension in ('.tif', '.tiff') and not is_compressed(filename):
+        return GeoTiff(filename)
+    raise RuntimeError('{} is not an ESRI ASCII grid (.asc), an ESRI BIL '
+                       'grid (.bil) or a GeoTIFF (.tif)'.format(filename))
+
+
+def raster_sites(grid, bbox=None, step=1):
+    """
+    Yield the sites of the cells of a Vs30Grid whose centre is in bbox
+    (see Vs30Grid.window), taking every step-th row and column, as
+    blocks of lon, lat and vs30 columns of strings, a row at a time.
+    Cells without a positive Vs30 are left out.
+    """
+    rows, cols = grid.window(bbox)
+    cols = slice(cols.start, cols.stop, step)
+    lons = numpy.array([
+        '{}'.format(lon) for lon in (grid.xmin + grid.xdim * (
+            numpy.arange(cols.start, cols.stop, step) + 0.5)).tolist()],
+        dtype=object)
+    for row, values in grid.rows(rows.start, rows.stop, step):
+        values = values[cols]
+        valid = _has_vs30(values, grid.nodata)
+        if not valid.any():
+            continue
+        vs30 = _format_vs30(values[valid])
+        lat = '{}'.format(grid.ymax - grid.ydim * (row + 0.5))
+        yield dict(lon=lons[valid].tolist(), lat=[lat] * len(vs30),
+                   vs30=vs30)
+
+
+class Vs30Points(object):
+    """
+    Vs30 measured or estimated at scattered points, as in a site model
+    csv, with a grid index of the points to find the nearest one to a
+    site. Distances are in degrees.
+    """
+
+    POINTS_PER_CELL = 4
+
+    def __init__(self, lons, lats, vs30):
+        self.lons = numpy.array(lons, dtype=numpy.float64)
+        self.lats = numpy.array(lats, dtype=numpy.float64)
+        self.vs30 = list(vs30)
+        if not len(self.vs30):
+            raise RuntimeError('there are no Vs30 points')
+        self.xmin, self.ymin = self.lons.min(), self.lats.min()
+        width = self.lons.max() - self.xmin
+        height = self.lats.max() - self.ymin
+        # points along a line still get a few per cell
+        span = max(width, height)
+        self.cellsize = math.sqrt(
+            max(width * height, span * span / len(self.vs30)) *
+            self.POINTS_PER_CELL / len(self.vs30)) or 1.0
+        cols = self._cols(self.lons)
+        rows = self._rows(self.lats)
+        self.ncols = int(cols.max()) + 1
+        self.nrows = int(rows.max()) + 1
+        cells = self._cells(cols, rows)
+        # the points of cell i are order[cell_starts[i]:cell_starts[i + 1]]
+        self.order = numpy.argsort(cells, kind='mergesort')
+        self.cell_starts = numpy.searchsorted(
+            cells[self.order], numpy.arange(self.ncols * self.nrows + 1))
+
+    @classmethod
+    def from_csv(cls, filename):
+        with open_file(filename) as points_file:
+            columns = SiteModelTxtReader(points_file).readcolumns()
+        try:
+            return cls(numpy.array(columns['lon'], dtype=numpy.float64),
+                       numpy.array(columns['lat'], dtype=numpy.float64),
+                       columns['vs30'])
+        except ValueError:
+            raise RuntimeError('lon and lat of the Vs30 points of {} must '
+                               'be numbers'.format(filename))
+
+    def _cols(self, lons):
+        return numpy.floor((lons - self.xmin) / self.cellsize).astype(int)
+
+    def _rows(self, lats):
+        return numpy.floor((lats - self.ymin) / self.cellsize).astype(int)
+
+    def _cells(self, cols, rows):
+        return rows.astype(numpy.int64) * self.ncols + cols
+
+    def nearest(self, lons, lats):
+        """
+        Return the index of the nearest point to each of the sites of
+        the lons and lats arrays, the first one of the points at the
+        same distance.
+
+        The cells around the sites are searched a ring at a time, for
+        all the sites at once. After ring r every point closer than r
+        cells has been seen, so a site is done when its nearest point
+        so far is closer than that (one just as close could tie with a
+        first point of the next rings). The sites out of the index
+        start from its nearest cell, which is no farther from the
+        points.
+        """
+        cols = numpy.clip(self._cols(lons), 0, self.ncols - 1)
+        rows = numpy.clip(self._rows(lats), 0, self.nrows - 1)
+        best = numpy.zeros(len(lons), dtype=int) - 1
+        distance = numpy.zeros(len(lons)) + numpy.inf
+        todo = numpy.arange(len(lons))
+        # beyond this ring every cell of the index has been searched
+        last_ring = max(self.ncols, self.nrows)
+        ring = 0
+        while len(todo):
+            for dcol, drow in self._ring(ring):
+                col = cols[todo] + dcol
+                row = rows[todo] + drow
+                inside = ((col >= 0) & (col < self.ncols) &
+                          (row >= 0) & (row < self.nrows))
+                sites = todo[inside]
+                cells = self._cells(col[inside], row[inside])
+                starts = self.cell_starts[cells]
+                counts = self.cell_starts[cells + 1] - starts
+                # the k-th point of the cell of every site at once
+                for k in range(counts.max() if len(counts) else 0):
+                    has_k = counts > k
+                    points = self.order[starts[has_k] + k]
+                    k_sites = sites[has_k]
+                    k_distance = numpy.hypot(
+                        self.lons[points] - lons[k_sites],
+                        self.lats[points] - lats[k_sites])
+                    closer = ((k_distance < distance[k_sites]) |
+                              ((k_distance == distance[k_sites]) &
+                               (points < best[k_sites])))
+                    distance[k_sites[closer]] = k_distance[closer]
+                    best[k_sites[closer]] = points[closer]
+            if ring >= last_ring:
+                break
+            todo = todo[distance[todo] >= ring * self.cellsize]
+            ring += 1
+        return best
+
+    def _ring(self, ring):
+        # the offsets of the cells at a distance of ring cells, leaving
+        # out the ones that are off the index from any of its cells
+        if ring == 0:
+            return [(0, 0)]
+        col_reach = min(ring, self.ncols - 1)
+        row_reach = min(ring, self.nrows - 1)
+        dcols = range(-col_reach, col_reach + 1)
+        drows = range(-row_reach, row_reach + 1)
+        return ([(dcol, drow) for dcol in dcols for drow in (-ring, ring)
+                 if abs(drow) < self.nrows] +
+                [(dcol, drow) for dcol in (-ring, ring) for drow in drows
+                 if abs(dcol) < self.ncols and abs(drow) < ring])
+
+    def sample(self, lons, lats):
+        """
+        Return the Vs30 strings of the nearest points to the sites of
+        the lons and lats arrays.
+        """
+        return [self.vs30[index] for index in self.nearest(lons, lats)]
+
+
+def open_vs30(filename):
+    """
+    Return the Vs30Grid of a raster (see open_raster) or the Vs30Points
+    of a site model csv (lon, lat and vs30 columns).
+    """
+    name = filename
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    if os.path.splitext(name)[1].lower() in RASTER_EXTENSIONS:
+        return open_raster(filename)
+    return Vs30Points.from_csv(filename)
+
+
+def iter_exposure_locations(filename, chunk_size=SITE_BLOCK_SIZE):
+    """
+    Yield the lon and lat arrays of the assets of an exposure,
+    chunk_size at a time. The exposure is either NRML (.xml, 0.3 or
+    0.5) or a csv whose assets follow a header with lon and lat (the
+    exposure txt) or LONGITUDE and LATITUDE (the EQRM csv) columns.
+    Compressed files are read the same way.
+    """
+    name = filename
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    if os.path.splitext(name)[1].lower() == '.xml':
+        locations = _iter_nrml_locations(filename)
+    else:
+        locations = _iter_csv_locations(filename)
+    while True:
+        chunk = list(islice(locations, chunk_size))
+        if not chunk:
+            return
+        try:
+            lons, lats = numpy.array(chunk, dtype=numpy.float64).T
+        except ValueError:
+            raise RuntimeError('lon and lat of the assets of {} must be '
+                               'numbers'.format(filename))
+        yield lons, lats
+
+
+def _iter_nrml_locations(filename):
+    # the location of the NRML 0.5 assets, the gml:pos of the 0.3 ones
+    with open_file(filename, 'rb') as nrml_file:
+        for _, elem in etree.iterparse(nrml_file):
+            localname = etree.QName(elem).localname
+            if localname == 'location':
+                yield elem.get('lon'), elem.get('lat')
+            elif localname == 'pos':
+                lon_lat = elem.text.split()
+                yield lon_lat[0], lon_lat[1]
+            elif localname in ('asset', 'assetDefinition'):
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+
+def _iter_csv_locations(filename):
+    with open_file(filename) as csv_file:
+        lines = (line.decode('utf-8') if not isinstance(line, str)
+                 else line for line in csv_file)
+        for line in lines:
+            fields = [field.strip() for field in line.split(',')]
+            for lon, lat in LOCATION_FIELDNAMES:
+                if lon in fields and lat in fields:
+                    break
+            else:
+                continue
+            lon, lat = fields.index(lon), fields.index(lat)
+            size = max(lon, lat)
+            for row in csv_reader(lines):
+                # csv gives blank lines as empty rows, they are not assets
+                if not row:
+                    continue
+                if len(row) <= size:
+                    raise RuntimeError('{}: an asset has {} fields'.format(
+                        filename, len(row)))
+                yield row[lon], row[lat]
+            return
+    raise RuntimeError('{} has no lon and lat header'.format(filename))
+
+
+def exposure_sites(filename, vs30_source, spacing=None):
+    """
+    Return the unique sites of the assets of an exposure (see
+    iter_exposure_locations), as lon, lat and vs30 columns of strings,
+    and the number of assets.
+
+    With spacing the locations are first snapped to the nodes of a
+    grid of that many degrees. The sites are deduplicated through a
+    hash index of their coordinates, a chunk of assets at a time, in
+    the order in which they first appear. The Vs30 of each site comes
+    from vs30_source, a Vs30Grid or Vs30Points (see open_vs30).
+    """
+    index = {}
+    assets = 0
+    for lons, lats in iter_exposure_locations(filename):
+        assets += len(lons)
+        if spacing is not None:
+            lons = numpy.round(lons / spacing)
+            lats = numpy.round(lats / spacing)
+        keys, first = numpy.unique(lons + 1j * lats, return_index=True)
+        for key in keys[numpy.argsort(first)].tolist():
+            if key not in index:
+                index[key] = len(index)
+    keys = numpy.zeros(len(index), dtype=numpy.complex128)
+    keys[list(index.values())] = list(index)
+    lons, lats = keys.real, keys.imag
+    if spacing is not None:
+        lons, lats = snap_nodes(lons, spacing), snap_nodes(lats, spacing)
+
+    vs30 = vs30_source.sample(lons, lats)
+    missing = [i for i, value in enumerate(vs30) if value is None]
+    if missing:
+        raise RuntimeError('{} sites have no Vs30, e.g. {} {}'.format(
+            len(missing), lons[missing[0]], lats[missing[0]]))
+    # the nodes of a fine grid can need more than the 12 digits of
+    # str, they are written in full
+    format_coordinate = '{}'.format if spacing is None else repr
+    columns = dict(lon=[format_coordinate(lon) for lon in lons.tolist()],
+                   lat=[format_coordinate(lat) for lat in lats.tolist()],
+                   vs30=vs30)
+    return columns, assets
+
+
+def snap_nodes(nodes, spacing):
+    """
+    Return the coordinates of the nodes, numbered along an axis of a
+    grid of spacing degrees, without float noise: 1157 / 10 rather
+    than 1157 * 0.1 when spacing is the inverse of an integer, else
+    rounded to SNAP_DECIMALS.
+    """
+    inverse = round(1 / spacing)
+    if inverse >= 1 and abs(inverse * spacing - 1) < 1e-12:
+        return nodes / inverse
+    return numpy.round(nodes * spacing, SNAP_DECIMALS)
 
 
 def cmd_parser():
@@ -172,6 +951,49 @@ def cmd_parser():
         dest='input_file',
         help='Specify the input file (i.e. site_model.csv)')
 
+    parser.add_argument('-r', '--raster-file',
+        nargs=1,
+        metavar='raster file',
+        dest='raster_file',
+        help='Take the sites from the cells of a Vs30 raster instead: '
+             'an ESRI ASCII grid (.asc), an ESRI BIL grid (.bil, with its '
+             '.hdr) or a GeoTIFF (.tif)')
+
+    parser.add_argument('--bbox',
+        type=bbox_argument,
+        metavar='WEST/SOUTH/EAST/NORTH',
+        dest='bbox',
+        help='Only take the raster cells whose centre is in the box')
+
+    parser.add_argument('--step',
+        type=int,
+        metavar='N',
+        dest='step',
+        help='Only take every N-th row and column of the raster '
+             '(default: 1)')
+
+    parser.add_argument('-e', '--exposure-file',
+        nargs=1,
+        metavar='exposure file',
+        dest='exposure_file',
+        help='Take the sites from the asset locations of an exposure '
+             'instead: NRML (.xml), an exposure txt or an EQRM csv')
+
+    parser.add_argument('--vs30-file',
+        nargs=1,
+        metavar='vs30 file',
+        dest='vs30_file',
+        help='Vs30 of the exposure sites: a raster, as for '
+             '--raster-file, or a csv of lon, lat and vs30 points, of '
+             'which the nearest one is taken')
+
+    parser.add_argument('--snap',
+        type=float,
+        metavar='DEG',
+        dest='snap',
+        help='Snap the exposure locations to a grid of DEG degrees '
+             'before removing the duplicate sites')
+
     return parser
 
 def main():
@@ -182,17 +1004,49 @@ def main():
         parser.print_help()
     else:
         args = parser.parse_args()
-        with open(args.input_file[0]) as input_file:
-            reader = SiteModelTxtReader(input_file)
-            metadata = reader.metadata
-            assets = reader.readassets()
+        inputs = [args.input_file, args.raster_file, args.exposure_file]
+        if len([name for name in inputs if name is not None]) != 1:
+            parser.error('one of --input-file, --raster-file and '
+                         '--exposure-file is needed')
+        if args.raster_file is None and (args.bbox is not None or
+                                         args.step is not None):
+            parser.error('--bbox and --step go with --raster-file')
+        if args.step is not None and args.step < 1:
+            parser.error('--step must be at least 1')
+        if (args.exposure_file is None) != (args.vs30_file is None):
+            parser.error('--vs30-file goes with --exposure-file')
+        if args.snap is not None and args.snap <= 0:
+            parser.error('--snap must be positive')
+        input_file = [name for name in inputs if name is not None][0][0]
 
-        _path = os.path.abspath(os.path.dirname(args.input_file[0]))
-        _list = os.path.basename(args.input_file[0]).split('.')
-        output_file = os.path.join(_path, '{}.xml'.format(_list[0]))
+        _path = os.path.abspath(os.path.dirname(input_file))
+        _list = os.path.basename(input_file).split('.')
+        # a compressed input gives an output compressed the same way
+        _compression = ''
+        if is_compressed(input_file):
+            _compression = os.path.splitext(input_file)[1]
+        _suffix = '_site_model' if args.exposure_file is not None else ''
+        output_file = os.path.join(_path, '{}{}.xml{}'.format(
+            _list[0], _suffix, _compression))
 
         writer = SiteModelWriter()
-        writer.serialize(output_file, metadata, assets)
+        if args.exposure_file is not None:
+            vs30_source = open_vs30(args.vs30_file[0])
+            columns, assets = exposure_sites(input_file, vs30_source,
+                                             spacing=args.snap)
+            writer.serialize_columns(output_file, {}, columns)
+            print('{} assets, {} sites'.format(assets, len(columns['lon'])))
+            return
+        if args.raster_file is not None:
+            grid = open_raster(input_file)
+            writer.serialize_blocks(output_file, {}, raster_sites(
+                grid, bbox=args.bbox, step=args.step or 1))
+            return
+        with open_file(input_file) as input_file:
+            reader = SiteModelTxtReader(input_file)
+            metadata = reader.metadata
+            columns = reader.readcolumns()
+        writer.serialize_columns(output_file, metadata, columns)
 
 if __name__ == '__main__':
     main()
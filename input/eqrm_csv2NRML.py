@@ -17,11 +17,30 @@ exposureTxt2NRML creates an exposure input file format (NRML)
 taking an exposure portfolio in a fixed txt format.
 """
 
+import glob
+import hashlib
+import os
 import sys
+import pickle
+import re
+import shutil
+import tempfile
+import time
 import argparse
+from multiprocessing import Pool
 from lxml import etree
-from csv import DictReader
-import pandas as pd
+from csv import (DictReader, Error as CsvError, reader as csv_reader,
+                 writer as csv_writer)
+from io import BytesIO
+from itertools import chain, islice, repeat
+from xml.sax.saxutils import escape
+import numpy
+
+# the shared nrml_utils package is kept next to the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'nrml_utils'))
+from nrml_utils.compression import is_compressed, open_file
+from nrml_utils.parquet import ParquetExport
 
 NRML_NS = 'http://openquake.org/xmlns/nrml/0.5'
 #GML_NS = 'http://www.opengis.net/gml'
@@ -68,10 +87,88 @@ OCCUPANTS = '%soccupancies' % NRML
 
 NO_VALUE = ''
 
-BLDG_MAPPING = pd.read_csv(
-    '/Users/hyeuk/Projects/scenario_Guildford/input/bldg_class_mapping.csv')
-BLDG_MAPPING.set_index('NEXIS_CONS', inplace=True)
-BLDG_MAPPING = BLDG_MAPPING['MAPPING2'].to_dict()
+# Streaming serialization: the assets, written from templates at the
+# indentation lxml gives them, and the csv sidecar
+ASSETS_PLACEHOLDER = 'assets'
+ASSET_START = ('\n      <asset id="%s" taxonomy="%s" area="%s" number="1">'
+               '\n        <location lon="%s" lat="%s"/>')
+COSTS = ('\n        <costs>'
+         '\n          <cost type="structural" value="%s"/>'
+         '\n        </costs>')
+NO_COSTS = '\n        <costs/>'
+OCCUPANCIES = ('\n        <occupancies>'
+               '\n          <occupancy occupants="%s" period="night"/>'
+               '\n        </occupancies>')
+ASSET_END = '\n      </asset>'
+# start of a serialized asset, up to its taxonomy
+ASSET_PREFIX = ASSET_START[:ASSET_START.index(' area=')]
+ASSET_TAG = b'\n      <asset '
+INDEX_BLOCK_SIZE = 16 * 1024 * 1024
+# Rows of a previous input are compared by the SHA-1 of their fields
+ROW_SEPARATOR = '\0'
+ROW_DIGEST = 'S20'
+# Inputs of a batch taken from a directory
+BATCH_INPUT = re.compile(r'\.csv(\.gz|\.bz2|\.xz)?$', re.IGNORECASE)
+_ATTRIB_ENTITIES = {'"': '&quot;', '\t': '&#9;', '\n': '&#10;', '\r': '&#13;'}
+_ATTRIB_SPECIALS = re.compile('[&<>"\t\n\r]')
+ASSET_CHUNK_SIZE = 10000
+# EQRM fields parsed as numbers by the chunked reader, once per chunk
+EQRM_FLOAT_FIELDNAMES = ['LATITUDE', 'LONGITUDE', 'CONTENTS_COST_DENSITY',
+                         'BUILDING_COST_DENSITY', 'FLOOR_AREA', 'POPULATION',
+                         'SURVEY_FACTOR']
+# key of the text of all the fields in a chunk, as read: the NRML and
+# the sidecar repeat the numbers as they are written in the input
+TEXT = 'text'
+SIDECAR_FIELDNAMES = ['LID', 'SA1_CODE', 'SUBURB', 'REPL_COST', 'POPULATION']
+# Columns of the Parquet export and their Arrow types
+PARQUET_FIELDS = [
+    ('id', 'string'), ('taxonomy', 'string'), ('lon', 'float64'),
+    ('lat', 'float64'), ('area', 'float64'), ('cost_density', 'float64'),
+    ('repl_cost', 'float64'), ('occupants', 'float64'),
+    ('sa1_code', 'string'), ('suburb', 'string')]
+
+# Building class mapping csv columns
+MAPPING_CLASS = 'NEXIS_CONS'
+MAPPING_VALUE = 'MAPPING2'
+MAPPING_CACHE = '{}.pickle'
+
+
+def read_bldg_mapping(filename, cache=True):
+    """
+    Read the building class mapping csv into a dict of the MAPPING2
+    value of each NEXIS_CONS class. Unless cache is False, the dict is
+    pickled next to the csv and read from there until the csv changes.
+    """
+    stat = os.stat(filename)
+    cache_filename = MAPPING_CACHE.format(filename)
+    if cache:
+        try:
+            with open(cache_filename, 'rb') as cache_file:
+                size, mtime, mapping = pickle.load(cache_file)
+            if (size, mtime) == (stat.st_size, stat.st_mtime):
+                return mapping
+        except Exception:
+            # missing or unreadable, the csv is parsed again
+            pass
+
+    with open_file(filename) as mapping_file:
+        reader = DictReader(mapping_file)
+        if (MAPPING_CLASS not in reader.fieldnames or
+                MAPPING_VALUE not in reader.fieldnames):
+            raise RuntimeError('{} must have the {} and {} columns'.format(
+                filename, MAPPING_CLASS, MAPPING_VALUE))
+        mapping = dict((row[MAPPING_CLASS], row[MAPPING_VALUE])
+                       for row in reader)
+
+    if cache:
+        try:
+            with open(cache_filename, 'wb') as cache_file:
+                pickle.dump((stat.st_size, stat.st_mtime, mapping),
+                            cache_file, pickle.HIGHEST_PROTOCOL)
+        except (IOError, OSError):
+            # e.g. a read-only directory, the cache is only an optimization
+            pass
+    return mapping
 
 
 def convert_to_float(string):
@@ -103,6 +200,111 @@ def map_vul_class(ga_class, year_built, BLDG_MAPPING):
     return '{}_{}'.format(ga_class, tail)
 
 
+def sidecar_name(filename):
+    """
+    Return the name of the csv written next to the exposure filename,
+    e.g. exposure.xml.csv for exposure.xml or exposure.xml.gz: the
+    sidecar is never compressed.
+    """
+    if is_compressed(filename):
+        filename = os.path.splitext(filename)[0]
+    return '{}.csv'.format(filename)
+
+
+def _escape_attrib(value):
+    if _ATTRIB_SPECIALS.search(value) is None:
+        return value
+    return escape(value, _ATTRIB_ENTITIES)
+
+
+def _to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
+
+def to_float_array(values, fieldname, first_asset=1):
+    """
+    Parse a column of strings into a float64 array in one go, with NaN
+    where the value is empty. The values are the ones of the assets
+    numbered from first_asset, which the errors refer to.
+    """
+    values = numpy.asarray(values)
+    if not len(values):
+        return numpy.zeros(0)
+    try:
+        return numpy.where(values == NO_VALUE, 'nan', values).astype(
+            numpy.float64)
+    except ValueError:
+        for asset, value in enumerate(values.tolist(), first_asset):
+            try:
+                float(value or 'nan')
+            except ValueError:
+                raise RuntimeError('asset {}: {} must be a number, not '
+                                   '{!r}'.format(asset, fieldname, value))
+        raise
+
+
+def check_bldg_classes(ga_classes, BLDG_MAPPING):
+    """
+    Raise a RuntimeError naming all the classes missing from BLDG_MAPPING.
+    """
+    unmapped = sorted(set(ga_classes).difference(BLDG_MAPPING))
+    if unmapped:
+        raise RuntimeError('{} building classes are not in the mapping: '
+                           '{}'.format(len(unmapped), ', '.join(unmapped)))
+
+
+def map_vul_classes(ga_classes, years_built, BLDG_MAPPING):
+    """
+    Same as map_vul_class, for all the assets at once. Each year range
+    is parsed once and each taxonomy string is built once per (class,
+    year bucket) pair. All the classes missing from BLDG_MAPPING are
+    reported together.
+    """
+    if not len(ga_classes):
+        return []
+    class_values, class_index = numpy.unique(
+        numpy.asarray(ga_classes), return_inverse=True)
+    year_values, year_index = numpy.unique(
+        numpy.asarray(years_built), return_inverse=True)
+    check_bldg_classes(class_values.tolist(), BLDG_MAPPING)
+
+    # an unknown year is before any cut-off year, as in map_vul_class
+    years = numpy.array([convert_to_float(year_built)
+                         for year_built in year_values.tolist()], dtype=float)
+    years[numpy.isnan(years)] = -numpy.inf
+    cutoffs = []
+    taxonomies = []
+    for ga_class in class_values.tolist():
+        if BLDG_MAPPING[ga_class][:2] in ['UR', 'W1', 'W2']:
+            cutoffs.append(1946)
+            tails = ['Pre1945', 'Post1945']
+        else:
+            cutoffs.append(1996)
+            tails = ['Pre1996', 'Post1996']
+        taxonomies.append(['{}_{}'.format(ga_class, tail) for tail in tails])
+
+    post = years[year_index] > numpy.array(cutoffs)[class_index]
+    return numpy.array(taxonomies)[class_index, post.astype(int)].tolist()
+
+
+def row_digests(chunk):
+    """
+    Return the LIDs of a chunk of columns as a string array and the
+    SHA-1 digests of its rows, as read, as an S20 array. The digests
+    are those of the fields joined by NUL, which a csv field cannot
+    hold, so they stay comparable between runs and interpreters.
+    """
+    text = chunk[TEXT]
+    columns = [text[fieldname]
+               for fieldname in ExposureTxtReader.EQRM_FIELDNAMES]
+    rows = [hashlib.sha1(_to_bytes(ROW_SEPARATOR.join(row))).digest()
+            for row in zip(*columns)]
+    return (numpy.array(text['LID'], dtype=str),
+            numpy.array(rows, dtype=ROW_DIGEST))
+
+
 class ExposureTxtReader(object):
 
     # ASSETS_FIELDNAMES = ['lon', 'lat', 'taxonomy', 'stco', 'number' ,'area',
@@ -128,11 +330,13 @@ class ExposureTxtReader(object):
 
     def _move_to_assets_definitions(self):
         self._move_to_beginning_file_input()
+        fieldnames = set(self.EQRM_FIELDNAMES)
         while True:
-            line = set([field.strip() for field in (
-                self.txtfile.readline()).split(',')])
-            if set(self.EQRM_FIELDNAMES).issubset(line):
-                break;
+            line = self.txtfile.readline()
+            if not line:
+                raise RuntimeError('the EQRM header line is missing')
+            if fieldnames.issubset(field.strip() for field in line.split(',')):
+                break
 
     @property
     def metadata(self):
@@ -148,20 +352,415 @@ class ExposureTxtReader(object):
         reader = DictReader(self.txtfile, fieldnames=self.EQRM_FIELDNAMES)
         return [asset for asset in reader]
 
+    def iter_chunks(self, chunk_size=ASSET_CHUNK_SIZE):
+        """
+        Yield the assets chunk_size at a time as dicts of columns: a
+        float64 array (NaN where empty) for each of EQRM_FLOAT_FIELDNAMES
+        and a tuple of strings for the other fields, plus the tuples of
+        strings of all the fields under TEXT. The file must stay open
+        until the iteration is over.
+
+        The rows are split by the csv module, which honours quoted
+        fields, and each numeric column is then parsed by one
+        to_float_array call: the text is kept anyway for the NRML and
+        the row digests, and numpy.genfromtxt neither handles the
+        quotes nor is faster.
+        """
+        self._move_to_assets_definitions()
+        rows = csv_reader(self.txtfile)
+        first_asset = 1
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                return
+            # csv gives blank lines as empty rows, they are not assets
+            chunk = [row for row in chunk if row]
+            if not chunk:
+                continue
+            for row in chunk:
+                if len(row) != len(self.EQRM_FIELDNAMES):
+                    raise RuntimeError('an asset is made of {} fields, not '
+                                       '{}'.format(len(self.EQRM_FIELDNAMES),
+                                                   len(row)))
+            yield self.to_columns(zip(*chunk), first_asset)
+            first_asset += len(chunk)
+
+    @classmethod
+    def to_columns(cls, columns, first_asset=1):
+        """
+        Turn the columns of strings of a chunk, in EQRM_FIELDNAMES
+        order, into the typed columns iter_chunks yields. first_asset
+        is the number of the first asset of the chunk in the input.
+        """
+        text = dict(zip(cls.EQRM_FIELDNAMES, columns))
+        chunk = dict(text)
+        chunk[TEXT] = text
+        for fieldname in EQRM_FLOAT_FIELDNAMES:
+            chunk[fieldname] = to_float_array(text[fieldname], fieldname,
+                                              first_asset)
+        return chunk
+
+
+class PreviousConversion(object):
+    """
+    The input csv and the NRML output of an earlier run, whose
+    serialized assets are reused for the LIDs whose row did not change.
+    The n-th asset of the output is the one of the n-th row of the
+    input, as serialize_chunks writes them.
+
+    Only the LIDs and the digests of the input rows and the byte
+    ranges of the output assets are kept in memory. The assets of the new input are
+    counted as they are matched, see added, removed, changed and
+    unchanged.
+    """
+
+    def __init__(self, input_filename, output_filename):
+        lids = [numpy.array([], dtype=str)]
+        rows = [numpy.array([], dtype=ROW_DIGEST)]
+        with open_file(input_filename) as input_file:
+            for chunk in ExposureTxtReader(None, input_file).iter_chunks():
+                chunk_lids, chunk_rows = row_digests(chunk)
+                lids.append(chunk_lids)
+                rows.append(chunk_rows)
+        lids = numpy.concatenate(lids)
+        self.order = numpy.argsort(lids, kind='mergesort')
+        self.lids = lids[self.order]
+        self.rows = numpy.concatenate(rows)[self.order]
+        # the assets of a repeated LID cannot be told apart
+        repeated = self.lids[1:] == self.lids[:-1]
+        self.reusable = numpy.ones(len(self.lids), dtype=bool)
+        self.reusable[1:] &= ~repeated
+        self.reusable[:-1] &= ~repeated
+        self.seen = numpy.zeros(len(self.lids), dtype=bool)
+
+        self.output_filename = output_filename
+        self.offsets, self.lengths = self._index_assets(output_filename)
+        if len(self.offsets) != len(self.lids):
+            raise RuntimeError('{} has {} assets, but {} has {} rows'.format(
+                output_filename, len(self.offsets), input_filename,
+                len(self.lids)))
+        self.output_file = open_file(output_filename, 'rb')
+        self.assets = self.found = self.unchanged = 0
+
+    @staticmethod
+    def _index_assets(filename):
+        # The assets are written one after the other, each one starting
+        # with the line break of the line before, so that one ends
+        # where the next one starts.
+        start = None
+        ends = []
+        end_tag = _to_bytes(ASSET_END)
+        position = 0
+        tail = b''
+        with open_file(filename, 'rb') as output_file:
+            for block in iter(lambda: output_file.read(INDEX_BLOCK_SIZE),
+                              b''):
+                data = tail + block
+                offset = position - len(tail)
+                if start is None and ASSET_TAG in data:
+                    start = offset + data.index(ASSET_TAG)
+                ends.extend(offset + match.end()
+                            for match in re.finditer(re.escape(end_tag),
+                                                     data))
+                position += len(block)
+                tail = data[-len(end_tag) + 1:]
+        ends = numpy.array(ends, dtype=numpy.int64)
+        offsets = numpy.concatenate([[start or 0], ends[:-1]]).astype(
+            numpy.int64)[:len(ends)]
+        return offsets, ends - offsets
+
+    @property
+    def added(self):
+        return self.assets - self.found
+
+    @property
+    def changed(self):
+        return self.found - self.unchanged
+
+    @property
+    def removed(self):
+        return int(len(self.seen) - self.seen.sum())
+
+    def match(self, chunk):
+        """
+        Return, for each row of chunk, the position in the previous
+        output of the asset to reuse, or -1 if it must be serialized.
+        """
+        lids, rows = row_digests(chunk)
+        self.assets += len(lids)
+        if not len(self.lids):
+            return numpy.zeros(len(lids), dtype=int) - 1
+        index = numpy.minimum(numpy.searchsorted(self.lids, lids),
+                              len(self.lids) - 1)
+        found = self.lids[index] == lids
+        self.found += int(found.sum())
+        self.seen[index[found]] = True
+        same = found & (self.rows[index] == rows) & self.reusable[index]
+        return numpy.where(same, self.order[index], -1)
+
+    def fragments(self, positions, lids, taxonomies):
+        """
+        Return the serialized assets at positions in the previous
+        output, as returned by match. The list has None where the
+        position is -1 or where the asset is not the one of the lid and
+        taxonomy of the row (e.g. because the building mapping changed
+        since). Runs of consecutive assets are read at once.
+        """
+        fragments = [None] * len(positions)
+        rows = numpy.flatnonzero(positions >= 0)
+        if not len(rows):
+            return fragments
+        wanted = positions[rows]
+        breaks = numpy.flatnonzero(numpy.diff(wanted) != 1) + 1
+        for run in numpy.split(numpy.arange(len(rows)), breaks):
+            first = wanted[run[0]]
+            last = wanted[run[-1]]
+            start = self.offsets[first]
+            self.output_file.seek(start)
+            data = self.output_file.read(
+                self.offsets[last] + self.lengths[last] - start)
+            for row, position in zip(rows[run].tolist(),
+                                     wanted[run].tolist()):
+                offset = self.offsets[position] - start
+                fragment = data[offset:offset + self.lengths[position]]
+                if fragment.startswith(_to_bytes(ASSET_PREFIX % (
+                        _escape_attrib(lids[row]),
+                        _escape_attrib(taxonomies[row])))):
+                    fragments[row] = fragment
+                    self.unchanged += 1
+        return fragments
+
+    def close(self):
+        self.output_file.close()
+
 
 class ExposureWriter(object):
 
+    def __init__(self, bldg_mapping):
+        self.bldg_mapping = bldg_mapping
+
     def serialize(self, filename, metadata, assets):
+        """
+        Write the exposure of the asset dicts to filename, see
+        serialize_chunks.
+        """
+        chunks = (
+            ExposureTxtReader.to_columns(
+                [[asset[fieldname] for asset in chunk]
+                 for fieldname in ExposureTxtReader.EQRM_FIELDNAMES])
+            for chunk in self._chunks(assets))
+        self.serialize_chunks(filename, metadata, chunks)
+
+    def serialize_chunks(self, filename, metadata, chunks,
+                         parquet_filename=None, previous=None):
+        """
+        Write the exposure to filename and the SA1_CODE, SUBURB,
+        REPL_COST and POPULATION of each asset to its sidecar_name, in a
+        single pass over the chunks of columns (see
+        ExposureTxtReader.iter_chunks). Taxonomies and costs are
+        computed a chunk at a time.
+
+        With parquet_filename the PARQUET_FIELDS of the assets are also
+        written there, a row group per chunk; filename can then be None
+        to write the Parquet file only.
+
+        With a PreviousConversion the assets whose row did not change
+        are copied from its output instead of being serialized again.
+
+        The building classes missing from the mapping are collected
+        over the whole input and reported together, after which the
+        partial outputs are removed. Return the number of assets.
+        """
+        if previous is not None and (filename is None or os.path.abspath(
+                filename) == os.path.abspath(previous.output_filename)):
+            raise RuntimeError('an incremental conversion needs an output '
+                               'other than the previous one')
+        chunks = iter(chunks)
+        first_chunk = next(chunks, None)
+        parquet = None
+        if parquet_filename is not None:
+            parquet = ParquetExport(parquet_filename, PARQUET_FIELDS)
+        if first_chunk is None:
+            if parquet is not None:
+                parquet.close()
+            if filename is not None:
+                self._write_empty(filename, metadata)
+            return 0
+
+        output_file = sidecar_file = sidecar = None
+        try:
+            if filename is not None:
+                head, tail = self._header_fragments(metadata)
+                output_file = open_file(filename, 'wb')
+                sidecar_file = open(sidecar_name(filename), 'w')
+                sidecar = csv_writer(sidecar_file, lineterminator='\n')
+                sidecar.writerow(SIDECAR_FIELDNAMES)
+                output_file.write(head)
+            assets, unmapped = self.write_chunks(
+                output_file, sidecar, chain([first_chunk], chunks),
+                parquet, previous)
+            if output_file is not None:
+                output_file.write(tail)
+        finally:
+            for output in (output_file, sidecar_file, parquet):
+                if output is not None:
+                    output.close()
+        if unmapped:
+            if filename is not None:
+                os.remove(filename)
+                os.remove(sidecar_name(filename))
+            if parquet_filename is not None:
+                os.remove(parquet_filename)
+            check_bldg_classes(unmapped, self.bldg_mapping)
+        return assets
+
+    def write_chunks(self, output_file, sidecar, chunks, parquet=None,
+                     previous=None):
+        """
+        Write the serialized assets of the chunks to output_file and
+        their rows to the sidecar csv writer (both can be None). Once a
+        building class is missing from the mapping nothing more is
+        written, but the other missing classes are still collected.
+        Return the number of assets and the set of missing classes.
+        """
+        assets = 0
+        unmapped = set()
+        for chunk in chunks:
+            assets += len(chunk['LID'])
+            unmapped.update(set(chunk['GA_STRUCTURE_CLASSIFICATION'])
+                            .difference(self.bldg_mapping))
+            if not unmapped:
+                self._write_chunk(output_file, sidecar, parquet, chunk,
+                                  previous)
+        return assets, unmapped
+
+    def merge(self, filename, metadata, parts):
+        """
+        Write the exposure to filename and its sidecar (see sidecar_name)
+        from the (assets, sidecar rows) files written by write_chunks
+        for each part of the input, in order.
+        """
+        if all(os.path.getsize(part) == 0 for part, _ in parts):
+            self._write_empty(filename, metadata)
+            return
+        head, tail = self._header_fragments(metadata)
+        with open_file(filename, 'wb') as output_file, \
+                open(sidecar_name(filename), 'w') as sidecar_file:
+            csv_writer(sidecar_file, lineterminator='\n').writerow(
+                SIDECAR_FIELDNAMES)
+            output_file.write(head)
+            for part, sidecar_part in parts:
+                with open(part, 'rb') as part_file:
+                    shutil.copyfileobj(part_file, output_file)
+                with open(sidecar_part) as sidecar_part_file:
+                    shutil.copyfileobj(sidecar_part_file, sidecar_file)
+            output_file.write(tail)
+
+    def _write_empty(self, filename, metadata):
+        with open(sidecar_name(filename), 'w') as sidecar_file:
+            csv_writer(sidecar_file, lineterminator='\n').writerow(
+                SIDECAR_FIELDNAMES)
+        # an empty assets element is serialized as a self-closing
+        # element, leave it to lxml.
         root_elem = self._write_header(metadata)
-        root_elem = self._write_assets(root_elem, assets)
-        tree = etree.ElementTree(root_elem)
-        with open(filename, 'w') as output_file:
-            tree.write(output_file, xml_declaration=True,
-                encoding='utf-8', pretty_print=True)
-        # to_csv
-        _df = pd.DataFrame(assets)
-        _df.set_index('LID', inplace=True)
-        _df[['SA1_CODE', 'SUBURB', 'REPL_COST', 'POPULATION']].to_csv('{}.csv'.format(filename))
+        exp_mod_elem = root_elem.find('.//%s' % EXPOSURE_MODEL)
+        etree.SubElement(exp_mod_elem, 'assets')
+        with open_file(filename, 'w') as output_file:
+            etree.ElementTree(root_elem).write(output_file,
+                xml_declaration=True, encoding='utf-8',
+                pretty_print=True)
+
+    def _write_chunk(self, output_file, sidecar, parquet, chunk,
+                     previous=None):
+        taxonomies = map_vul_classes(chunk['GA_STRUCTURE_CLASSIFICATION'],
+                                     chunk['YEAR_BUILT'], self.bldg_mapping)
+        building_cost = chunk['BUILDING_COST_DENSITY']
+        has_cost = ~numpy.isnan(building_cost)
+        cost_density = building_cost + chunk['CONTENTS_COST_DENSITY']
+        area = chunk['FLOOR_AREA']
+        repl_cost = cost_density * area
+        if numpy.isnan(repl_cost[has_cost]).any():
+            raise RuntimeError('CONTENTS_COST_DENSITY and FLOOR_AREA must '
+                               'be defined with BUILDING_COST_DENSITY')
+
+        if parquet is not None:
+            lon, lat = chunk['LONGITUDE'], chunk['LATITUDE']
+            if numpy.isnan(lon).any() or numpy.isnan(lat).any():
+                raise RuntimeError('lon and lat are compulsory values for an '
+                                   'asset')
+            parquet.write(dict(
+                id=chunk['LID'], taxonomy=taxonomies, lon=lon, lat=lat,
+                area=area, cost_density=cost_density, repl_cost=repl_cost,
+                occupants=chunk['POPULATION'], sa1_code=chunk['SA1_CODE'],
+                suburb=chunk['SUBURB']))
+        if output_file is None:
+            return
+
+        cost_density = [
+            '{}'.format(value) if defined else None
+            for value, defined in zip(cost_density.tolist(), has_cost)]
+        repl_cost = [
+            repr(value) if defined else NO_VALUE
+            for value, defined in zip(repl_cost.tolist(), has_cost)]
+
+        fragments = repeat(None)
+        if previous is not None:
+            fragments = previous.fragments(previous.match(chunk),
+                                           chunk['LID'], taxonomies)
+        text = chunk[TEXT]
+        for row, fragment in zip(zip(
+                chunk['LID'], taxonomies, text['FLOOR_AREA'],
+                text['LONGITUDE'], text['LATITUDE'], cost_density,
+                text['POPULATION']), fragments):
+            if fragment is None:
+                fragment = self._asset_fragment(*row)
+            output_file.write(fragment)
+        sidecar.writerows(zip(chunk['LID'], chunk['SA1_CODE'],
+                              chunk['SUBURB'], repl_cost,
+                              text['POPULATION']))
+
+    def _chunks(self, assets):
+        assets = iter(assets)
+        while True:
+            chunk = list(islice(assets, ASSET_CHUNK_SIZE))
+            if not chunk:
+                return
+            yield chunk
+
+    def _header_fragments(self, metadata):
+        # The document around the assets is serialized by lxml, with a
+        # placeholder comment where the assets go, so that the
+        # declaration, namespaces and indentation are unchanged.
+        root_elem = self._write_header(metadata)
+        exp_mod_elem = root_elem.find('.//%s' % EXPOSURE_MODEL)
+        exp_list = etree.SubElement(exp_mod_elem, 'assets')
+        exp_list.append(etree.Comment(ASSETS_PLACEHOLDER))
+        output = BytesIO()
+        etree.ElementTree(root_elem).write(output, xml_declaration=True,
+            encoding='utf-8', pretty_print=True)
+        placeholder = etree.tostring(etree.Comment(ASSETS_PLACEHOLDER))
+        head, tail = output.getvalue().split(placeholder)
+        return head.rstrip(), tail
+
+    def _asset_fragment(self, lid, taxonomy, area, lon, lat, cost_density,
+                        population):
+        """
+        Return the serialized asset, encoded in utf-8. cost_density is
+        None when the building cost is not defined.
+        """
+        if lon == NO_VALUE or lat == NO_VALUE:
+            raise RuntimeError('lon and lat are compulsory values for an '
+                               'asset')
+        parts = [ASSET_START % tuple(_escape_attrib(value) for value in (
+            lid, taxonomy, area, lon, lat))]
+        if cost_density is not None:
+            parts.append(COSTS % _escape_attrib(cost_density))
+        else:
+            parts.append(NO_COSTS)
+        if population != NO_VALUE:
+            parts.append(OCCUPANCIES % _escape_attrib(population))
+        parts.append(ASSET_END)
+        return _to_bytes(''.join(parts))
 
     def _value_defined_for(self, dict, attrib):
         return dict[attrib] != NO_VALUE
@@ -211,48 +810,136 @@ class ExposureWriter(object):
 
         return root_elem
 
-    def _write_assets(self, root_elem, assets):
-        exp_mod_elem = root_elem.find('.//%s' % EXPOSURE_MODEL)
-        exp_list = etree.SubElement(exp_mod_elem, 'assets')
-        for asset in assets:
-            asset_elem = etree.SubElement(exp_list, ASSET)
-            asset_elem.attrib['id'] = asset['LID']
-            asset_elem.attrib['taxonomy'] = map_vul_class(
-                asset['GA_STRUCTURE_CLASSIFICATION'],
-                asset['YEAR_BUILT'], BLDG_MAPPING)
-            # asset['TAXONOMY'] = asset_elem.attrib['taxonomy']
-            asset_elem.attrib['area'] = asset['FLOOR_AREA']
-            asset_elem.attrib['number'] = '1'
-
-            if (self._value_defined_for(asset, 'LONGITUDE') and
-                self._value_defined_for(asset, 'LATITUDE')):
-
-                site_elem = etree.SubElement(
-                    asset_elem, 'location')
-                site_elem.attrib['lon'] = asset['LONGITUDE']
-                site_elem.attrib['lat'] = asset['LATITUDE']
+
+# State shared by the conversions of a batch, set once per worker
+_batch = {}
+
+
+def _init_batch(bldg_mapping, metadata):
+    _batch['writer'] = ExposureWriter(bldg_mapping)
+    _batch['metadata'] = metadata
+
+
+def batch_inputs(pattern, exclude=()):
+    """
+    Return the sorted EQRM csv files matching the glob pattern or, if
+    pattern is a directory, the .csv files in it (compressed or not).
+    The excluded files and the csv sidecars of NRML outputs are left
+    out.
+    """
+    if os.path.isdir(pattern):
+        filenames = [os.path.join(pattern, name)
+                     for name in os.listdir(pattern)
+                     if BATCH_INPUT.search(name)]
+    else:
+        filenames = glob.glob(pattern)
+    exclude = set(os.path.abspath(filename) for filename in exclude)
+    return sorted(
+        filename for filename in filenames
+        if os.path.abspath(filename) not in exclude and
+        not BATCH_INPUT.sub('', filename).lower().endswith('.xml'))
+
+
+def batch_output(input_filename, output_dir):
+    """
+    Return the name of the exposure of input_filename in output_dir,
+    e.g. output_dir/LGA_55110.xml for LGA_55110.csv.gz.
+    """
+    name = BATCH_INPUT.sub('', os.path.basename(input_filename))
+    return os.path.join(output_dir, '{}.xml'.format(name))
+
+
+def _convert_input(args):
+    # convert an input of a batch to its own exposure or, when merging,
+    # to the assets and sidecar rows of its part of the exposure
+    input_filename, output_filename, part = args
+    started_at = time.time()
+    writer = _batch['writer']
+    try:
+        with open_file(input_filename) as input_file:
+            chunks = ExposureTxtReader(None, input_file).iter_chunks()
+            if not part:
+                assets = writer.serialize_chunks(
+                    output_filename, _batch['metadata'], chunks)
             else:
-                raise RuntimeError('lon and lat are compulsory values for an '
-                                   'asset')
+                with open(output_filename, 'wb') as output_file, \
+                        open(sidecar_name(output_filename), 'w') as \
+                        sidecar_file:
+                    assets, unmapped = writer.write_chunks(
+                        output_file,
+                        csv_writer(sidecar_file, lineterminator='\n'),
+                        chunks)
+                check_bldg_classes(unmapped, writer.bldg_mapping)
+    except (RuntimeError, EnvironmentError, CsvError) as e:
+        # reported in the summary, the other inputs go on
+        return input_filename, 0, time.time() - started_at, str(e)
+    return input_filename, assets, time.time() - started_at, None
 
-            cost_elem = etree.SubElement(asset_elem, 'costs')
-            if self._value_defined_for(asset, 'BUILDING_COST_DENSITY'):
-                stco_elem = etree.SubElement(cost_elem, 'cost')
-                stco_elem.attrib['type'] = 'structural'
-                repl_cost = (float(asset['BUILDING_COST_DENSITY']) +
-                             float(asset['CONTENTS_COST_DENSITY']))
-                stco_elem.attrib['value'] = '{}'.format(repl_cost)
-                asset['REPL_COST'] = repl_cost * float(asset['FLOOR_AREA'])
-
-            if self._value_defined_for(asset, 'POPULATION'):
-                occupants_elem = etree.SubElement(
-                    asset_elem, OCCUPANTS)
-                occupants_night_elem = etree.SubElement(
-                    occupants_elem, 'occupancy')
-                occupants_night_elem.attrib['occupants'] = asset['POPULATION']
-                occupants_night_elem.attrib['period'] = 'night'
 
-        return root_elem
+def convert_batch(input_filenames, metadata, bldg_mapping, output_dir='.',
+                  merged_filename=None, workers=1):
+    """
+    Convert EQRM csv files sharing the same metadata, each one to its
+    own exposure in output_dir (see batch_output) or, with
+    merged_filename, all of them to a single exposure with the assets
+    in the order of the inputs. The files are converted by a pool of
+    workers, each of which gets the building mapping once.
+
+    Return the (input, assets, seconds, error) of each input, error
+    being None for the inputs converted. The merged exposure is only
+    written if all the inputs were converted.
+    """
+    part_dir = None
+    if merged_filename is not None:
+        part_dir = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(merged_filename)))
+        outputs = [os.path.join(part_dir, '{}.part'.format(i))
+                   for i in range(len(input_filenames))]
+    else:
+        outputs = [batch_output(input_filename, output_dir)
+                   for input_filename in input_filenames]
+        if len(set(outputs)) < len(outputs):
+            raise RuntimeError('the inputs of a batch must have different '
+                               'names, unless they are merged')
+    tasks = [(input_filename, output, part_dir is not None)
+             for input_filename, output in zip(input_filenames, outputs)]
+    try:
+        if workers <= 1:
+            _init_batch(bldg_mapping, metadata)
+            results = [_convert_input(task) for task in tasks]
+        else:
+            pool = Pool(workers, _init_batch, (bldg_mapping, metadata))
+            try:
+                results = list(pool.imap(_convert_input, tasks))
+            finally:
+                pool.close()
+                pool.join()
+        if part_dir is not None and all(
+                error is None for _, _, _, error in results):
+            ExposureWriter(bldg_mapping).merge(
+                merged_filename, metadata,
+                [(output, sidecar_name(output)) for output in outputs])
+    finally:
+        if part_dir is not None:
+            shutil.rmtree(part_dir, ignore_errors=True)
+    return results
+
+
+def print_batch_summary(results, wall_time):
+    failed = [result for result in results if result[3] is not None]
+    for input_filename, _, _, error in failed:
+        print('{}: {}'.format(input_filename, error))
+    assets = sum(result[1] for result in results)
+    print('{} files converted, {} failed: {} assets in {:.1f}s '
+          '({:.0f} assets/s, {:.1f}s of conversion in the workers)'.format(
+              len(results) - len(failed), len(failed), assets, wall_time,
+              assets / max(wall_time, 1e-6),
+              sum(result[2] for result in results)))
+    if results:
+        input_filename, assets, seconds, _ = max(
+            results, key=lambda result: result[2])
+        print('slowest: {} ({} assets in {:.1f}s)'.format(
+            input_filename, assets, seconds))
 
 
 def cmd_parser():
@@ -278,12 +965,99 @@ def cmd_parser():
         default=['exposure_portfolio.xml'],
         help='Specify the output file (i.e. exposure_portfolio.xml)')
 
+    parser.add_argument('-b', '--bldg-mapping-file',
+        nargs=1,
+        metavar='building mapping file',
+        dest='bldg_mapping_file',
+        required=True,
+        help='csv mapping the NEXIS_CONS building classes to MAPPING2 '
+             '(i.e. bldg_class_mapping.csv)')
+
+    parser.add_argument('--no-mapping-cache',
+        action='store_false',
+        dest='mapping_cache',
+        help='Do not read or write the pickled building mapping kept '
+             'next to its csv')
+
+    parser.add_argument('-p', '--parquet-file',
+        nargs=1,
+        metavar='parquet file',
+        dest='parquet_file',
+        help='Also write the taxonomy, location, costs and occupancy of '
+             'the assets to a Parquet file (needs pyarrow)')
+
+    parser.add_argument('--parquet-only',
+        action='store_true',
+        dest='parquet_only',
+        help='Write the Parquet file instead of the NRML')
+
+    parser.add_argument('--previous-input',
+        nargs=1,
+        metavar='previous input file',
+        dest='previous_input',
+        help='Input file of an earlier conversion: the assets whose row '
+             'did not change are copied from --previous-output')
+
+    parser.add_argument('--previous-output',
+        nargs=1,
+        metavar='previous output file',
+        dest='previous_output',
+        help='Output file of the conversion of --previous-input')
+
+    parser.add_argument('--batch',
+        nargs=1,
+        metavar='directory or glob',
+        dest='batch',
+        help='Convert all the csv files in a directory, or matching a '
+             'glob (quoted), each one to its own exposure in '
+             '--output-dir, or to the single exposure --output-file '
+             'with --merge')
+
+    parser.add_argument('-d', '--output-dir',
+        nargs=1,
+        metavar='output directory',
+        dest='output_dir',
+        default=['.'],
+        help='Directory of the exposures of a batch (default: the '
+             'current directory)')
+
+    parser.add_argument('--merge',
+        action='store_true',
+        dest='merge',
+        help='Merge the exposures of a batch into --output-file')
+
+    parser.add_argument('-w', '--workers',
+        type=int,
+        metavar='N',
+        dest='workers',
+        default=1,
+        help='Convert the files of a batch with N processes (default: 1)')
+
     parser.add_argument('-v', '--version',
         action='version',
         version="%(prog)s 0.0.1")
 
     return parser
 
+
+def main_batch(args, bldg_mapping):
+    inputs = batch_inputs(args.batch[0], exclude=(args.bldg_mapping_file +
+                                                  args.metadata_file))
+    if not inputs:
+        raise RuntimeError('no csv file matches {}'.format(args.batch[0]))
+    with open_file(args.metadata_file[0]) as metadata_file:
+        metadata = ExposureTxtReader(metadata_file, None).metadata
+    if not os.path.isdir(args.output_dir[0]):
+        os.makedirs(args.output_dir[0])
+    started_at = time.time()
+    results = convert_batch(
+        inputs, metadata, bldg_mapping, output_dir=args.output_dir[0],
+        merged_filename=args.output_file[0] if args.merge else None,
+        workers=args.workers)
+    print_batch_summary(results, time.time() - started_at)
+    if any(error is not None for _, _, _, error in results):
+        sys.exit(1)
+
 def main():
 
     parser = cmd_parser()
@@ -291,14 +1065,41 @@ def main():
         parser.print_help()
     else:
         args = parser.parse_args()
-        with open(args.metadata_file[0]) as metadata_file, \
-                open(args.input_file[0]) as input_file:
-            reader = ExposureTxtReader(metadata_file, input_file)
-            metadata = reader.metadata
-            assets = reader.readassets()
-
-        writer = ExposureWriter()
-        writer.serialize(args.output_file[0], metadata, assets)
+        if args.parquet_only and args.parquet_file is None:
+            parser.error('--parquet-only needs a --parquet-file')
+        if (args.previous_input is None) != (args.previous_output is None):
+            parser.error('--previous-input and --previous-output go '
+                         'together')
+        if args.batch is not None and (args.parquet_file or
+                                       args.previous_input):
+            parser.error('--batch cannot be used with --parquet-file or '
+                         '--previous-input')
+        output_file = None if args.parquet_only else args.output_file[0]
+        parquet_file = args.parquet_file and args.parquet_file[0]
+        bldg_mapping = read_bldg_mapping(args.bldg_mapping_file[0],
+                                         cache=args.mapping_cache)
+        if args.batch is not None:
+            return main_batch(args, bldg_mapping)
+        writer = ExposureWriter(bldg_mapping)
+        previous = None
+        if args.previous_input is not None:
+            previous = PreviousConversion(args.previous_input[0],
+                                          args.previous_output[0])
+        try:
+            with open_file(args.metadata_file[0]) as metadata_file, \
+                    open_file(args.input_file[0]) as input_file:
+                reader = ExposureTxtReader(metadata_file, input_file)
+                writer.serialize_chunks(output_file, reader.metadata,
+                                        reader.iter_chunks(),
+                                        parquet_filename=parquet_file,
+                                        previous=previous)
+        finally:
+            if previous is not None:
+                previous.close()
+        if previous is not None:
+            print('{} assets added, {} removed, {} changed, {} '
+                  'unchanged'.format(previous.added, previous.removed,
+                                     previous.changed, previous.unchanged))
 
 if __name__ == '__main__':
     main()
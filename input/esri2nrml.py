@@ -18,14 +18,23 @@ Simple LandScan ESRI binary file to NRML converter
 for exposure population models. 
 """
 
-import struct
+import os
 import ConfigParser
 import argparse
 import sys
 import math
+import json
 import datetime
+import numpy
+from multiprocessing import Pool
+from xml.sax.saxutils import escape
 from lxml import etree
 
+# the shared nrml_utils package is kept next to the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'nrml_utils'))
+from nrml_utils.arguments import bbox_argument
+
 
 NRML_NS = "http://openquake.org/xmlns/nrml/0.3"
 GML_NS = "http://www.opengis.net/gml"
@@ -33,29 +42,139 @@ NSMAP = {None: NRML_NS, "gml": GML_NS}
 NRML = "{%s}" % NRML_NS
 GML = "{%s}" % GML_NS
 
+ASSETS_PLACEHOLDER = "assets"
+ASSET_BLOCK_SIZE = 10000
+ASSET = """
+      <assetDefinition gml:id="asset_%d">
+        <site>
+          <gml:Point srsName="epsg:4326">
+            <gml:pos>%s %s</gml:pos>
+          </gml:Point>
+        </site>
+        <number>%s</number>
+        <taxonomy>%s</taxonomy>
+      </assetDefinition>"""
+
+# Cell data types, as PIXELTYPE, NBITS and BYTEORDER of an ESRI .hdr
+# (pixeltype, nbits and byteorder of the data section of an .ini). Grids
+# without them are LandScan ones, two bytes signed integers, LSB.
+PIXEL_TYPES = {"SIGNEDINT": "i", "UNSIGNEDINT": "u", "FLOAT": "f"}
+BYTE_ORDERS = {"I": "<", "LSB": "<", "M": ">", "MSB": ">"}
+DEFAULT_PIXEL_TYPE = "SIGNEDINT"
+DEFAULT_NBITS = 16
+DEFAULT_BYTE_ORDER = "LSB"
+
+# about this many cells are read from the grid at a time
+BLOCK_CELLS = 4 * 1024 * 1024
+
+
+def _get(config, section, option, default=None):
+    if config.has_option(section, option):
+        return config.get(section, option)
+    return default
+
+
+def data_type(config):
+    """
+    Return the numpy dtype of the cells of the grid described by config.
+    """
+    pixel_type = _get(config, "data", "pixeltype", DEFAULT_PIXEL_TYPE)
+    nbits = _get(config, "data", "nbits", DEFAULT_NBITS)
+    byte_order = _get(config, "data", "byteorder", DEFAULT_BYTE_ORDER)
+
+    kind = PIXEL_TYPES.get(pixel_type.upper())
+    order = BYTE_ORDERS.get(byte_order.upper())
+    if kind is None or order is None or int(nbits) not in (8, 16, 32, 64):
+        raise RuntimeError("unsupported cells: %s %s bits %s" % (
+            pixel_type, nbits, byte_order))
+    if kind == "f" and int(nbits) < 32:
+        raise RuntimeError("unsupported cells: %s bits floats" % nbits)
+
+    return numpy.dtype("%s%s%d" % (order, kind, int(nbits) // 8))
+
+
+def read_binary_data(filename, config):
+    """
+    Memory-map the binary grid filename as a nrows x ncols array of the
+    data type given in config (see data_type). Nothing is read until the
+    cells are accessed.
+    """
+    nrows = config.getint("georeference", "nrows")
+    ncols = config.getint("georeference", "ncols")
+    offset = int(_get(config, "data", "skipbytes", 0))
+    dtype = data_type(config)
 
-def read_binary_data(filename):
-    results = []
-
-    with open(filename, "rb") as data:
-        # at the moment, we only support two bytes
-        # integer format.
-        bytes_read = data.read(2)
-        while bytes_read:
-            # at the moment, we only support LSB format.
-            results.append(struct.unpack("<h", bytes_read)[0])
-            bytes_read = data.read(2)
+    size = os.path.getsize(filename) - offset
+    if size != nrows * ncols * dtype.itemsize:
+        raise RuntimeError("%s has %s bytes of cells, %s x %s cells of %s "
+                           "bytes expected" % (filename, size, nrows, ncols,
+                                               dtype.itemsize))
 
-    return results
+    return numpy.memmap(filename, dtype=dtype, mode="r", offset=offset,
+                        shape=(nrows, ncols))
 
 
 def read_metadata(filename):
+    """
+    Read the georeference and data sections of the grid metadata, either
+    an .ini or the .hdr of an ESRI BIL grid.
+    """
+    if os.path.splitext(filename)[1].lower() == ".hdr":
+        return read_hdr(filename)
+
     config = ConfigParser.ConfigParser()
     config.read(filename)
 
     return config
 
 
+def read_hdr(filename):
+    """
+    Convert the .hdr of a one band ESRI BIL grid to the sections of an
+    .ini. ULXMAP and ULYMAP are the centre of the upper left cell.
+    """
+    header = {}
+    with open(filename) as hdr:
+        for line in hdr:
+            fields = line.split()
+            if len(fields) >= 2:
+                header[fields[0].upper()] = fields[1]
+
+    if int(header.get("NBANDS", 1)) != 1:
+        raise RuntimeError("%s: only one band grids are supported" %
+                           filename)
+    if header.get("LAYOUT", "BIL").upper() not in ("BIL", "BIP", "BSQ"):
+        raise RuntimeError("%s: unsupported layout %s" % (
+            filename, header["LAYOUT"]))
+
+    try:
+        nrows, ncols = int(header["NROWS"]), int(header["NCOLS"])
+        xdim, ydim = float(header["XDIM"]), float(header["YDIM"])
+        xmin = float(header["ULXMAP"]) - xdim / 2
+        ymax = float(header["ULYMAP"]) + ydim / 2
+    except KeyError as missing:
+        raise RuntimeError("%s has no %s" % (filename, missing))
+
+    config = ConfigParser.ConfigParser()
+    config.add_section("georeference")
+    config.set("georeference", "nrows", str(nrows))
+    config.set("georeference", "ncols", str(ncols))
+    config.set("georeference", "xmin", repr(xmin))
+    config.set("georeference", "ymin", repr(ymax - nrows * ydim))
+    config.set("georeference", "xmax", repr(xmin + ncols * xdim))
+    config.set("georeference", "ymax", repr(ymax))
+
+    config.add_section("data")
+    for option, key in [("nodatavalue", "NODATA"),
+                        ("pixeltype", "PIXELTYPE"), ("nbits", "NBITS"),
+                        ("byteorder", "BYTEORDER"),
+                        ("skipbytes", "SKIPBYTES")]:
+        if key in header:
+            config.set("data", option, header[key])
+
+    return config
+
+
 def cmd_parser():
     args_parser = argparse.ArgumentParser(prog="esri2nrml",
         usage="%(prog)s [options]")
@@ -66,47 +185,324 @@ def cmd_parser():
 
     args_parser.add_argument("-m", "--mdata",
         dest="mdata", nargs="?", required=True,
-        help="file containing the metadata (.ini)")
+        help="file containing the metadata (.ini or .hdr)")
 
     args_parser.add_argument("-t", "--taxonomy",
         dest="taxonomy", nargs="?", required=True,
         help="assets taxonomy")
 
+    args_parser.add_argument("--threshold",
+        dest="threshold", type=float, default=0,
+        help="skip the cells with a value not above this one "
+             "(default: 0, i.e. the empty cells)")
+
+    args_parser.add_argument("--bbox",
+        dest="bbox", type=bbox_argument,
+        metavar="WEST/SOUTH/EAST/NORTH",
+        help="only convert the cells whose centre is in the box")
+
+    args_parser.add_argument("--polygon",
+        dest="polygon",
+        help="only convert the cells whose centre is in the polygon of "
+             "this file (GeoJSON, or one lon lat vertex per line)")
+
+    args_parser.add_argument("--coarsen",
+        dest="coarsen", type=int, default=1, metavar="K",
+        help="aggregate the cells in blocks of K x K, summing their "
+             "values at their weighted centroid (default: 1)")
+
+    args_parser.add_argument("-o", "--output-file",
+        dest="output_file", default="exp_model.xml",
+        help="exposure file (default: exp_model.xml)")
+
+    args_parser.add_argument("--tiles",
+        dest="tiles", type=int, nargs=2, metavar=("NX", "NY"),
+        help="split the grid in NY rows of NX tiles, each one written "
+             "to its own exposure file, OUTPUT_ROW_COL.xml")
+
+    args_parser.add_argument("-w", "--workers",
+        dest="workers", type=int, default=1, metavar="N",
+        help="convert the tiles with N processes (default: 1)")
+
     return args_parser
 
 
-def asset_iterator(config, data):
+def read_georeference(config):
+    """
+    Return nrows, ncols, xmin, ymax and the width and height of the
+    cells of the grid described by config.
+    """
     nrows = config.getint("georeference", "nrows")
     ncols = config.getint("georeference", "ncols")
 
     xmin = config.getfloat("georeference", "xmin")
     ymin = config.getfloat("georeference", "ymin")
-    xmax = config.getfloat("georeference", "xmax") 
-    ymax = config.getfloat("georeference", "ymax") 
-
-    no_data = config.getfloat("data", "nodatavalue") 
+    xmax = config.getfloat("georeference", "xmax")
+    ymax = config.getfloat("georeference", "ymax")
 
     x_step = math.fabs((xmax - xmin) / ncols)
     y_step = math.fabs((ymax - ymin) / nrows)
 
-    assert nrows * ncols == len(data)
-
-    current_x = xmin + (x_step / 2)
-    current_y = ymax - (y_step / 2)
-
-    for counter, value in enumerate(data, start=1):
-        assert xmin <= current_x <= xmax
-        assert ymin <= current_y <= ymax
-        
-        yield (current_x, current_y,
-            value if value != no_data else 0)
-
-        current_x = current_x + x_step
-
-        # we are on the last column.
-        if counter % ncols == 0:
-            current_x = xmin + (x_step / 2)
-            current_y = current_y - y_step
+    return nrows, ncols, xmin, ymax, x_step, y_step
+
+
+def grid_window(config, bbox):
+    """
+    Return the slices of the rows and of the columns of the cells whose
+    centre is inside bbox (west, south, east, north).
+    """
+    nrows, ncols, xmin, ymax, x_step, y_step = read_georeference(config)
+    west, south, east, north = bbox
+
+    def _slice(low, high, size):
+        start = min(max(int(math.ceil(low - 0.5)), 0), size)
+        stop = min(max(int(math.floor(high - 0.5)) + 1, start), size)
+        return slice(start, stop)
+
+    rows = _slice((ymax - north) / y_step, (ymax - south) / y_step, nrows)
+    cols = _slice((west - xmin) / x_step, (east - xmin) / x_step, ncols)
+
+    return rows, cols
+
+
+def read_window(config, bbox=None, polygon=None):
+    """
+    Return the slices of the rows and of the columns of the window of
+    the grid around the cells in bbox and in the bounding box of
+    polygon, the whole grid without them.
+    """
+    nrows, ncols = read_georeference(config)[:2]
+
+    rows, cols = slice(0, nrows), slice(0, ncols)
+    for window in [bbox, polygon and polygon.bbox]:
+        if window:
+            window_rows, window_cols = grid_window(config, window)
+            rows = slice(max(rows.start, window_rows.start),
+                         min(rows.stop, window_rows.stop))
+            cols = slice(max(cols.start, window_cols.start),
+                         min(cols.stop, window_cols.stop))
+
+    return rows, cols
+
+
+def tile_windows(window, nx, ny, coarsen=1):
+    """
+    Split window in ny rows of nx tiles of about the same size, each
+    one a window. Tiles start on multiples of coarsen from the upper
+    left corner of window, so that they aggregate the cells as the
+    whole window does.
+    """
+    def _split(whole, parts):
+        size = max(0, whole.stop - whole.start)
+        blocks = -(-size // coarsen)
+        bounds = [whole.start + min(blocks * i // parts * coarsen, size)
+                  for i in range(parts + 1)]
+        return [slice(start, stop)
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    rows, cols = window
+    return [[(tile_rows, tile_cols) for tile_cols in _split(cols, nx)]
+            for tile_rows in _split(rows, ny)]
+
+
+def asset_blocks(config, data, threshold=0, bbox=None, polygon=None,
+                 coarsen=1, window=None):
+    """
+    Yield the lons, lats and numbers arrays of the cells of the grid
+    with a value above threshold, a block of rows at a time. The nodata
+    cells are left out, and every cell is located at its centre.
+
+    With a bbox and/or a polygon (see Polygon) only the cells whose
+    centre is inside are kept, and only the window of the grid around
+    them is read.
+
+    With coarsen K the cells are aggregated in blocks of K x K (from
+    the upper left corner of the window): the number of a block is the
+    sum of its cells, located at their weighted centroid, and threshold
+    applies to that sum.
+
+    window, the rows and columns slices of a part of the window of bbox
+    and polygon (see read_window and tile_windows), only converts that
+    part.
+    """
+    nrows, ncols, xmin, ymax, x_step, y_step = read_georeference(config)
+
+    no_data = _get(config, "data", "nodatavalue")
+    no_data = float(no_data) if no_data is not None else None
+
+    assert data.shape == (nrows, ncols)
+
+    if window is None:
+        window = read_window(config, bbox, polygon)
+    rows, cols = window
+
+    lons = xmin + (numpy.arange(cols.start, cols.stop) + 0.5) * x_step
+    # blocks of whole rows of aggregated cells
+    block_rows = BLOCK_CELLS // max(1, cols.stop - cols.start)
+    block_rows = max(1, block_rows // coarsen) * coarsen
+
+    for start in range(rows.start, rows.stop, block_rows):
+        # only the bytes of the window are read from the grid
+        stop = min(start + block_rows, rows.stop)
+        block = numpy.asarray(data[start:stop, cols])
+        lats = ymax - (numpy.arange(start, stop) + 0.5) * y_step
+
+        # NaN cells of float grids are never above threshold
+        with numpy.errstate(invalid="ignore"):
+            valid = block > (threshold if coarsen == 1 else 0)
+        if no_data is not None:
+            valid &= block != no_data
+
+        cell_rows, cell_cols = numpy.nonzero(valid)
+        if polygon is not None:
+            outside = ~polygon.contains(lons[cell_cols], lats[cell_rows])
+            valid[cell_rows[outside], cell_cols[outside]] = False
+            cell_rows = cell_rows[~outside]
+            cell_cols = cell_cols[~outside]
+        if not len(cell_rows):
+            continue
+
+        if coarsen == 1:
+            yield (lons[cell_cols], lats[cell_rows],
+                   block[cell_rows, cell_cols])
+        else:
+            block_lons, block_lats, numbers = coarsen_block(
+                block, valid, lons, lats, coarsen)
+            above = numbers > threshold
+            if above.any():
+                yield block_lons[above], block_lats[above], numbers[above]
+
+
+def coarsen_block(block, valid, lons, lats, k):
+    """
+    Aggregate the valid cells of block, whose centres are at lons and
+    lats, in k x k cells. Return the lons and lats of the weighted
+    centroids and the sums of the aggregated cells with any valid one.
+    """
+    # integer grids are summed exactly
+    if block.dtype.kind in "iu":
+        weights = numpy.where(valid, block, 0).astype(numpy.int64)
+    else:
+        weights = numpy.where(valid, block, 0).astype(numpy.float64)
+
+    # pad to whole aggregated cells, with cells weighting nothing
+    nrows = -(-block.shape[0] // k) * k
+    ncols = -(-block.shape[1] // k) * k
+    padded = numpy.zeros((nrows, ncols), dtype=weights.dtype)
+    padded[:block.shape[0], :block.shape[1]] = weights
+    has_cells = numpy.zeros((nrows, ncols), dtype=bool)
+    has_cells[:block.shape[0], :block.shape[1]] = valid
+    lons = numpy.resize(lons, ncols)
+    lats = numpy.resize(lats, nrows)
+
+    # the sums over the k rows (axis 1) and the k columns (axis 3)
+    cells = padded.reshape(nrows // k, k, ncols // k, k)
+    col_sums = cells.sum(axis=1)
+    row_sums = cells.sum(axis=3)
+    numbers = col_sums.sum(axis=2)
+    has_cells = has_cells.reshape(nrows // k, k, ncols // k, k).any(
+        axis=3).any(axis=1)
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        centroid_lons = (col_sums * lons.reshape(ncols // k, k)).sum(
+            axis=2) / numbers
+        centroid_lats = (row_sums * lats.reshape(nrows // k, k, 1)).sum(
+            axis=1) / numbers
+
+    return (centroid_lons[has_cells], centroid_lats[has_cells],
+            numbers[has_cells])
+
+
+def asset_iterator(config, data, threshold=0, bbox=None, polygon=None,
+                   coarsen=1):
+    for lons, lats, numbers in asset_blocks(config, data, threshold,
+                                            bbox, polygon, coarsen):
+        for asset_data in zip(lons.tolist(), lats.tolist(),
+                              numbers.tolist()):
+            yield asset_data
+
+
+class Polygon(object):
+    """
+    Polygon mask made of one or more rings of (lon, lat) vertices. A
+    point is inside when it is inside an odd number of rings, so that
+    holes and multipolygons work as well.
+    """
+
+    def __init__(self, rings):
+        self.rings = [numpy.array(ring, dtype=numpy.float64)
+                      for ring in rings if len(ring) >= 3]
+        if not self.rings:
+            raise RuntimeError("the polygon has no ring of 3 vertices")
+
+        vertices = numpy.concatenate(self.rings)
+        self.bbox = (vertices[:, 0].min(), vertices[:, 1].min(),
+                     vertices[:, 0].max(), vertices[:, 1].max())
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Read a GeoJSON (.json or .geojson) Polygon or MultiPolygon,
+        possibly in a Feature or a FeatureCollection, or a text file of
+        one lon lat vertex per line, separated by spaces or commas.
+        """
+        if os.path.splitext(filename)[1].lower() in (".json", ".geojson"):
+            with open(filename) as geojson:
+                return cls(_geojson_rings(json.load(geojson)))
+
+        ring = []
+        with open(filename) as vertices:
+            for line in vertices:
+                fields = line.replace(",", " ").split()
+                if not fields or fields[0].startswith("#"):
+                    continue
+                try:
+                    ring.append((float(fields[0]), float(fields[1])))
+                except (ValueError, IndexError):
+                    raise RuntimeError("%s: invalid vertex %r" % (
+                        filename, line.strip()))
+        return cls([ring])
+
+    def contains(self, lons, lats):
+        """
+        Return the boolean array of the points of the lons and lats
+        arrays inside the polygon (even-odd rule).
+
+        The points are sorted by lat, so that every edge is only tested
+        against the points within its lat range.
+        """
+        order = numpy.argsort(lats, kind="mergesort")
+        sorted_lats = lats[order]
+        crossings = numpy.zeros(len(lats), dtype=bool)
+
+        for ring in self.rings:
+            x0, y0 = ring[:, 0], ring[:, 1]
+            x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+            # the points with y0 <= lat < y1 or y1 <= lat < y0
+            starts = numpy.searchsorted(sorted_lats, numpy.minimum(y0, y1))
+            stops = numpy.searchsorted(sorted_lats, numpy.maximum(y0, y1))
+            for edge in numpy.flatnonzero(stops > starts):
+                points = order[starts[edge]:stops[edge]]
+                x_cross = x0[edge] + (lats[points] - y0[edge]) * (
+                    x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+                crossings[points[lons[points] < x_cross]] ^= True
+
+        return crossings
+
+
+def _geojson_rings(geojson):
+    kind = geojson.get("type")
+    if kind == "FeatureCollection":
+        return [ring for feature in geojson["features"]
+                for ring in _geojson_rings(feature)]
+    if kind == "Feature":
+        return _geojson_rings(geojson["geometry"])
+    if kind == "Polygon":
+        return geojson["coordinates"]
+    if kind == "MultiPolygon":
+        return [ring for polygon in geojson["coordinates"]
+                for ring in polygon]
+    raise RuntimeError("unsupported GeoJSON geometry: %s" % kind)
 
 
 class ExposureModelWriter(object):
@@ -150,14 +546,110 @@ class ExposureModelWriter(object):
 
         self.counter += 1
 
-    def serialize(self):
-        with open("exp_model.xml", "w") as fh:
+    def serialize(self, filename="exp_model.xml"):
+        with open(filename, "w") as fh:
 
             fh.write(etree.tostring(
                     self.root, pretty_print=True,
                     xml_declaration=True,
                     encoding="UTF-8"))
 
+    def serialize_blocks(self, filename, blocks):
+        """
+        Write the assets added so far and then the ones of an iterable
+        of (lons, lats, numbers) arrays, as yielded by asset_blocks, to
+        filename. The blocks are written from a template as they come,
+        so only one of them is in memory at a time. Return the number of
+        assets written from the blocks.
+        """
+        head, tail = self._header_fragments()
+        taxonomy = escape(self.taxonomy)
+        first = self.counter
+
+        with open(filename, "wb") as fh:
+            fh.write(head)
+            for lons, lats, numbers in blocks:
+                numbers = numpy.maximum(numbers, 0)
+                for start in range(0, len(lons), ASSET_BLOCK_SIZE):
+                    stop = start + ASSET_BLOCK_SIZE
+                    assets = zip(
+                        range(self.counter + start, self.counter + stop),
+                        map(str, lons[start:stop].tolist()),
+                        map(str, lats[start:stop].tolist()),
+                        map(str, numbers[start:stop].tolist()))
+                    fh.write("".join(ASSET % (asset + (taxonomy,))
+                                     for asset in assets))
+                self.counter += len(lons)
+            fh.write(tail)
+
+        return self.counter - first
+
+    def _header_fragments(self):
+        # The document around the assets is serialized by lxml, with a
+        # placeholder comment where they go, so that the declaration,
+        # namespaces and indentation are the ones of serialize.
+        placeholder = etree.Comment(ASSETS_PLACEHOLDER)
+        self.exposure_list.append(placeholder)
+        try:
+            document = etree.tostring(self.root, pretty_print=True,
+                                      xml_declaration=True,
+                                      encoding="UTF-8")
+        finally:
+            self.exposure_list.remove(placeholder)
+        head, tail = document.split(etree.tostring(placeholder))
+        return head.rstrip(), tail
+
+
+def tile_filename(filename, row, col):
+    root, extension = os.path.splitext(filename)
+    return "%s_%d_%d%s" % (root, row, col, extension or ".xml")
+
+
+def _convert_tile(args):
+    (data_filename, metadata_filename, taxonomy, threshold, polygon,
+     coarsen, window, filename) = args
+    config = read_metadata(metadata_filename)
+    data = read_binary_data(data_filename, config)
+    blocks = asset_blocks(config, data, threshold, polygon=polygon,
+                          coarsen=coarsen, window=window)
+    assets = ExposureModelWriter(taxonomy).serialize_blocks(filename, blocks)
+    if not assets:
+        os.remove(filename)
+    return filename, assets
+
+
+def convert_tiles(data_filename, metadata_filename, taxonomy, filename,
+                  nx, ny, threshold=0, bbox=None, polygon=None, coarsen=1,
+                  workers=1):
+    """
+    Split the window of bbox and polygon of the grid in ny rows of nx
+    tiles (see tile_windows) and write the assets of each tile to its
+    own exposure file, named after filename and the row and column of
+    the tile (see tile_filename), with workers processes.
+    Tiles without assets are not written. Return the list of the
+    filenames and numbers of assets of the tiles written.
+    """
+    config = read_metadata(metadata_filename)
+    window = read_window(config, bbox, polygon)
+    tasks = []
+    for row, tiles in enumerate(tile_windows(window, nx, ny, coarsen)):
+        for col, tile in enumerate(tiles):
+            tasks.append((data_filename, metadata_filename, taxonomy,
+                          threshold, polygon, coarsen, tile,
+                          tile_filename(filename, row, col)))
+
+    if workers <= 1:
+        results = map(_convert_tile, tasks)
+    else:
+        pool = Pool(workers)
+        try:
+            results = pool.map(_convert_tile, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    return [result for result in results if result[1]]
+
 
 if __name__ == "__main__":
     parser = cmd_parser()
@@ -168,19 +660,34 @@ if __name__ == "__main__":
         exit(1)
     else:
         args = parser.parse_args()
+        if args.coarsen < 1:
+            parser.error("--coarsen must be at least 1")
+        if args.tiles is not None and min(args.tiles) < 1:
+            parser.error("--tiles NX and NY must be at least 1")
     
     started_at = datetime.datetime.now()
     print ">> Started at: " + str(started_at)
 
-    metadata = read_metadata(args.mdata)
-    bdata = read_binary_data(args.data)
-
-    writer = ExposureModelWriter(args.taxonomy)
-
-    for asset_data in asset_iterator(metadata, bdata):
-        writer.add(asset_data)
-
-    writer.serialize()
+    polygon = None
+    if args.polygon is not None:
+        polygon = Polygon.from_file(args.polygon)
+
+    if args.tiles is not None:
+        tiles = convert_tiles(args.data, args.mdata, args.taxonomy,
+                              args.output_file, args.tiles[0], args.tiles[1],
+                              args.threshold, args.bbox, polygon,
+                              args.coarsen, args.workers)
+        print ">> %s assets in %s tiles" % (
+            sum(assets for _, assets in tiles), len(tiles))
+    else:
+        metadata = read_metadata(args.mdata)
+        bdata = read_binary_data(args.data, metadata)
+
+        writer = ExposureModelWriter(args.taxonomy)
+        assets = writer.serialize_blocks(args.output_file, asset_blocks(
+            metadata, bdata, args.threshold, args.bbox, polygon,
+            args.coarsen))
+        print ">> %s assets" % assets
 
     elapsed_time = (datetime.datetime.now() - started_at)
     print ">> Time spent: %ss, %sms" % (
@@ -17,10 +17,16 @@ fragilityTxt2NRML creates a fragility input file format (NRML)
 taking a fragility in a fixed txt format.
 """
 
+import os
 import sys
 import argparse
 from lxml import etree
 
+# the shared nrml_utils package is kept next to the scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'nrml_utils'))
+from nrml_utils.compression import open_file
+
 NRML_NS = 'http://openquake.org/xmlns/nrml/0.5'
 #GML_NS = 'http://www.opengis.net/gml'
 NRML = "{%s}" % NRML_NS
@@ -126,7 +132,7 @@ class FragilityWriter(object):
         root_elem = self._write_header(metadata)
         root_elem = self._write_frag_def(root_elem, metadata, frag_definitions)
         tree = etree.ElementTree(root_elem)
-        with open(filename, 'w') as output_file:
+        with open_file(filename, 'w') as output_file:
             tree.write(output_file, xml_declaration=True,
                 encoding='utf-8', pretty_print=True)
 
@@ -230,7 +236,7 @@ def main():
         parser.print_help()
     else:
         args = parser.parse_args()
-        with open(args.input_file[0]) as input_file:
+        with open_file(args.input_file[0]) as input_file:
             reader = FragilityTxtReader(input_file)
             metadata = reader.metadata
             frag_def = reader.readfragility()
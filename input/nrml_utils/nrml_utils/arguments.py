@@ -0,0 +1,36 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+argparse types of the options shared by the command line scripts, so
+that they are written the same way in all of them.
+"""
+
+import argparse
+
+
+def bbox_argument(value):
+    """
+    argparse type of --bbox: west/south/east/north.
+    """
+    try:
+        west, south, east, north = [float(v) for v in value.split("/")]
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "expected west/south/east/north, got %s" % value)
+    if west > east or south > north:
+        raise argparse.ArgumentTypeError(
+            "west must be less than east and south less than north")
+    return west, south, east, north
@@ -0,0 +1,167 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from nrml_utils.compression import open_file
+from nrml_utils.reader import ExposureTxtReader
+from nrml_utils.table import ExposureTable
+
+DEFAULT_MAX_BYTES = 4 * 1024 ** 3
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def content_hash(filename):
+    sha1 = hashlib.sha1()
+    with open(filename, 'rb') as data:
+        for block in iter(lambda: data.read(HASH_BLOCK_SIZE), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class ExposureCache(object):
+    """
+    Cache of parsed exposure txt files, kept in cache_dir.
+
+    Every entry is a directory named after the content hash and the
+    size of the input, holding the metadata and one .npy file per
+    ExposureTable column, which are memory-mapped when read back.
+    The hash of an input is only recomputed when its size or mtime
+    changed. Once the entries take more than max_bytes the least
+    recently used ones are removed.
+    """
+
+    INDEX = 'index.json'
+    METADATA = 'metadata.json'
+    # prefix of the entries being written, which are not evicted
+    TMP_PREFIX = 'tmp-'
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def read(self, filename):
+        """
+        Return the metadata and the ExposureTable of the exposure txt
+        filename, from the cache if the input did not change or by
+        parsing it (and caching the result) otherwise.
+        """
+        key = self.key(filename)
+        cached = self.load(key)
+        if cached is not None:
+            return cached
+        with open_file(filename) as txtfile:
+            reader = ExposureTxtReader(txtfile)
+            metadata = reader.metadata
+            table = reader.readtable()
+        self.store(key, metadata, table)
+        return metadata, table
+
+    def key(self, filename):
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        index = self._read_index()
+        entry = index.get(path)
+        if (entry is None or entry['size'] != stat.st_size or
+                entry['mtime'] != stat.st_mtime):
+            entry = dict(size=stat.st_size, mtime=stat.st_mtime,
+                         hash=content_hash(filename))
+            index[path] = entry
+            self._write_index(index)
+        return '%s-%s' % (entry['hash'], entry['size'])
+
+    def load(self, key):
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, self.METADATA)) as meta:
+                cached = json.load(meta)
+            columns = dict(
+                (name, numpy.load(os.path.join(entry_dir, name + '.npy'),
+                                  mmap_mode='r'))
+                for name in ExposureTable.FLOAT_FIELDNAMES + ['taxonomy'])
+        except (IOError, OSError, ValueError):
+            return None
+        # the entry mtime is the LRU clock
+        os.utime(entry_dir, None)
+        table = ExposureTable(columns, columns['taxonomy'],
+                              cached['taxonomies'])
+        return cached['metadata'], table
+
+    def store(self, key, metadata, table):
+        if table.nbytes > self.max_bytes:
+            return
+        # write into a temporary directory first, so that concurrent
+        # readers never see a partial entry.
+        tmp_dir = tempfile.mkdtemp(prefix=self.TMP_PREFIX,
+                                   dir=self.cache_dir)
+        try:
+            for name in ExposureTable.FLOAT_FIELDNAMES + ['taxonomy']:
+                numpy.save(os.path.join(tmp_dir, name + '.npy'), table[name])
+            with open(os.path.join(tmp_dir, self.METADATA), 'w') as meta:
+                json.dump(dict(metadata=metadata,
+                               taxonomies=table.taxonomies), meta)
+            os.rename(tmp_dir, os.path.join(self.cache_dir, key))
+        except EnvironmentError:
+            # another process stored the same entry meanwhile, or the
+            # entry could not be written (e.g. the disk is full): the
+            # cache is only an optimization.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """
+        Remove the least recently used entries, other than keep, until
+        the cache takes no more than max_bytes. The entries still being
+        written by store are left alone.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if (name.startswith(self.TMP_PREFIX) or
+                    not os.path.isdir(entry_dir)):
+                continue
+            size = sum(os.path.getsize(os.path.join(entry_dir, f))
+                       for f in os.listdir(entry_dir))
+            total += size
+            if name != keep:
+                entries.append((os.path.getmtime(entry_dir), size, entry_dir))
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+
+    def _read_index(self):
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX)) as index:
+                return json.load(index)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_index(self, index):
+        handle, tmp_name = tempfile.mkstemp(prefix=self.TMP_PREFIX,
+                                            dir=self.cache_dir)
+        with os.fdopen(handle, 'w') as tmp_index:
+            json.dump(index, tmp_index)
+        os.rename(tmp_name, os.path.join(self.cache_dir, self.INDEX))
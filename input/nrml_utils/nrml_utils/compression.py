@@ -0,0 +1,55 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Transparent (de)compression of the input and output files, chosen from
+the file extension, so that compressed files are streamed instead of
+being decompressed to disk first.
+"""
+
+import bz2
+import gzip
+import os
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.BZ2File}
+if lzma is not None:
+    OPENERS['.xz'] = lzma.LZMAFile
+
+
+def is_compressed(filename):
+    return os.path.splitext(filename)[1].lower() in ('.gz', '.bz2', '.xz')
+
+
+def open_file(filename, mode='r'):
+    """
+    Open filename like open does, through gzip, bz2 or lzma when its
+    extension is .gz, .bz2 or .xz. Compressed files are always opened
+    in binary mode.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if not is_compressed(filename):
+        return open(filename, mode)
+    if extension not in OPENERS:
+        raise RuntimeError('%s files need the lzma module (backports.lzma '
+                           'on python 2)' % extension)
+    return OPENERS[extension](filename, mode.replace('b', '') + 'b')
@@ -0,0 +1,66 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Columnar export of the converted assets to Parquet, shared by the
+converters writing it in the same pass as their NRML.
+"""
+
+import numpy
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+class ParquetExport(object):
+    """
+    Columnar copy of the converted assets, written to a Parquet file a
+    row group at a time, so that it can be filled in the same pass as
+    the NRML and read back one column at a time.
+
+    fields is the list of the (column name, Arrow type name) of the
+    file, e.g. [('id', 'string'), ('lon', 'float64')].
+    """
+
+    def __init__(self, filename, fields):
+        if pyarrow is None:
+            raise RuntimeError('the Parquet export needs pyarrow')
+        self.filename = filename
+        self.names = [name for name, _ in fields]
+        self.types = [getattr(pyarrow, type_name)() for _, type_name in fields]
+        self.writer = pyarrow.parquet.ParquetWriter(
+            filename, pyarrow.schema(list(zip(self.names, self.types))))
+
+    def write(self, columns):
+        """
+        Write a dict of equally long columns as a row group. A column
+        is a sequence of values, None being a null, or a numpy array;
+        NaN in the float arrays are written as nulls.
+        """
+        arrays = []
+        for name, type_ in zip(self.names, self.types):
+            values = columns[name]
+            if isinstance(values, numpy.ndarray) and values.dtype.kind == 'f':
+                arrays.append(pyarrow.array(values, type=type_,
+                                            mask=numpy.isnan(values)))
+            else:
+                arrays.append(pyarrow.array(list(values), type=type_))
+        self.writer.write_table(pyarrow.Table.from_arrays(arrays, self.names))
+
+    def close(self):
+        self.writer.close()
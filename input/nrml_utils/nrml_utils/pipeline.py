@@ -0,0 +1,235 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import re
+from itertools import islice
+from multiprocessing import Pool
+
+from nrml_utils.cache import ExposureCache
+from nrml_utils.compression import is_compressed, open_file
+from nrml_utils.parquet import ParquetExport
+from nrml_utils.reader import ExposureTxtReader
+from nrml_utils.table import NO_VALUE
+from nrml_utils.writer import ExposureWriter, ID_PLACEHOLDER
+
+CHUNK_SIZE = 16 * 1024 * 1024
+CHUNKS_PER_WORKER = 4
+
+# Columns of the Parquet export and their Arrow types
+PARQUET_FIELDS = [('id', 'string'), ('taxonomy', 'string')] + [
+    (field, 'float64') for field in ExposureTxtReader.NUMERIC_FIELDNAMES]
+# Parquet export: assets per row group
+ROW_GROUP_SIZE = 10000
+
+# Line number of the validation errors of ExposureTxtReader
+_ERROR_LINE = re.compile(r'^line (\d+): ')
+
+
+def convert_exposure(input_filename, output_filename, workers=1,
+                     parquet_filename=None, cache_dir=None):
+    """
+    Convert an exposure txt file to NRML.
+
+    With more than one worker the asset section is split into chunks
+    of whole lines, serialized by a pool of processes and merged in
+    order. The output is identical to the one of a serial run.
+    Compressed inputs cannot be split and are always read serially.
+
+    With parquet_filename the assets are also written there as
+    PARQUET_FIELDS columns, a row group per ROW_GROUP_SIZE assets (per
+    chunk with more than one worker), in the same pass. output_filename
+    can then be None to write the Parquet file only.
+
+    With cache_dir the input is read through an ExposureCache kept
+    there: it is parsed once into an ExposureTable and the following
+    conversions of the same input load its memory-mapped columns. The
+    numbers are then written in their shortest form (see
+    ExposureWriter.serialize) and the conversion is serial.
+    """
+    parquet = None
+    if parquet_filename is not None:
+        parquet = ParquetExport(parquet_filename, PARQUET_FIELDS)
+    try:
+        if cache_dir is not None:
+            _convert_cached_exposure(input_filename, output_filename,
+                                     cache_dir, parquet)
+        else:
+            _convert_exposure(input_filename, output_filename, workers,
+                              parquet)
+    finally:
+        if parquet is not None:
+            parquet.close()
+
+
+def _convert_exposure(input_filename, output_filename, workers, parquet):
+    if workers <= 1 or is_compressed(input_filename):
+        with open_file(input_filename) as input_file:
+            reader = ExposureTxtReader(input_file)
+            assets = reader.iter_assets()
+            if parquet is not None:
+                assets = _export_assets(assets, parquet)
+            if output_filename is None:
+                for _ in assets:
+                    pass
+            else:
+                ExposureWriter().serialize(output_filename, reader.metadata,
+                                           assets, streaming=True)
+        return
+
+    with open(input_filename) as input_file:
+        reader = ExposureTxtReader(input_file)
+        metadata = reader.metadata
+        start, first_line = reader.assets_position()
+    tasks = [(input_filename, chunk_start, chunk_end, parquet is not None)
+             for chunk_start, chunk_end in split_in_chunks(
+                 input_filename, start, workers)]
+
+    pool = Pool(workers)
+    try:
+        fragments = _number_chunks(pool.imap(_serialize_chunk, tasks),
+                                   first_line, parquet)
+        if output_filename is None:
+            for _ in fragments:
+                pass
+        else:
+            ExposureWriter().serialize_fragments(output_filename, metadata,
+                                                 fragments)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _convert_cached_exposure(input_filename, output_filename, cache_dir,
+                             parquet):
+    metadata, table = ExposureCache(cache_dir).read(input_filename)
+    table.validate()
+    assets = table
+    if parquet is not None:
+        assets = _export_assets(table.iter_assets(), parquet)
+    if output_filename is not None:
+        ExposureWriter().serialize(output_filename, metadata, assets,
+                                   streaming=True)
+    elif parquet is not None:
+        for _ in assets:
+            pass
+
+
+def _number_chunks(results, first_line, parquet):
+    """
+    Number the assets of the serialized chunks as they come, in
+    order, from the gml:id and the line reached by the previous ones,
+    so that the input is read once. The line numbers of the errors
+    are moved from the chunk to the file.
+    """
+    first_index = 1
+    results = iter(results)
+    while True:
+        try:
+            block, lines, columns = next(results)
+        except StopIteration:
+            return
+        except RuntimeError as error:
+            raise RuntimeError(_ERROR_LINE.sub(
+                lambda match: 'line %d: ' % (
+                    first_line - 1 + int(match.group(1))),
+                str(error)))
+        block, rows = ExposureWriter.number_fragments(block, first_index)
+        if parquet is not None and rows:
+            columns['id'] = asset_ids(first_index, rows)
+            parquet.write(columns)
+        first_line += lines
+        first_index += rows
+        yield block
+
+
+def split_in_chunks(filename, start, workers, chunk_size=CHUNK_SIZE):
+    """
+    Split the bytes of filename from start onwards in (start, end)
+    ranges ending on line boundaries, at least CHUNKS_PER_WORKER per
+    worker and none larger than about chunk_size.
+    """
+    end = os.path.getsize(filename)
+    chunk_size = max(1, min(chunk_size,
+                            (end - start) // (workers * CHUNKS_PER_WORKER)))
+    chunks = []
+    with open(filename, 'rb') as data:
+        while start < end:
+            data.seek(min(start + chunk_size, end))
+            data.readline()
+            chunk_end = min(data.tell(), end)
+            chunks.append((start, chunk_end))
+            start = chunk_end
+    return chunks
+
+
+def _read_chunk(filename, start, end):
+    with open(filename, 'rb') as data:
+        data.seek(start)
+        return data.read(end - start)
+
+
+def _serialize_chunk(args):
+    # Serialize a chunk with line numbers and, in place of the gml:id
+    # numbers, ID_PLACEHOLDER relative to the chunk.
+    filename, start, end, export = args
+    chunk = _read_chunk(filename, start, end)
+    if not isinstance(chunk, str):
+        chunk = chunk.decode('utf-8')
+    if ID_PLACEHOLDER in chunk:
+        raise RuntimeError('line %d: an asset cannot contain a NUL '
+                           'character' % (chunk.count(
+                               '\n', 0, chunk.index(ID_PLACEHOLDER)) + 1))
+    lines = chunk.splitlines(True)
+    assets = list(ExposureTxtReader.iter_asset_rows(lines, 1))
+    block = ExposureWriter().unnumbered_fragments(assets)
+    return block, len(lines), parquet_columns(assets) if export else None
+
+
+def asset_ids(first_index, count):
+    """
+    Return the gml:ids of count assets numbered from first_index.
+    """
+    return ['asset_%s' % i for i in range(first_index, first_index + count)]
+
+
+def parquet_columns(assets, first_index=None):
+    """
+    Turn validated asset dicts into the PARQUET_FIELDS columns of a
+    row group, numbered from first_index like their gml:ids. Without
+    first_index the id column is left to the caller.
+    """
+    columns = dict(taxonomy=[asset['taxonomy'] for asset in assets])
+    if first_index is not None:
+        columns['id'] = asset_ids(first_index, len(assets))
+    for field in ExposureTxtReader.NUMERIC_FIELDNAMES:
+        columns[field] = [float(asset[field]) if asset[field] != NO_VALUE
+                          else None for asset in assets]
+    return columns
+
+
+def _export_assets(assets, parquet):
+    # write the assets to parquet a row group at a time while passing
+    # them on to the NRML writer
+    assets = iter(assets)
+    first_index = 1
+    while True:
+        row_group = list(islice(assets, ROW_GROUP_SIZE))
+        if not row_group:
+            return
+        parquet.write(parquet_columns(row_group, first_index))
+        first_index += len(row_group)
+        for asset in row_group:
+            yield asset
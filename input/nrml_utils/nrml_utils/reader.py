@@ -13,7 +13,22 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with NRML.  If not, see <http://www.gnu.org/licenses/>.
 
-from csv import DictReader
+from array import array
+from csv import DictReader, reader as csv_reader
+
+from lxml import etree
+
+from nrml_utils.table import ExposureTable, NO_TAXONOMY, NO_VALUE
+
+NRML_NAMESPACES = ['http://openquake.org/xmlns/nrml/0.3',
+                   'http://openquake.org/xmlns/nrml/0.5']
+GML_NS = 'http://www.opengis.net/gml'
+GML_ID = '{%s}id' % GML_NS
+GML_POS = '{%s}pos' % GML_NS
+
+
+def _localname(tag):
+    return tag.rsplit('}', 1)[-1]
 
 
 class ExposureTxtReader(object):
@@ -22,6 +37,10 @@ class ExposureTxtReader(object):
     ASSETS_FIELDNAMES = ['lon', 'lat', 'taxonomy', 'stco', 'number' ,'area',
                          'reco', 'coco', 'occupantDay', 'occupantNight',
                          'deductible', 'limit']
+    COMPULSORY_FIELDNAMES = ['lon', 'lat', 'taxonomy']
+    NUMERIC_FIELDNAMES = ['lon', 'lat', 'stco', 'number', 'area', 'reco',
+                          'coco', 'occupantDay', 'occupantNight',
+                          'deductible', 'limit']
 
     def __init__(self, txtfile):
         self.txtfile = txtfile
@@ -31,11 +50,32 @@ class ExposureTxtReader(object):
 
     def _move_to_assets_definitions(self):
         self._move_to_beginning_file()
+        line_number = 0
         while True:
+            line_number += 1
             line = set([field.strip() for field in (
                 self.txtfile.readline()).split(',')])
             if set(self.ASSETS_FIELDNAMES).issubset(line):
                 break;
+        return line_number
+
+    @classmethod
+    def _validate_asset(cls, asset, line_number):
+        if None in asset or None in asset.values():
+            raise RuntimeError('line %s: an asset is made of %s fields' % (
+                line_number, len(cls.ASSETS_FIELDNAMES)))
+        for field in cls.COMPULSORY_FIELDNAMES:
+            if asset[field] == '':
+                raise RuntimeError('line %s: %s is a compulsory value for '
+                                   'an asset' % (line_number, field))
+        for field in cls.NUMERIC_FIELDNAMES:
+            if asset[field] != '':
+                try:
+                    float(asset[field])
+                except ValueError:
+                    raise RuntimeError('line %s: %s must be a number, not '
+                                       '%r' % (line_number, field,
+                                               asset[field]))
 
     @property
     def metadata(self):
@@ -51,6 +91,208 @@ class ExposureTxtReader(object):
         reader = DictReader(self.txtfile, fieldnames=self.ASSETS_FIELDNAMES)
         return [asset for asset in reader]
 
+    def iter_assets(self):
+        """
+        Yield the assets one row at a time, validating each of them
+        as it is read, so that only the current row is kept in memory.
+        The file must stay open until the iteration is over.
+        """
+        header_line = self._move_to_assets_definitions()
+        for asset in self.iter_asset_rows(self.txtfile, header_line + 1):
+            yield asset
+
+    def assets_position(self):
+        """
+        Return the file offset and the line number of the first asset
+        row, e.g. to split the asset section in chunks.
+        """
+        header_line = self._move_to_assets_definitions()
+        return self.txtfile.tell(), header_line + 1
+
+    @classmethod
+    def iter_asset_rows(cls, lines, first_line_number):
+        """
+        Yield the validated assets of some rows of the asset section,
+        the first of which is at line first_line_number of the file.
+        """
+        reader = DictReader(lines, fieldnames=cls.ASSETS_FIELDNAMES)
+        for asset in reader:
+            cls._validate_asset(asset, first_line_number - 1 + reader.line_num)
+            yield asset
+
+    def readtable(self):
+        """
+        Read the assets straight into an ExposureTable, without
+        building a dict per asset.
+        """
+        header_line = self._move_to_assets_definitions()
+        float_columns = [(self.ASSETS_FIELDNAMES.index(name), array('d'))
+                         for name in ExposureTable.FLOAT_FIELDNAMES]
+        taxonomy_index = self.ASSETS_FIELDNAMES.index('taxonomy')
+        taxonomy = array('i')
+        codes = {}
+        nan = float('nan')
+        rows = csv_reader(self.txtfile)
+        for row in rows:
+            if not row:
+                continue
+            if len(row) != len(self.ASSETS_FIELDNAMES):
+                raise RuntimeError('line %s: an asset is made of %s fields'
+                                   % (header_line + rows.line_num,
+                                      len(self.ASSETS_FIELDNAMES)))
+            try:
+                for index, column in float_columns:
+                    value = row[index]
+                    column.append(float(value) if value != '' else nan)
+            except ValueError:
+                raise RuntimeError('line %s: %s must be a number, not %r' % (
+                    header_line + rows.line_num,
+                    self.ASSETS_FIELDNAMES[index], value))
+            value = row[taxonomy_index]
+            taxonomy.append(codes.setdefault(value, len(codes))
+                            if value != '' else NO_TAXONOMY)
+        taxonomies = sorted(codes, key=codes.get)
+        return ExposureTable(
+            dict((name, column) for name, (_, column) in
+                 zip(ExposureTable.FLOAT_FIELDNAMES, float_columns)),
+            taxonomy, taxonomies)
+
+
+class ExposureNRMLReader(object):
+    """
+    Read exposure NRML back, either with assetDefinition elements, as
+    written by ExposureWriter and exposureTxt2NRML.py, or with asset
+    elements, as written by eqrm_csv2NRML.py, in any of NRML_NAMESPACES.
+
+    The assets are parsed one at a time with iterparse and removed from
+    the tree as soon as they are read, so that memory does not grow with
+    the size of the file. They come as dicts with the fields of
+    ExposureTxtReader plus the asset id.
+    """
+
+    ASSET_TAGS = ['assetDefinition', 'asset']
+    ASSETS_FIELDNAMES = ['id'] + ExposureTxtReader.ASSETS_FIELDNAMES
+    METADATA_FIELDNAMES = ['expModId', 'assetCategory', 'description',
+                           'stcoType', 'stcoUnit', 'areaType', 'areaUnit',
+                           'cocoType', 'cocoUnit', 'recoType', 'recoUnit',
+                           'taxonomySource']
+    # asset fields of the cost types and of the occupancy periods
+    COST_FIELDNAMES = {'structural': 'stco', 'contents': 'coco',
+                       'nonstructural': 'reco'}
+    OCCUPANCY_FIELDNAMES = {'day': 'occupantDay', 'night': 'occupantNight'}
+
+    def __init__(self, xmlfile):
+        self.xmlfile = xmlfile
+        self.asset_tags = ['{%s}%s' % (namespace, tag)
+                           for namespace in NRML_NAMESPACES
+                           for tag in self.ASSET_TAGS]
+
+    def _move_to_beginning_file(self):
+        self.xmlfile.seek(0)
+
+    def _iterparse(self, **kwargs):
+        self._move_to_beginning_file()
+        return etree.iterparse(self.xmlfile, **kwargs)
+
+    @property
+    def metadata(self):
+        metadata = {}
+        for event, elem in self._iterparse(events=('start', 'end')):
+            name = _localname(elem.tag)
+            if event == 'end':
+                if name in ('description', 'taxonomySource'):
+                    metadata[name] = (elem.text or NO_VALUE).strip()
+            elif elem.tag in self.asset_tags:
+                break
+            elif name == 'exposureList':
+                metadata['expModId'] = elem.get(GML_ID, NO_VALUE)
+                metadata.update(elem.attrib)
+            elif name == 'exposureModel' and 'id' in elem.attrib:
+                metadata['expModId'] = elem.get('id')
+                metadata['assetCategory'] = elem.get('category', NO_VALUE)
+                metadata['taxonomySource'] = elem.get('taxonomySource',
+                                                      NO_VALUE)
+            elif name == 'costType':
+                field = self.COST_FIELDNAMES.get(elem.get('name'))
+                if field is not None:
+                    metadata[field + 'Type'] = elem.get('type', NO_VALUE)
+                    metadata[field + 'Unit'] = elem.get('unit', NO_VALUE)
+            elif name == 'area':
+                metadata['areaType'] = elem.get('type', NO_VALUE)
+                metadata['areaUnit'] = elem.get('unit', NO_VALUE)
+        return dict((field, metadata.get(field, NO_VALUE))
+                    for field in self.METADATA_FIELDNAMES)
+
+    def iter_assets(self):
+        """
+        Yield the validated assets in document order. The file must
+        stay open until the iteration is over.
+        """
+        for _, elem in self._iterparse(tag=self.asset_tags):
+            if _localname(elem.tag) == 'assetDefinition':
+                asset = self._read_asset_definition(elem)
+            else:
+                asset = self._read_asset(elem)
+            ExposureTxtReader._validate_asset(asset, elem.sourceline)
+            # drop the asset and the ones before it from the tree
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+            yield asset
+
+    def readassets(self):
+        return list(self.iter_assets())
+
+    def readtable(self):
+        return ExposureTable.from_assets(self.iter_assets())
+
+    def _read_asset_definition(self, elem):
+        asset = dict.fromkeys(self.ASSETS_FIELDNAMES, NO_VALUE)
+        asset['id'] = elem.get(GML_ID, NO_VALUE)
+        for child in elem.iterchildren(tag=etree.Element):
+            name = _localname(child.tag)
+            if name == 'site':
+                asset['lon'], asset['lat'] = self._split_pos(
+                    child.findtext('.//%s' % GML_POS), child.sourceline)
+            elif name == 'occupants':
+                field = self.OCCUPANCY_FIELDNAMES.get(
+                    child.get('description'))
+                if field is not None:
+                    asset[field] = (child.text or NO_VALUE).strip()
+            elif name in asset:
+                asset[name] = (child.text or NO_VALUE).strip()
+        return asset
+
+    def _read_asset(self, elem):
+        asset = dict.fromkeys(self.ASSETS_FIELDNAMES, NO_VALUE)
+        for name in ('id', 'taxonomy', 'number', 'area'):
+            asset[name] = elem.get(name, NO_VALUE)
+        for child in elem.iterdescendants(tag=etree.Element):
+            name = _localname(child.tag)
+            if name == 'location':
+                asset['lon'] = child.get('lon', NO_VALUE)
+                asset['lat'] = child.get('lat', NO_VALUE)
+            elif name == 'cost':
+                field = self.COST_FIELDNAMES.get(child.get('type'))
+                if field is not None:
+                    asset[field] = child.get('value', NO_VALUE)
+                if field == 'stco':
+                    asset['deductible'] = child.get('deductible', NO_VALUE)
+                    asset['limit'] = child.get('insuranceLimit', NO_VALUE)
+            elif name == 'occupancy':
+                field = self.OCCUPANCY_FIELDNAMES.get(child.get('period'))
+                if field is not None:
+                    asset[field] = child.get('occupants', NO_VALUE)
+        return asset
+
+    @staticmethod
+    def _split_pos(pos, line_number):
+        values = (pos or NO_VALUE).split()
+        if len(values) != 2:
+            raise RuntimeError('line %s: gml:pos must be made of lon and '
+                               'lat, not %r' % (line_number, pos))
+        return values
+
 
 class VulnerabilityTxtReader(object):
 
@@ -0,0 +1,165 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+from array import array
+
+import numpy
+
+NO_VALUE = ''
+NO_TAXONOMY = -1
+
+
+def format_number(value):
+    """
+    Format a float from a table column the way it would appear
+    in an exposure txt file: NaN is an empty value and integral
+    numbers have no decimal part.
+    """
+    if value != value:
+        return NO_VALUE
+    if value.is_integer() and abs(value) < 1e16:
+        return '%d' % value
+    return repr(value)
+
+
+class ExposureTable(object):
+    """
+    Columnar exposure: one float64 array per numeric asset field (NaN
+    where the value is not defined) and the taxonomy stored as integer
+    codes into the taxonomies list (NO_TAXONOMY where missing).
+    """
+
+    FLOAT_FIELDNAMES = ['lon', 'lat', 'stco', 'number', 'area', 'reco',
+                        'coco', 'occupantDay', 'occupantNight',
+                        'deductible', 'limit']
+    COMPULSORY_FIELDNAMES = ['lon', 'lat']
+    FORMAT_BLOCK_SIZE = 10000
+
+    def __init__(self, columns, taxonomy, taxonomies):
+        self.columns = dict(
+            (name, numpy.asarray(columns[name], dtype=numpy.float64))
+            for name in self.FLOAT_FIELDNAMES)
+        self.taxonomy = numpy.asarray(taxonomy, dtype=numpy.int32)
+        self.taxonomies = list(taxonomies)
+        for name, column in self.columns.items():
+            if len(column) != len(self.taxonomy):
+                raise ValueError('column %s has %s values, expected %s' % (
+                    name, len(column), len(self.taxonomy)))
+
+    @classmethod
+    def from_assets(cls, assets):
+        """
+        Build a table from asset dicts as returned by ExposureTxtReader
+        or ExposureNRMLReader, consuming them one at a time.
+        """
+        columns = dict((name, array('d')) for name in cls.FLOAT_FIELDNAMES)
+        codes = {}
+        taxonomy = array('i')
+        for asset in assets:
+            for name in cls.FLOAT_FIELDNAMES:
+                value = asset[name]
+                columns[name].append(
+                    float(value) if value != NO_VALUE else numpy.nan)
+            if asset['taxonomy'] == NO_VALUE:
+                taxonomy.append(NO_TAXONOMY)
+            else:
+                taxonomy.append(
+                    codes.setdefault(asset['taxonomy'], len(codes)))
+        taxonomies = sorted(codes, key=codes.get)
+        return cls(columns, taxonomy, taxonomies)
+
+    def __len__(self):
+        return len(self.taxonomy)
+
+    def __getitem__(self, name):
+        if name == 'taxonomy':
+            return self.taxonomy
+        return self.columns[name]
+
+    @property
+    def nbytes(self):
+        return self.taxonomy.nbytes + sum(
+            column.nbytes for column in self.columns.values())
+
+    def is_empty(self, name):
+        """
+        True if no asset has a value for the numeric column name.
+        """
+        return bool(numpy.isnan(self.columns[name]).all())
+
+    def validate(self):
+        """
+        Check the compulsory values and the coordinates of all the
+        assets at once, raising a RuntimeError that names the first
+        offending assets (numbered from 1 like their gml:ids).
+        """
+        checks = [
+            (self.taxonomy == NO_TAXONOMY,
+             'taxonomy is a compulsory value for an asset')]
+        for name in self.COMPULSORY_FIELDNAMES:
+            checks.append((numpy.isnan(self.columns[name]),
+                           '%s is a compulsory value for an asset' % name))
+        with numpy.errstate(invalid='ignore'):
+            checks.append((numpy.abs(self.columns['lon']) > 180,
+                           'lon must be within [-180, 180]'))
+            checks.append((numpy.abs(self.columns['lat']) > 90,
+                           'lat must be within [-90, 90]'))
+        for invalid, message in checks:
+            rows = numpy.flatnonzero(invalid)
+            if len(rows):
+                raise RuntimeError('%s (%s assets, starting from asset_%s)'
+                                   % (message, len(rows), rows[0] + 1))
+
+    def summary(self):
+        """
+        Return count, min, max and sum of the defined values of each
+        numeric column, plus the number of assets per taxonomy.
+        """
+        stats = {}
+        for name in self.FLOAT_FIELDNAMES:
+            column = self.columns[name]
+            defined = column[~numpy.isnan(column)]
+            stats[name] = dict(
+                count=len(defined),
+                min=defined.min() if len(defined) else numpy.nan,
+                max=defined.max() if len(defined) else numpy.nan,
+                sum=defined.sum())
+        counts = numpy.bincount(self.taxonomy[self.taxonomy >= 0],
+                                minlength=len(self.taxonomies))
+        stats['taxonomy'] = dict(zip(self.taxonomies, counts.tolist()))
+        return stats
+
+    def iter_assets(self):
+        """
+        Yield the assets as dicts of strings, as ExposureWriter expects
+        them. Values are formatted a block of rows at a time.
+        """
+        # NO_TAXONOMY (-1) picks the trailing empty value
+        taxonomies = self.taxonomies + [NO_VALUE]
+        empty = [name for name in self.FLOAT_FIELDNAMES if self.is_empty(name)]
+        for start in range(0, len(self), self.FORMAT_BLOCK_SIZE):
+            stop = min(start + self.FORMAT_BLOCK_SIZE, len(self))
+            block = dict(
+                (name, [format_number(value)
+                        for value in self.columns[name][start:stop].tolist()])
+                for name in self.FLOAT_FIELDNAMES if name not in empty)
+            for name in empty:
+                block[name] = [NO_VALUE] * (stop - start)
+            block['taxonomy'] = [
+                taxonomies[code]
+                for code in self.taxonomy[start:stop].tolist()]
+            names = list(block)
+            for values in zip(*[block[name] for name in names]):
+                yield dict(zip(names, values))
@@ -0,0 +1,156 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Schema validation of NRML documents too large to be parsed as a whole.
+
+The document is streamed with iterparse and its assets are moved, a
+batch at a time, into a copy of the document made of everything but
+the assets, which is validated against the schema. Memory is bounded by
+the size of a batch, and errors keep the line numbers of the original
+document. Constraints spanning assets of different batches, such as
+the uniqueness of the gml:id values, are not checked.
+"""
+
+import os
+from copy import deepcopy
+from multiprocessing import Pool
+
+from lxml import etree
+
+from nrml_utils.compression import open_file
+from nrml_utils.reader import ExposureNRMLReader, NRML_NAMESPACES
+
+NRML_SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'schema', 'nrml.xsd')
+ASSET_TAGS = ['{%s}%s' % (namespace, tag)
+              for namespace in NRML_NAMESPACES
+              for tag in ExposureNRMLReader.ASSET_TAGS]
+BATCH_SIZE = 10000
+MAX_ERRORS = 10
+
+# XMLSchema objects cannot be pickled, every process compiles its own
+_schemas = {}
+
+
+def _schema(schema_filename):
+    if schema_filename not in _schemas:
+        _schemas[schema_filename] = etree.XMLSchema(
+            etree.parse(schema_filename))
+    return _schemas[schema_filename]
+
+
+def validate(filename, schema_filename=NRML_SCHEMA_FILE,
+             max_errors=MAX_ERRORS, batch_size=BATCH_SIZE):
+    """
+    Validate the NRML document filename against the schema and return
+    its first max_errors errors as (line, message) tuples, in the order
+    they are found. An empty list means the document is valid.
+    """
+    schema = _schema(schema_filename)
+    errors = []
+    seen = set()
+
+    def check(tree):
+        if schema.validate(tree):
+            return
+        for error in schema.error_log:
+            if (error.line, error.message) not in seen:
+                seen.add((error.line, error.message))
+                errors.append((error.line, error.message))
+
+    skeleton = None
+    batch = []
+    with open_file(filename, 'rb') as xmlfile:
+        context = etree.iterparse(xmlfile, events=('start', 'end'),
+                                  tag=ASSET_TAGS)
+        try:
+            for event, elem in context:
+                if skeleton is None:
+                    skeleton = _skeleton(elem)
+                    containers = {}
+                if event == 'start':
+                    continue
+                parent = elem.getparent()
+                if parent not in containers:
+                    containers[parent] = _find_in_skeleton(skeleton, parent)
+                # moving the asset also drops it from the parsed tree
+                containers[parent].append(elem)
+                batch.append(elem)
+                if len(batch) > batch_size:
+                    check(skeleton)
+                    if len(errors) >= max_errors:
+                        return errors[:max_errors]
+                    # the last asset is kept, as containers need at least one
+                    for asset in batch[:-1]:
+                        asset.getparent().remove(asset)
+                    del batch[:-1]
+        except etree.XMLSyntaxError as e:
+            errors.append((e.position[0], e.msg))
+            return errors[:max_errors]
+
+        if skeleton is None:
+            # no assets, the document is small enough
+            check(context.root.getroottree())
+        elif batch:
+            check(skeleton)
+    return errors[:max_errors]
+
+
+def validate_files(filenames, schema_filename=NRML_SCHEMA_FILE,
+                   max_errors=MAX_ERRORS, batch_size=BATCH_SIZE, workers=1):
+    """
+    Validate many NRML documents, over a pool of processes if more than
+    one worker is given. Return a dict of the errors of each filename,
+    see validate.
+    """
+    tasks = [(filename, schema_filename, max_errors, batch_size)
+             for filename in filenames]
+    if workers <= 1 or len(tasks) <= 1:
+        results = [_validate(task) for task in tasks]
+    else:
+        pool = Pool(workers)
+        try:
+            results = pool.map(_validate, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    return dict(zip(filenames, results))
+
+
+def _validate(args):
+    return validate(*args)
+
+
+def _skeleton(first_asset):
+    """
+    Copy the document the first asset belongs to, without any asset.
+    """
+    # deepcopy, unlike a serialization round trip, keeps the line numbers
+    skeleton = etree.ElementTree(deepcopy(first_asset.getroottree().getroot()))
+    for asset in list(skeleton.getroot().iter(*ASSET_TAGS)):
+        asset.getparent().remove(asset)
+    return skeleton
+
+
+def _find_in_skeleton(skeleton, elem):
+    path = []
+    while elem.getparent() is not None:
+        path.append(elem.getparent().index(elem))
+        elem = elem.getparent()
+    found = skeleton.getroot()
+    for index in reversed(path):
+        found = found[index]
+    return found
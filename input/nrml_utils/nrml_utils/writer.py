@@ -13,8 +13,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with NRML.  If not, see <http://www.gnu.org/licenses/>.
 
+from io import BytesIO
+from itertools import chain, count, repeat
+from xml.sax.saxutils import escape
+
 from lxml import etree
 
+from nrml_utils.compression import open_file
+from nrml_utils.table import ExposureTable
+
 NRML_NS = 'http://openquake.org/xmlns/nrml/0.3'
 GML_NS = 'http://www.opengis.net/gml'
 NRML = "{%s}" % NRML_NS
@@ -78,17 +85,233 @@ PROB_DISTR = 'probabilisticDistribution'
 
 NO_VALUE = ''
 
+# Streaming serialization
+ASSETS_PLACEHOLDER = 'assets'
+ASSET_INDENT = '\n' + ' ' * 6
+ASSET_CHILD_INDENT = '\n' + ' ' * 8
+_TEXT_ENTITIES = {'\r': '&#13;'}
+_ATTRIB_ENTITIES = {'"': '&quot;', '\t': '&#9;', '\n': '&#10;', '\r': '&#13;'}
+# Stands for the gml:id number of the assets serialized before it is
+# known; no asset value may contain it.
+ID_PLACEHOLDER = '\0'
+
+
+def _prefixed(tag):
+    """
+    Turn a Clark notation tag into the prefixed name lxml
+    uses when serializing a document declaring NSMAP.
+    """
+    namespace, name = tag[1:].split('}')
+    for prefix, uri in NSMAP.items():
+        if uri == namespace:
+            return '%s:%s' % (prefix, name) if prefix else name
+    raise ValueError('%s is not declared in NSMAP' % namespace)
+
+
+QNAMES = dict((tag, _prefixed(tag)) for tag in [
+    ASSET, GML_ID, SITE, GML_POINT, GML_POS, AREA, COCO, DEDUCTIBLE, LIMIT,
+    NUMBER, OCCUPANTS, RECO, STCO, TAXONOMY])
+
+# Optional children of an assetDefinition, in the order they are
+# written: (asset field, tag, attributes)
+ASSET_CHILDREN = [
+    ('area', AREA, {}),
+    ('coco', COCO, {}),
+    ('deductible', DEDUCTIBLE, {}),
+    ('limit', LIMIT, {}),
+    ('number', NUMBER, {}),
+    ('occupantDay', OCCUPANTS, {'description': 'day'}),
+    ('occupantNight', OCCUPANTS, {'description': 'night'}),
+    ('reco', RECO, {}),
+    ('stco', STCO, {})]
+ASSET_CHILDREN_FIELDS = [field for field, _, _ in ASSET_CHILDREN]
+
+# Serialized assetDefinition up to the gml:pos text, and from there
+# to the optional children
+ASSET_START = (
+    ASSET_INDENT + '<%s %s="asset_%%s">' % (QNAMES[ASSET], QNAMES[GML_ID]) +
+    ASSET_CHILD_INDENT + '<%s>' % QNAMES[SITE] +
+    ASSET_CHILD_INDENT + '  <%s %s="%s">' % (
+        QNAMES[GML_POINT], GML_SRS_ATTR_NAME, GML_SRS_EPSG_4326) +
+    ASSET_CHILD_INDENT + '    <%s>' % QNAMES[GML_POS])
+SITE_END = (
+    '</%s>' % QNAMES[GML_POS] +
+    ASSET_CHILD_INDENT + '  </%s>' % QNAMES[GML_POINT] +
+    ASSET_CHILD_INDENT + '</%s>' % QNAMES[SITE])
+TAXONOMY_START = ASSET_CHILD_INDENT + '<%s>' % QNAMES[TAXONOMY]
+ASSET_END = ('</%s>' % QNAMES[TAXONOMY] +
+             ASSET_INDENT + '</%s>' % QNAMES[ASSET])
+
+
+def _escape_text(value):
+    if '&' in value or '<' in value or '>' in value or '\r' in value:
+        return escape(value, _TEXT_ENTITIES)
+    return value
+
+
+def _escape_attrib(value):
+    return escape(value, _ATTRIB_ENTITIES)
+
+
+def _to_bytes(text):
+    if isinstance(text, bytes):
+        return text
+    return text.encode('utf-8')
+
 
 class ExposureWriter(object):
 
-    def serialize(self, filename, metadata, assets):
+    def serialize(self, filename, metadata, assets, streaming=False):
+        """
+        Write the exposure to filename.
+
+        With streaming=True each assetDefinition is written as soon as
+        it is taken from assets (which can be any iterable), so memory
+        does not grow with the number of assets. The output is the same,
+        byte for byte, as the one built through the lxml tree.
+
+        assets can also be an ExposureTable, whose numbers are then
+        written in their shortest form (e.g. 0.1 for an input 0.10).
+        """
+        fields = self._defined_fields(assets)
+        if isinstance(assets, ExposureTable):
+            assets = assets.iter_assets()
+        if streaming:
+            return self._stream(filename, metadata, assets, fields)
         root_elem = self._write_header(metadata)
-        root_elem = self._write_assets(root_elem, assets)
+        root_elem = self._write_assets(root_elem, assets, fields)
         tree = etree.ElementTree(root_elem)
-        with open(filename, 'w') as output_file:
+        with open_file(filename, 'w') as output_file:
             tree.write(output_file, xml_declaration=True,
                 encoding='utf-8', pretty_print=True)
 
+    def _defined_fields(self, assets):
+        """
+        Return the optional asset fields that have a value for at
+        least one of the assets, or all of them when assets can only
+        be iterated once.
+
+        Streaming inputs, such as the generators of convert_exposure,
+        are not pruned. The output does not change, since empty values
+        are skipped asset by asset anyway. Only an ExposureTable can be
+        pruned for less than the cost of the per-asset checks it saves.
+        """
+        if isinstance(assets, ExposureTable):
+            return [field for field in ASSET_CHILDREN_FIELDS
+                    if not assets.is_empty(field)]
+        if isinstance(assets, (list, tuple)):
+            return [field for field in ASSET_CHILDREN_FIELDS
+                    if any(asset[field] != NO_VALUE for asset in assets)]
+        return ASSET_CHILDREN_FIELDS
+
+    def _emitters(self, fields):
+        """
+        Return the (field, start tag, end tag) of the children to be
+        written for the given fields.
+        """
+        emitters = []
+        for field, tag, attrib in ASSET_CHILDREN:
+            if field in fields:
+                attributes = ''.join(
+                    ' %s="%s"' % (name, _escape_attrib(attrib[name]))
+                    for name in sorted(attrib))
+                emitters.append((field, '%s<%s%s>' % (
+                    ASSET_CHILD_INDENT, QNAMES[tag], attributes),
+                    '</%s>' % QNAMES[tag]))
+        return emitters
+
+    def _stream(self, filename, metadata, assets, fields):
+        self.serialize_fragments(filename, metadata,
+                                 self._iter_fragments(assets, count(1),
+                                                      fields))
+
+    def _iter_fragments(self, assets, numbers, fields):
+        emitters = self._emitters(fields)
+        for asset in assets:
+            yield _to_bytes(self._asset_fragment(next(numbers), asset,
+                                                 emitters))
+
+    def asset_fragments(self, assets, start=1):
+        """
+        Serialize assets into a block of assetDefinitions numbered
+        from start, to be passed (in order) to serialize_fragments.
+        """
+        return b''.join(self._iter_fragments(
+            assets, count(start), ASSET_CHILDREN_FIELDS))
+
+    def unnumbered_fragments(self, assets):
+        """
+        Serialize assets like asset_fragments, when the number of the
+        first one is not known yet, leaving ID_PLACEHOLDER in their
+        gml:ids. The block is then numbered with number_fragments.
+        """
+        return b''.join(self._iter_fragments(
+            assets, repeat(ID_PLACEHOLDER), ASSET_CHILDREN_FIELDS))
+
+    @staticmethod
+    def number_fragments(block, start):
+        """
+        Number from start the assetDefinitions of a block serialized
+        by unnumbered_fragments, returning the numbered block and the
+        number of assets in it.
+        """
+        parts = block.split(_to_bytes(ID_PLACEHOLDER))
+        numbered = [parts[0]]
+        for i, part in enumerate(parts[1:], start):
+            numbered += (_to_bytes(str(i)), part)
+        return b''.join(numbered), len(parts) - 1
+
+    def serialize_fragments(self, filename, metadata, fragments):
+        """
+        Write the exposure to filename from an iterable of already
+        serialized assetDefinitions, writing each one as it comes.
+        """
+        fragments = (fragment for fragment in fragments if fragment)
+        first_fragment = next(fragments, None)
+        if first_fragment is None:
+            # an empty exposureList is serialized as a self-closing
+            # element, leave it to lxml.
+            return self.serialize(filename, metadata, [])
+
+        head, tail = self._header_fragments(metadata)
+        with open_file(filename, 'wb') as output_file:
+            output_file.write(head)
+            for fragment in chain([first_fragment], fragments):
+                output_file.write(fragment)
+            output_file.write(tail)
+
+    def _header_fragments(self, metadata):
+        # The document around the assets is serialized by lxml, with a
+        # placeholder comment where the assetDefinitions go, so that
+        # the declaration, namespaces and indentation are unchanged.
+        root_elem = self._write_header(metadata)
+        exp_list = root_elem.find('.//%s' % EXPOSURE_LIST)
+        exp_list.append(etree.Comment(ASSETS_PLACEHOLDER))
+        output = BytesIO()
+        etree.ElementTree(root_elem).write(output, xml_declaration=True,
+            encoding='utf-8', pretty_print=True)
+        placeholder = etree.tostring(etree.Comment(ASSETS_PLACEHOLDER))
+        head, tail = output.getvalue().split(placeholder)
+        return head.rstrip(), tail
+
+    def _asset_fragment(self, i, asset, emitters):
+        lon, lat = asset['lon'], asset['lat']
+        if lon == NO_VALUE or lat == NO_VALUE:
+            raise RuntimeError('lon and lat are compulsory values for an '
+                               'asset')
+        taxonomy = asset['taxonomy']
+        if taxonomy == NO_VALUE:
+            raise RuntimeError('taxonomy is a compulsory value for '
+                               'an asset')
+
+        parts = [ASSET_START % i, _escape_text(lon + ' ' + lat), SITE_END]
+        for field, start_tag, end_tag in emitters:
+            value = asset[field]
+            if value != NO_VALUE:
+                parts += (start_tag, _escape_text(value), end_tag)
+        parts += (TAXONOMY_START, _escape_text(taxonomy), ASSET_END)
+        return ''.join(parts)
+
     def _value_defined_for(self, dict, attrib):
         return dict[attrib] != NO_VALUE
 
@@ -135,8 +358,11 @@ class ExposureWriter(object):
             taxonomy_source.text = metadata['taxonomySource']
         return root_elem
 
-    def _write_assets(self, root_elem, assets):
+    def _write_assets(self, root_elem, assets, fields=ASSET_CHILDREN_FIELDS):
         exp_list = root_elem.find('.//%s' % EXPOSURE_LIST)
+        emitters = [(field, tag, attrib)
+                    for field, tag, attrib in ASSET_CHILDREN
+                    if field in fields]
         for i, asset in enumerate(assets, start=1):
             asset_elem = etree.SubElement(
                 exp_list, ASSET)
@@ -154,55 +380,13 @@ class ExposureWriter(object):
                     point_elem, GML_POS)
                 pos_elem.text = " ".join([asset['lon'], asset['lat']])
             else:
-               raise RuntimeError('lon and lat are compulsory values for an '
-                                  'asset')
-
-            if self._value_defined_for(asset, 'area'):
-                area_elem = etree.SubElement(
-                    asset_elem, AREA)
-                area_elem.text = asset['area']
-
-            if self._value_defined_for(asset, 'coco'):
-                coco_elem = etree.SubElement(
-                    asset_elem, COCO)
-                coco_elem.text = asset['coco']
-
-            if self._value_defined_for(asset, 'deductible'):
-                deduct_elem = etree.SubElement(
-                    asset_elem, DEDUCTIBLE)
-                deduct_elem.text = asset['deductible']
-
-            if self._value_defined_for(asset, 'limit'):
-                limit_elem = etree.SubElement(
-                    asset_elem, LIMIT)
-                limit_elem.text = asset['limit']
-
-            if self._value_defined_for(asset, 'number'):
-                number_elem = etree.SubElement(
-                    asset_elem, NUMBER)
-                number_elem.text = asset['number']
-
-            if self._value_defined_for(asset, 'occupantDay'):
-                occupants_elem = etree.SubElement(
-                    asset_elem, OCCUPANTS)
-                occupants_elem.text = asset['occupantDay']
-                occupants_elem.attrib['description'] = 'day'
-
-            if self._value_defined_for(asset, 'occupantNight'):
-                occupants_elem = etree.SubElement(
-                    asset_elem, OCCUPANTS)
-                occupants_elem.text = asset['occupantNight']
-                occupants_elem.attrib['description'] = 'night'
-
-            if self._value_defined_for(asset, 'reco'):
-                reco_elem = etree.SubElement(
-                    asset_elem, RECO)
-                reco_elem.text = asset['reco']
-
-            if self._value_defined_for(asset, 'stco'):
-                stco_elem = etree.SubElement(
-                    asset_elem, STCO)
-                stco_elem.text = asset['stco']
+                raise RuntimeError('lon and lat are compulsory values for an '
+                                   'asset')
+
+            for field, tag, attrib in emitters:
+                value = asset[field]
+                if value != NO_VALUE:
+                    etree.SubElement(asset_elem, tag, attrib).text = value
 
             if self._value_defined_for(asset, 'taxonomy'):
                 taxonomy_elem = etree.SubElement(
@@ -224,7 +408,7 @@ class VulnerabilityWriter(object):
         root_elem = self._write_header(metadata)
         root_elem = self._write_vuln_def(root_elem, vuln_definitions)
         tree = etree.ElementTree(root_elem)
-        with open(filename, 'w') as output_file:
+        with open_file(filename, 'w') as output_file:
             tree.write(output_file, xml_declaration=True,
                 encoding='utf-8', pretty_print=True)
 
@@ -0,0 +1,102 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import errno
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from nrml_utils.cache import ExposureCache
+
+EXPOSURE_TXT = os.path.join(os.path.dirname(__file__), 'data',
+                            'example_exposure.txt')
+
+
+class AnExposureCacheShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_filename = os.path.join(self.tmpdir, 'exposure.txt')
+        shutil.copy(EXPOSURE_TXT, self.input_filename)
+        self.cache = ExposureCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_reuse_the_parsed_exposure(self):
+        metadata, table = self.cache.read(self.input_filename)
+        key = self.cache.key(self.input_filename)
+        cached_metadata, cached_table = self.cache.load(key)
+
+        self.assertEqual(metadata, cached_metadata)
+        self.assertEqual(table.taxonomies, cached_table.taxonomies)
+        numpy.testing.assert_array_equal(table['stco'], cached_table['stco'])
+        numpy.testing.assert_array_equal(table['taxonomy'],
+                                         cached_table['taxonomy'])
+
+    def test_fall_back_to_parsing_when_the_input_changes(self):
+        _, table = self.cache.read(self.input_filename)
+        with open(self.input_filename, 'a') as txtfile:
+            txtfile.write('28.7025,40.9925,RC_MR_LC,1,,,,,,,,\n')
+
+        _, changed_table = self.cache.read(self.input_filename)
+
+        self.assertEqual(len(table) + 1, len(changed_table))
+        self.assertEqual(1.0, changed_table['stco'][-1])
+
+    def test_evict_the_least_recently_used_entries(self):
+        _, table = self.cache.read(self.input_filename)
+        first_key = self.cache.key(self.input_filename)
+        self.cache.max_bytes = table.nbytes
+        with open(self.input_filename, 'a') as txtfile:
+            txtfile.write('\n')
+
+        self.cache.read(self.input_filename)
+
+        self.assertIsNone(self.cache.load(first_key))
+        self.assertIsNotNone(
+            self.cache.load(self.cache.key(self.input_filename)))
+
+    def test_not_evict_the_entries_being_written(self):
+        _, table = self.cache.read(self.input_filename)
+        self.cache.max_bytes = 0
+        tmp_dir = os.path.join(self.cache.cache_dir,
+                               self.cache.TMP_PREFIX + 'entry')
+        os.mkdir(tmp_dir)
+
+        self.cache.evict()
+
+        self.assertTrue(os.path.isdir(tmp_dir))
+        self.assertIsNone(self.cache.load(
+            self.cache.key(self.input_filename)))
+
+    def test_skip_the_entries_it_cannot_write(self):
+        metadata, table = self.cache.read(self.input_filename)
+
+        def full_disk(*args):
+            raise IOError(errno.ENOSPC, 'No space left on device')
+        save, numpy.save = numpy.save, full_disk
+        try:
+            self.cache.store('other-key', metadata, table)
+        finally:
+            numpy.save = save
+
+        self.assertIsNone(self.cache.load('other-key'))
+        self.assertEqual(
+            sorted([self.cache.INDEX, self.cache.key(self.input_filename)]),
+            sorted(os.listdir(self.cache.cache_dir)))
@@ -0,0 +1,73 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import bz2
+import gzip
+import os
+import shutil
+import tempfile
+
+from nrml_utils.compression import OPENERS, open_file
+from nrml_utils.pipeline import convert_exposure
+from nrml_utils.reader import ExposureNRMLReader
+from nrml_utils.validation import validate
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+EXPOSURE_TXT = os.path.join(DATA_DIR, 'example_exposure.txt')
+
+
+class CompressedFilesShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(EXPOSURE_TXT, 'rb') as txtfile:
+            self.content = txtfile.read()
+        convert_exposure(EXPOSURE_TXT, os.path.join(self.tmpdir, 'plain.xml'))
+        with open(os.path.join(self.tmpdir, 'plain.xml'), 'rb') as xmlfile:
+            self.expected = xmlfile.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_be_chosen_from_the_extension(self):
+        for extension, opener in [('.gz', gzip.GzipFile),
+                                  ('.bz2', bz2.BZ2File)]:
+            filename = os.path.join(self.tmpdir, 'exposure.txt' + extension)
+            with open_file(filename, 'w') as compressed:
+                self.assertTrue(isinstance(compressed, opener))
+                compressed.write(self.content)
+            with open(filename, 'rb') as raw:
+                self.assertNotEqual(self.content, raw.read())
+            with open_file(filename) as compressed:
+                self.assertEqual(self.content, compressed.read())
+
+    def test_be_converted_and_validated(self):
+        for extension in sorted(OPENERS):
+            input_filename = os.path.join(self.tmpdir,
+                                          'exposure.txt' + extension)
+            output_filename = os.path.join(self.tmpdir,
+                                           'exposure.xml' + extension)
+            with open_file(input_filename, 'w') as compressed:
+                compressed.write(self.content)
+
+            # compressed inputs are always converted serially
+            convert_exposure(input_filename, output_filename, workers=2)
+
+            with open_file(output_filename) as xmlfile:
+                self.assertEqual(self.expected, xmlfile.read())
+                self.assertEqual(
+                    7, len(ExposureNRMLReader(xmlfile).readassets()))
+            self.assertEqual([], validate(output_filename))
@@ -15,6 +15,8 @@
 
 import unittest
 import os
+import shutil
+import tempfile
 from lxml import etree
 from StringIO import StringIO
 
@@ -73,6 +75,26 @@ class AnExposureTxtReaderShould(unittest.TestCase):
         expected_assets = [first_asset, second_asset]
         self.assertEqual(expected_assets, self.exp_reader.readassets())
 
+    def test_iter_assets(self):
+        assets = self.exp_reader.iter_assets()
+
+        self.assertEqual('28.6925', next(assets)['lon'])
+        self.assertEqual('28.6975', next(assets)['lon'])
+        self.assertRaises(StopIteration, next, assets)
+
+    def test_iter_assets_validates_rows(self):
+        content = StringIO('expModId,assetCategory\n'
+                           'PAV01,buildings\n\n'
+                           'lon,lat,taxonomy,stco,number,area,reco,coco,'
+                           'occupantDay,occupantNight,deductible,limit\n'
+                           '28.6925,40.9775,RC_MR_LC,40000,,,,,,,,\n'
+                           '28.6975,40.9825,,300000,,,,,,,,\n')
+        assets = ExposureTxtReader(content).iter_assets()
+
+        self.assertEqual('40000', next(assets)['stco'])
+        self.assertRaisesRegexp(RuntimeError, 'line 6: taxonomy',
+                                next, assets)
+
 
 class AnExposureWriterShould(unittest.TestCase):
 
@@ -117,3 +139,34 @@ class AnExposureWriterShould(unittest.TestCase):
         self.assertTrue(validates_against_xml_schema(self.output_filename,
             NRML_SCHEMA_FILE))
 
+    def test_leave_out_the_fields_empty_for_all_assets(self):
+        assets = [self.first_asset, self.second_asset, self.third_asset]
+        for asset in assets:
+            asset['limit'] = ''
+
+        self.assertEqual(
+            ['area', 'coco', 'deductible', 'number', 'occupantDay', 'reco',
+             'stco'], self.writer._defined_fields(assets))
+
+        for streaming in (False, True):
+            self.writer.serialize(self.output_filename, self.metadata,
+                                  assets, streaming=streaming)
+            with open(self.output_filename, 'rb') as xmlfile:
+                content = xmlfile.read()
+            self.assertIn(b'<deductible>0.05</deductible>', content)
+            self.assertNotIn(b'<limit', content)
+            self.assertNotIn(b'description="night"', content)
+
+    def test_streaming_serialize_is_byte_compatible(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        streamed_filename = os.path.join(tmpdir, 'pippo_stream.xml')
+        assets = [self.first_asset, self.second_asset, self.third_asset]
+
+        self.writer.serialize(self.output_filename, self.metadata, assets)
+        self.writer.serialize(streamed_filename, self.metadata, iter(assets),
+                              streaming=True)
+
+        with open(self.output_filename, 'rb') as expected, \
+                open(streamed_filename, 'rb') as streamed:
+            self.assertEqual(expected.read(), streamed.read())
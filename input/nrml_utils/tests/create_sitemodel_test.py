@@ -0,0 +1,630 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import gzip
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import zlib
+from StringIO import StringIO
+
+import numpy
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir)
+sys.path.insert(0, INPUT_DIR)
+
+import create_sitemodel
+from create_sitemodel import (
+    AsciiGrid, BilGrid, GeoTiff, Vs30Points, cmd_parser,
+    est_z1pt0_z2pt5_given_v30, exposure_sites, open_raster, open_vs30,
+    raster_sites, z1pt0_z2pt5_strings)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+# the grids of the tests: cells of 0.5 degrees from 150E 30S, so that
+# the coordinates of the cell centres are exact
+XMIN = 150.0
+YMAX = -30.0
+CELLSIZE = 0.5
+NODATA = -9999
+
+
+def vs30_values(nrows, ncols, dtype='int16'):
+    """
+    A nrows x ncols grid of Vs30, with a nodata cell and a cell without
+    a positive Vs30.
+    """
+    values = (numpy.arange(nrows * ncols).reshape(nrows, ncols) % 500 +
+              150).astype(dtype)
+    values[0, 1] = NODATA
+    values[-1, -1] = 0
+    return values
+
+
+def expected_sites(values, rows=slice(None), cols=slice(None)):
+    """
+    The (lon, lat, vs30) of the cells of values with a Vs30, in the
+    rows and columns given.
+    """
+    nrows, ncols = values.shape
+    return [(XMIN + CELLSIZE * (col + 0.5), YMAX - CELLSIZE * (row + 0.5),
+             '{}'.format(values[row, col].tolist()))
+            for row in range(nrows)[rows] for col in range(ncols)[cols]
+            if values[row, col] > 0 and values[row, col] != NODATA]
+
+
+def sites(grid, **kwargs):
+    return [(float(lon), float(lat), vs30)
+            for block in raster_sites(grid, **kwargs)
+            for lon, lat, vs30 in zip(block['lon'], block['lat'],
+                                      block['vs30'])]
+
+
+def write_ascii_grid(filename, values, center=False):
+    nrows, ncols = values.shape
+    if center:
+        origin = ('xllcenter {}\nyllcenter {}\n'.format(
+            XMIN + CELLSIZE / 2, YMAX - CELLSIZE * (nrows - 0.5)))
+    else:
+        origin = 'xllcorner {}\nyllcorner {}\n'.format(
+            XMIN, YMAX - CELLSIZE * nrows)
+    opener = gzip.open if filename.endswith('.gz') else open
+    with opener(filename, 'wb') as grid_file:
+        grid_file.write(
+            'ncols {}\nnrows {}\n{}cellsize {}\nNODATA_value {}\n'.format(
+                ncols, nrows, origin, CELLSIZE, NODATA))
+        for row in values.tolist():
+            grid_file.write(' '.join('{}'.format(value) for value in row) +
+                            '\n')
+
+
+def write_bil_grid(filename, values, byteorder='I', **header):
+    nrows, ncols = values.shape
+    header = dict(dict(
+        BYTEORDER=byteorder, LAYOUT='BIL', NROWS=nrows, NCOLS=ncols,
+        NBANDS=1, NBITS=values.dtype.itemsize * 8,
+        PIXELTYPE='FLOAT' if values.dtype.kind == 'f' else 'SIGNEDINT',
+        ULXMAP=XMIN + CELLSIZE / 2, ULYMAP=YMAX - CELLSIZE / 2,
+        XDIM=CELLSIZE, YDIM=CELLSIZE, NODATA=NODATA), **header)
+    with open('{}.hdr'.format(os.path.splitext(filename)[0]), 'w') as hdr:
+        for key, value in sorted(header.items()):
+            hdr.write('{:<14}{}\n'.format(key, value))
+    values.astype(values.dtype.newbyteorder(
+        '>' if byteorder == 'M' else '<')).tofile(filename)
+
+
+def write_geotiff(filename, values, order='<', tile=None, rows_per_strip=None,
+                  deflate=False, predictor=1, pixel_is_point=False):
+    """
+    Write values as a single band GeoTIFF, in strips of rows_per_strip
+    rows or in tiles of tile (width, length) cells.
+    """
+    nrows, ncols = values.shape
+    values = values.astype(values.dtype.newbyteorder(order))
+    if tile is not None:
+        width, length = tile
+        padded = numpy.zeros((-(-nrows // length) * length,
+                              -(-ncols // width) * width), values.dtype)
+        padded[:nrows, :ncols] = values
+        blocks = [padded[row:row + length, col:col + width]
+                  for row in range(0, nrows, length)
+                  for col in range(0, ncols, width)]
+    else:
+        rows_per_strip = rows_per_strip or nrows
+        blocks = [values[row:row + rows_per_strip]
+                  for row in range(0, nrows, rows_per_strip)]
+    data = []
+    for block in blocks:
+        if predictor == 2:
+            block = block.copy()
+            block[:, 1:] = block[:, 1:] - block[:, :-1]
+        block = block.tobytes()
+        data.append(zlib.compress(block) if deflate else block)
+
+    offsets = []
+    position = 8
+    for block in data:
+        offsets.append(position)
+        position += len(block)
+    x, y = XMIN, YMAX
+    if pixel_is_point:
+        x, y = XMIN + CELLSIZE / 2, YMAX - CELLSIZE / 2
+    # (tag, type, values) with the types SHORT 3, LONG 4, DOUBLE 12 and
+    # ASCII 2
+    tags = [
+        (256, 4, [ncols]), (257, 4, [nrows]),
+        (258, 3, [values.dtype.itemsize * 8]),
+        (259, 3, [8 if deflate else 1]), (277, 3, [1]),
+        (317, 3, [predictor]),
+        (339, 3, [{'u': 1, 'i': 2, 'f': 3}[values.dtype.kind]]),
+        (33550, 12, [CELLSIZE, CELLSIZE, 0.0]),
+        (33922, 12, [0.0, 0.0, 0.0, x, y, 0.0]),
+        (34735, 3, [1, 1, 0, 1, 1025, 0, 1, 2 if pixel_is_point else 1]),
+        (42113, 2, '{}\0'.format(NODATA).encode('ascii'))]
+    if tile is not None:
+        tags += [(322, 4, [tile[0]]), (323, 4, [tile[1]]),
+                 (324, 4, offsets), (325, 4, [len(block) for block in data])]
+    else:
+        tags += [(273, 4, offsets), (278, 4, [rows_per_strip]),
+                 (279, 4, [len(block) for block in data])]
+    tags.sort()
+
+    formats = {2: 'c', 3: 'H', 4: 'I', 12: 'd'}
+    ifd = struct.pack(order + 'H', len(tags))
+    extra = b''
+    extra_position = position + 2 + 12 * len(tags) + 4
+    for tag, field_type, tag_values in tags:
+        if field_type == 2:
+            value = tag_values
+        else:
+            value = struct.pack(order + formats[field_type] * len(tag_values),
+                                *tag_values)
+        if len(value) > 4:
+            offset = extra_position + len(extra)
+            extra += value
+            value = struct.pack(order + 'I', offset)
+        ifd += struct.pack(order + 'HHI', tag, field_type,
+                           len(tag_values)) + value.ljust(4, b'\0')
+    with open(filename, 'wb') as tiff:
+        tiff.write((b'II' if order == '<' else b'MM') +
+                   struct.pack(order + 'HI', 42, position))
+        tiff.write(b''.join(data))
+        tiff.write(ifd + struct.pack(order + 'I', 0) + extra)
+
+
+class TheSiteDepthsShould(unittest.TestCase):
+
+    def test_be_written_as_by_the_scalar_relations(self):
+        # 1360 m/s gives a z1pt0 of exactly 1 m
+        vs30 = list(range(98, 6000)) + [1360]
+
+        z1pt0, z2pt5 = z1pt0_z2pt5_strings(['%d' % value for value in vs30])
+
+        for value, z1pt0_text, z2pt5_text in zip(vs30, z1pt0, z2pt5):
+            expected = est_z1pt0_z2pt5_given_v30(value)
+            self.assertEqual(['{}'.format(z) for z in expected],
+                             [z1pt0_text, z2pt5_text])
+        self.assertEqual('1.0', z1pt0[-1])
+
+    def test_truncate_the_vs30(self):
+        z1pt0, z2pt5 = z1pt0_z2pt5_strings(['760.9', '760', '761'])
+
+        self.assertEqual(z1pt0[0], z1pt0[1])
+        self.assertNotEqual(z1pt0[1], z1pt0[2])
+        self.assertEqual(z2pt5[0], z2pt5[1])
+
+    def test_reject_a_vs30_that_is_not_a_number(self):
+        self.assertRaisesRegexp(RuntimeError, 'vs30 must be a number',
+                                z1pt0_z2pt5_strings, ['760', 'rock'])
+        self.assertRaisesRegexp(RuntimeError, 'vs30 must be a finite',
+                                z1pt0_z2pt5_strings, ['nan'])
+
+
+class AVs30GridShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def test_read_an_ascii_grid_from_its_corner_or_its_centre(self):
+        values = vs30_values(3, 4)
+        write_ascii_grid(self._path('corner.asc'), values)
+        write_ascii_grid(self._path('centre.asc.gz'), values, center=True)
+
+        for name in ('corner.asc', 'centre.asc.gz'):
+            grid = open_raster(self._path(name))
+
+            self.assertTrue(isinstance(grid, AsciiGrid))
+            self.assertEqual((XMIN, YMAX), (grid.xmin, grid.ymax))
+            self.assertEqual(expected_sites(values), sites(grid))
+
+    def test_keep_the_values_of_an_ascii_grid_as_written(self):
+        values = vs30_values(2, 3, dtype='float64') + 0.25
+        write_ascii_grid(self._path('vs30.asc'), values)
+
+        self.assertEqual('150.25', sites(open_raster(
+            self._path('vs30.asc')))[0][2])
+
+    def test_read_a_bil_grid_in_either_byte_order(self):
+        values = vs30_values(3, 4)
+        for byteorder in ('I', 'M'):
+            filename = self._path('vs30_{}.bil'.format(byteorder))
+            write_bil_grid(filename, values, byteorder)
+
+            grid = open_raster(filename)
+
+            self.assertTrue(isinstance(grid, BilGrid))
+            self.assertEqual(expected_sites(values), sites(grid))
+
+    def test_read_a_float_bil_grid_after_the_skipped_bytes(self):
+        values = vs30_values(3, 4, dtype='float32') + 0.5
+        filename = self._path('vs30.bil')
+        write_bil_grid(filename, values, SKIPBYTES=8)
+        with open(filename, 'rb') as bil:
+            data = bil.read()
+        with open(filename, 'wb') as bil:
+            bil.write(b'\0' * 8 + data)
+
+        self.assertEqual(expected_sites(values), sites(open_raster(filename)))
+
+    def test_reject_the_bil_cells_it_cannot_read(self):
+        filename = self._path('vs30.bil')
+        for nbits, pixel_type in ((4, 'UNSIGNEDINT'), (1, 'UNSIGNEDINT'),
+                                  (12, 'SIGNEDINT'), (16, 'FLOAT')):
+            write_bil_grid(filename, vs30_values(3, 4), NBITS=nbits,
+                           PIXELTYPE=pixel_type)
+
+            self.assertRaisesRegexp(
+                RuntimeError, '{}-bit {} cells'.format(nbits, pixel_type),
+                BilGrid, filename)
+
+    def test_read_a_striped_geotiff(self):
+        values = vs30_values(20, 35)
+        for rows_per_strip in (1, 3, 20, 64):
+            filename = self._path('strips.tif')
+            write_geotiff(filename, values, rows_per_strip=rows_per_strip)
+
+            grid = open_raster(filename)
+
+            self.assertTrue(isinstance(grid, GeoTiff))
+            self.assertEqual(expected_sites(values), sites(grid))
+
+    def test_read_a_tiled_geotiff(self):
+        values = vs30_values(20, 35)
+        for tile in ((16, 16), (32, 16), (48, 32)):
+            filename = self._path('tiles.tif')
+            write_geotiff(filename, values, tile=tile)
+
+            self.assertEqual(expected_sites(values),
+                             sites(open_raster(filename)))
+
+    def test_read_a_deflated_geotiff_with_or_without_predictor(self):
+        values = vs30_values(20, 35)
+        for options in (dict(rows_per_strip=3), dict(tile=(16, 16))):
+            for predictor in (1, 2):
+                for order in ('<', '>'):
+                    filename = self._path('deflated.tif')
+                    write_geotiff(filename, values, order, deflate=True,
+                                  predictor=predictor, **options)
+
+                    self.assertEqual(expected_sites(values),
+                                     sites(open_raster(filename)))
+
+    def test_read_a_float_geotiff(self):
+        values = vs30_values(5, 6, dtype='float32') + 0.5
+        filename = self._path('vs30.tif')
+        write_geotiff(filename, values, order='>', rows_per_strip=2,
+                      deflate=True)
+
+        self.assertEqual(expected_sites(values), sites(open_raster(filename)))
+
+    def test_reject_a_float_geotiff_with_predictor(self):
+        filename = self._path('vs30.tif')
+        write_geotiff(filename, vs30_values(5, 6, dtype='float32'),
+                      deflate=True, predictor=2)
+
+        self.assertRaisesRegexp(RuntimeError, 'single band GeoTIFF',
+                                GeoTiff, filename)
+
+    def test_place_a_pixel_is_point_geotiff_on_the_cell_centres(self):
+        values = vs30_values(3, 4)
+        write_geotiff(self._path('area.tif'), values)
+        write_geotiff(self._path('point.tif'), values, pixel_is_point=True)
+
+        area = open_raster(self._path('area.tif'))
+        point = open_raster(self._path('point.tif'))
+
+        self.assertEqual((XMIN, YMAX), (point.xmin, point.ymax))
+        self.assertEqual(sites(area), sites(point))
+
+    def test_take_the_cells_whose_centre_is_in_the_bbox(self):
+        values = vs30_values(3, 4)
+        write_geotiff(self._path('vs30.tif'), values)
+        grid = open_raster(self._path('vs30.tif'))
+
+        # the edges of the bbox go through the centres of the cells of
+        # the columns 1 and 2 and of the rows 0 and 2
+        bbox = (150.75, -31.25, 151.25, -30.25)
+        self.assertEqual(expected_sites(values, cols=slice(1, 3)),
+                         sites(grid, bbox=bbox))
+        # and just inside them
+        bbox = (150.7500001, -31.2499999, 151.2499999, -30.2500001)
+        self.assertEqual(expected_sites(values, rows=slice(1, 2),
+                                        cols=slice(2, 2)),
+                         sites(grid, bbox=bbox))
+        # a bbox larger than the grid is clipped to it
+        self.assertEqual(expected_sites(values),
+                         sites(grid, bbox=(140, -40, 160, -20)))
+        self.assertEqual([], sites(grid, bbox=(140, -40, 149, -35)))
+
+    def test_take_every_step_cell_of_the_bbox(self):
+        values = vs30_values(20, 35)
+        write_geotiff(self._path('vs30.tif'), values, rows_per_strip=3)
+        grid = open_raster(self._path('vs30.tif'))
+
+        self.assertEqual(
+            expected_sites(values, rows=slice(0, None, 3),
+                           cols=slice(0, None, 3)),
+            sites(grid, step=3))
+        # cells 3 to 15 across and 2 to 9 down
+        bbox = (151.75, -34.75, 157.75, -31.25)
+        self.assertEqual(
+            expected_sites(values, rows=slice(2, 10, 2),
+                           cols=slice(3, 16, 2)),
+            sites(grid, bbox=bbox, step=2))
+
+    def test_read_the_bbox_as_esri2nrml_does(self):
+        args = cmd_parser().parse_args(
+            ['-r', 'vs30.tif', '--bbox=150.75/-31.25/151.25/-30.25'])
+
+        self.assertEqual((150.75, -31.25, 151.25, -30.25), args.bbox)
+        stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+        try:
+            self.assertRaises(SystemExit, cmd_parser().parse_args,
+                              ['--bbox', '150.75', '-31.25', '151.25',
+                               '-30.25'])
+        finally:
+            sys.stderr.close()
+            sys.stderr = stderr
+
+    def test_sample_the_cells_of_the_points(self):
+        values = vs30_values(3, 4)
+        write_bil_grid(self._path('vs30.bil'), values)
+        grid = open_raster(self._path('vs30.bil'))
+
+        # a cell with a Vs30, the nodata cell, the last cell with a
+        # Vs30, the cell without one and four points out of the grid
+        lons = numpy.array([150.1, 150.6, 151.4, 151.9, 149.9, 150.1,
+                            150.1, 152.1])
+        lats = numpy.array([-30.1, -30.1, -31.4, -31.4, -30.1, -29.9,
+                            -31.6, -30.1])
+
+        self.assertEqual(
+            ['150', None, '{}'.format(values[2, 2]), None, None, None, None,
+             None], grid.sample(lons, lats))
+
+
+def nearest_points(points, lons, lats):
+    """
+    The index of the nearest of the points to each site, the first one
+    of those at the same distance, comparing all the distances.
+    """
+    distance = numpy.hypot(points.lons[None, :] - lons[:, None],
+                           points.lats[None, :] - lats[:, None])
+    return numpy.argmin(distance, axis=1).tolist()
+
+
+class Vs30PointsShould(unittest.TestCase):
+
+    def setUp(self):
+        self.random = numpy.random.RandomState(42)
+
+    def test_find_the_nearest_points(self):
+        lons = self.random.uniform(150, 152, 500)
+        lats = self.random.uniform(-34, -33, 500)
+        points = Vs30Points(lons, lats, range(500))
+        # sites inside the index, around it and far from it
+        site_lons = self.random.uniform(149, 153, 400)
+        site_lats = self.random.uniform(-35, -32, 400)
+        site_lons[:3] = [100, 150, 151]
+        site_lats[:3] = [-33.5, 0, -33.5]
+
+        self.assertEqual(nearest_points(points, site_lons, site_lats),
+                         points.nearest(site_lons, site_lats).tolist())
+
+    def test_find_the_nearest_points_along_a_line(self):
+        lons = self.random.uniform(150, 152, 50)
+        points = Vs30Points(lons, numpy.zeros(50) - 33, range(50))
+        site_lons = self.random.uniform(149, 153, 100)
+        site_lats = self.random.uniform(-33.1, -32.9, 100)
+
+        self.assertEqual(nearest_points(points, site_lons, site_lats),
+                         points.nearest(site_lons, site_lats).tolist())
+
+    def test_take_the_first_of_the_points_as_near(self):
+        # a lattice of points, in a shuffled order, with sites half way
+        # between them, as near to 2 or 4 of them, and sites on them
+        nodes = numpy.array([(lon, lat) for lon in range(10)
+                             for lat in range(10)], dtype=float)
+        nodes = nodes[self.random.permutation(len(nodes))]
+        points = Vs30Points(nodes[:, 0], nodes[:, 1], range(len(nodes)))
+        site_lons = numpy.append(4.5, self.random.randint(-4, 24, 300) / 2.)
+        site_lats = numpy.append(4.5, self.random.randint(-4, 24, 300) / 2.)
+
+        nearest = points.nearest(site_lons, site_lats).tolist()
+
+        self.assertEqual(nearest_points(points, site_lons, site_lats),
+                         nearest)
+        self.assertEqual(min(
+            i for i, (lon, lat) in enumerate(nodes.tolist())
+            if (lon, lat) in [(4, 4), (5, 4), (4, 5), (5, 5)]), nearest[0])
+
+    def test_search_the_rings_beyond_the_nearest_cell(self):
+        # clustered points, with empty cells between the clusters, and
+        # sites in the cells around them
+        centres = self.random.uniform(0, 10, (5, 2))
+        lons, lats = (centres.repeat(40, axis=0) +
+                      self.random.normal(0, 0.05, (200, 2))).T
+        points = Vs30Points(lons, lats, range(200))
+        site_lons = self.random.uniform(-1, 11, 500)
+        site_lats = self.random.uniform(-1, 11, 500)
+
+        nearest = points.nearest(site_lons, site_lats)
+
+        self.assertEqual(nearest_points(points, site_lons, site_lats),
+                         nearest.tolist())
+        # the distances of the nearest points around and beyond the
+        # rings of the cells of the sites
+        rings = numpy.hypot(points.lons[nearest] - site_lons,
+                            points.lats[nearest] - site_lats
+                            ) // points.cellsize
+        self.assertTrue({0, 1, 2, 3}.issubset(rings.tolist()))
+
+    def test_have_a_single_point(self):
+        points = Vs30Points([150.0], [-33.0], ['760'])
+
+        self.assertEqual(['760', '760'], points.sample(
+            numpy.array([150.0, 10.0]), numpy.array([-33.0, 10.0])))
+
+    def test_need_some_points(self):
+        self.assertRaisesRegexp(RuntimeError, 'there are no Vs30 points',
+                                Vs30Points, [], [], [])
+
+
+class TheExposureSitesShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.vs30 = Vs30Points([115.7, 28.7], [-32.8, 41.0], ['400', '760'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as output_file:
+            output_file.write(text)
+        return filename
+
+    def _locations(self, *locations):
+        return self._write('exposure.csv', 'lon,lat,taxonomy\n' + ''.join(
+            '{},{},RC\n'.format(lon, lat) for lon, lat in locations))
+
+    def test_read_the_locations_of_every_exposure_format(self):
+        for name in ('example_exposure.txt', 'example_exposure.xml',
+                     'example_NEXIS.csv', 'example_NEXIS.xml'):
+            columns, assets = exposure_sites(os.path.join(DATA_DIR, name),
+                                             self.vs30)
+
+            vs30 = '400' if 'NEXIS' in name else '760'
+            self.assertEqual([vs30] * len(columns['lon']), columns['vs30'])
+
+        columns, assets = exposure_sites(
+            os.path.join(DATA_DIR, 'example_NEXIS.xml'), self.vs30)
+        self.assertEqual(2, assets)
+        self.assertEqual(['115.66984489', '115.69857'], columns['lon'])
+        self.assertEqual(['-32.78209594', '-32.78188'], columns['lat'])
+
+    def test_keep_the_first_of_the_duplicate_sites(self):
+        filename = self._locations(
+            ('115.7', '-32.8'), ('115.6', '-32.8'), ('115.70', '-32.8'),
+            ('115.6', '-32.9'), ('115.6', '-32.8'))
+
+        columns, assets = exposure_sites(filename, self.vs30)
+
+        self.assertEqual(5, assets)
+        self.assertEqual(['115.7', '115.6', '115.6'], columns['lon'])
+        self.assertEqual(['-32.8', '-32.8', '-32.9'], columns['lat'])
+
+    def test_snap_the_sites_to_the_grid(self):
+        filename = self._locations(
+            ('115.71', '-32.81'), ('115.74', '-32.76'), ('115.76', '-32.8'),
+            ('115.749', '-32.751'), ('115.3', '-32.3'))
+
+        columns, assets = exposure_sites(filename, self.vs30, spacing=0.1)
+
+        self.assertEqual(5, assets)
+        # without the float noise of 1157 * 0.1
+        self.assertEqual(['115.7', '115.8', '115.3'], columns['lon'])
+        self.assertEqual(['-32.8', '-32.8', '-32.3'], columns['lat'])
+
+        # a spacing that is not the inverse of an integer
+        columns, _ = exposure_sites(filename, self.vs30, spacing=0.3)
+        self.assertEqual(['115.8', '115.2'], columns['lon'])
+        self.assertEqual(['-32.7', '-32.4'], columns['lat'])
+
+    def test_keep_the_sites_of_a_fine_grid_apart(self):
+        filename = self._locations(
+            ('115.7', '-32.8'), ('115.7000000625', '-32.8'),
+            ('115.700000125', '-32.8000000625'),
+            ('115.7000000001', '-32.8'), ('115.7000000002', '-32.8'))
+
+        columns, _ = exposure_sites(filename, self.vs30, spacing=6.25e-8)
+        self.assertEqual(['115.7', '115.7000000625', '115.700000125'],
+                         columns['lon'])
+        self.assertEqual(['-32.8', '-32.8', '-32.8000000625'],
+                         columns['lat'])
+
+        columns, _ = exposure_sites(filename, self.vs30, spacing=1e-10)
+        self.assertEqual(
+            ['115.7', '115.7000000625', '115.700000125', '115.7000000001',
+             '115.7000000002'], columns['lon'])
+
+    def test_report_the_sites_without_vs30(self):
+        values = vs30_values(3, 4)
+        grid_filename = os.path.join(self.tmpdir, 'vs30.bil')
+        write_bil_grid(grid_filename, values)
+        # on a cell, on the nodata cell, on the cell without Vs30 and
+        # out of the grid
+        filename = self._locations(
+            ('150.1', '-30.1'), ('150.6', '-30.1'), ('151.9', '-31.4'),
+            ('149.9', '-30.1'))
+
+        self.assertRaisesRegexp(
+            RuntimeError, '^3 sites have no Vs30, e.g. 150.6 -30.1$',
+            exposure_sites, filename, open_vs30(grid_filename))
+
+        columns, _ = exposure_sites(self._locations(('150.1', '-30.1')),
+                                    open_vs30(grid_filename))
+        self.assertEqual(['150'], columns['vs30'])
+
+
+class TheCommandLineShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.grid_filename = os.path.join(self.tmpdir, 'vs30.bil')
+        write_bil_grid(self.grid_filename, vs30_values(3, 4))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _main(self, *args):
+        argv, stderr = sys.argv, sys.stderr
+        sys.argv = ['create_sitemodel'] + list(args)
+        sys.stderr = StringIO()
+        try:
+            create_sitemodel.main()
+        except SystemExit:
+            return sys.stderr.getvalue()
+        finally:
+            sys.argv, sys.stderr = argv, stderr
+
+    def test_reject_bbox_and_step_without_a_raster(self):
+        exposure = os.path.join(DATA_DIR, 'example_exposure.txt')
+        site_model = os.path.join(DATA_DIR, 'example_site_model.csv')
+        for args in (['-i', site_model, '--step', '2'],
+                     ['-i', site_model, '--step', '1'],
+                     ['-i', site_model, '--bbox', '150/-31/151/-30'],
+                     ['-e', exposure, '--vs30-file', self.grid_filename,
+                      '--bbox', '150/-31/151/-30']):
+            self.assertIn('--bbox and --step go with --raster-file',
+                          self._main(*args))
+
+    def test_take_bbox_and_step_with_a_raster(self):
+        self.assertIsNone(self._main('-r', self.grid_filename, '--step', '2',
+                                     '--bbox', '150/-31/151/-30'))
+
+        self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'vs30.xml')))
@@ -0,0 +1,597 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+from StringIO import StringIO
+
+import numpy
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir)
+sys.path.insert(0, INPUT_DIR)
+
+import eqrm_csv2NRML
+from eqrm_csv2NRML import (EQRM_FLOAT_FIELDNAMES, TEXT, ExposureTxtReader,
+                           ExposureWriter, PreviousConversion)
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+FIELDNAMES = ExposureTxtReader.EQRM_FIELDNAMES
+METADATA = (
+    'expModId,category,description,taxonomySource,stcoType,stcoUnit,'
+    'areaType,areaUnit\n'
+    'OQ_exposure,buildings,OpenQuake Exposure Model,NEXIS v9.0 HAZUS,'
+    'per_area,AUD,aggregated,SQM\n')
+BLDG_MAPPING = {'W1TIMBERMETAL': 'W1TM'}
+
+
+def eqrm_row(i, **values):
+    """
+    An EQRM csv row of asset i, with the given fields changed.
+    """
+    row = dict(
+        LID='LID%03d' % i, LATITUDE='-33.%04d' % i, LONGITUDE='151.20',
+        GCC_CODE='1GSYD', SA1_CODE='1010%d' % i, LGA_CODE='10050',
+        LGA_NAME='Albury (C)', SUBURB='SUBURB%d' % (i % 3),
+        POSTCODE='2640', HAZUS_STRUCTURE_CLASSIFICATION='W1',
+        GA_STRUCTURE_CLASSIFICATION='W1TIMBERMETAL',
+        STRUCTURE_CATEGORY='Building', HAZUS_USAGE='RES1', FCB_USAGE='111',
+        SITE_CLASS='C', YEAR_BUILT='1947 - 1961',
+        CONTENTS_COST_DENSITY='300.00', BUILDING_COST_DENSITY='1200.5',
+        FLOOR_AREA='%d.50' % (100 + i), POPULATION='2.5',
+        SURVEY_FACTOR='1')
+    row.update(values)
+    return ','.join(row[fieldname] for fieldname in FIELDNAMES) + '\n'
+
+
+def eqrm_csv(rows):
+    return StringIO(','.join(FIELDNAMES) + '\n' + ''.join(rows))
+
+
+class AnEQRMChunkReaderShould(unittest.TestCase):
+
+    def setUp(self):
+        self.rows = [eqrm_row(i) for i in range(7)]
+        # blank lines are not assets, wherever they fall
+        self.rows.insert(3, '\n')
+        self.rows.insert(4, '\n')
+
+    def _chunks(self, chunk_size):
+        reader = ExposureTxtReader(None, eqrm_csv(self.rows))
+        return list(reader.iter_chunks(chunk_size))
+
+    def test_type_the_numeric_columns(self):
+        chunk, = self._chunks(100)
+
+        for fieldname in EQRM_FLOAT_FIELDNAMES:
+            self.assertEqual(numpy.float64, chunk[fieldname].dtype)
+        self.assertEqual(100.5, chunk['FLOOR_AREA'][0])
+        self.assertEqual(-33.0006, chunk['LATITUDE'][-1])
+        self.assertEqual('100.50', chunk[TEXT]['FLOOR_AREA'][0])
+        self.assertEqual(('LID000', 'LID001'), chunk['LID'][:2])
+
+    def test_read_the_same_columns_whatever_the_chunk_size(self):
+        whole, = self._chunks(100)
+
+        for chunk_size in (1, 2, 3, 4, 9):
+            chunks = self._chunks(chunk_size)
+            self.assertTrue(all(len(chunk['LID']) <= chunk_size
+                                for chunk in chunks))
+            for fieldname in FIELDNAMES:
+                column = [value for chunk in chunks
+                          for value in chunk[fieldname]]
+                self.assertEqual(list(whole[fieldname]), column)
+                text = [value for chunk in chunks
+                        for value in chunk[TEXT][fieldname]]
+                self.assertEqual(list(whole[TEXT][fieldname]), text)
+
+    def test_keep_empty_numbers_as_nan(self):
+        self.rows[0] = eqrm_row(0, POPULATION='', BUILDING_COST_DENSITY='')
+        chunk, = self._chunks(100)
+
+        self.assertTrue(numpy.isnan(chunk['POPULATION'][0]))
+        self.assertTrue(numpy.isnan(chunk['BUILDING_COST_DENSITY'][0]))
+        self.assertEqual('', chunk[TEXT]['POPULATION'][0])
+
+    def test_report_the_asset_of_a_malformed_number(self):
+        # the sixth asset, after the blank lines, in the third chunk
+        self.rows[7] = eqrm_row(5, FLOOR_AREA='12.5m2')
+
+        for chunk_size in (2, 100):
+            self.assertRaisesRegexp(
+                RuntimeError, "asset 6: FLOOR_AREA must be a number, not "
+                "'12.5m2'", self._chunks, chunk_size)
+
+    def test_report_a_malformed_coordinate(self):
+        self.rows[0] = eqrm_row(0, LATITUDE='-33.5S')
+
+        self.assertRaisesRegexp(RuntimeError, 'asset 1: LATITUDE',
+                                self._chunks, 100)
+
+    def test_report_rows_with_missing_fields(self):
+        self.rows[1] = self.rows[1].rsplit(',', 1)[0] + '\n'
+
+        self.assertRaisesRegexp(RuntimeError, 'an asset is made of 21',
+                                self._chunks, 100)
+
+    def test_match_the_typed_columns_of_the_asset_dicts(self):
+        reader = ExposureTxtReader(None, eqrm_csv(self.rows))
+        assets = reader.readassets()
+        chunk = ExposureTxtReader.to_columns(
+            [[asset[fieldname] for asset in assets]
+             for fieldname in FIELDNAMES])
+        whole, = self._chunks(100)
+
+        for fieldname in EQRM_FLOAT_FIELDNAMES:
+            numpy.testing.assert_array_equal(whole[fieldname],
+                                             chunk[fieldname])
+
+
+class TheVulnerabilityClassesShould(unittest.TestCase):
+
+    MAPPING = {'W1TIMBERMETAL': 'W1TM', 'W2STEEL': 'W2S',
+               'URMLOAD': 'URML', 'C1MEDIUM': 'C1M'}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_match_the_class_of_each_asset(self):
+        years = ['1945', '1946', '1946.5', '1947', '1995', '1996', '1997',
+                 '1900 - 1946', '1947 - 1961', '1961-1996', '1996 - 1997',
+                 '2011']
+        ga_classes = sorted(self.MAPPING) * len(years)
+        years_built = [year for year in years for _ in self.MAPPING]
+
+        self.assertEqual(
+            [eqrm_csv2NRML.map_vul_class(ga_class, year, self.MAPPING)
+             for ga_class, year in zip(ga_classes, years_built)],
+            eqrm_csv2NRML.map_vul_classes(ga_classes, years_built,
+                                          self.MAPPING))
+
+    def test_put_an_unknown_year_before_the_cut_off(self):
+        ga_classes = ['W1TIMBERMETAL', 'C1MEDIUM'] * 3
+        years_built = ['', '', 'unknown', 'unknown', 'Pre 1900', 'Pre 1900']
+
+        taxonomies = eqrm_csv2NRML.map_vul_classes(ga_classes, years_built,
+                                                   self.MAPPING)
+
+        self.assertEqual(['W1TIMBERMETAL_Pre1945', 'C1MEDIUM_Pre1996'] * 3,
+                         taxonomies)
+        self.assertEqual(
+            [eqrm_csv2NRML.map_vul_class(ga_class, year, self.MAPPING)
+             for ga_class, year in zip(ga_classes, years_built)],
+            taxonomies)
+
+    def test_report_all_the_unmapped_classes_at_once(self):
+        self.assertRaisesRegexp(
+            RuntimeError, '^2 building classes are not in the mapping: '
+            'S1LIGHT, URMHEAVY$', eqrm_csv2NRML.map_vul_classes,
+            ['URMHEAVY', 'W1TIMBERMETAL', 'S1LIGHT', 'URMHEAVY'],
+            ['2000'] * 4, self.MAPPING)
+
+    def test_report_the_unmapped_classes_of_all_the_chunks(self):
+        rows = [eqrm_row(i) for i in range(6)]
+        rows[0] = eqrm_row(0, GA_STRUCTURE_CLASSIFICATION='URMHEAVY')
+        rows[5] = eqrm_row(5, GA_STRUCTURE_CLASSIFICATION='S1LIGHT')
+        reader = ExposureTxtReader(StringIO(METADATA), eqrm_csv(rows))
+        output = os.path.join(self.tmpdir, 'exposure.xml')
+
+        self.assertRaisesRegexp(
+            RuntimeError, '^2 building classes are not in the mapping: '
+            'S1LIGHT, URMHEAVY$', ExposureWriter(BLDG_MAPPING)
+            .serialize_chunks, output, reader.metadata,
+            reader.iter_chunks(2))
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+
+class TheBuildingMappingShould(unittest.TestCase):
+
+    MAPPING_CSV = 'NEXIS_CONS,MAPPING2\nW1TIMBERMETAL,W1TM\n'
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.mapping_file = self._write('mapping.csv', self.MAPPING_CSV)
+        self.cache_file = eqrm_csv2NRML.MAPPING_CACHE.format(
+            self.mapping_file)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as output_file:
+            output_file.write(text)
+        return filename
+
+    def _pickle(self, mapping):
+        # a cache entry of the current csv, with another mapping
+        stat = os.stat(self.mapping_file)
+        with open(self.cache_file, 'wb') as cache_file:
+            pickle.dump((stat.st_size, stat.st_mtime, mapping), cache_file)
+
+    def _main(self, *args):
+        metadata_file = self._write('header.csv', METADATA)
+        input_file = self._write('nexis.csv', eqrm_csv(
+            [eqrm_row(i) for i in range(3)]).getvalue())
+        output_file = os.path.join(self.tmpdir, 'exposure.xml')
+        argv = sys.argv
+        sys.argv = ['eqrm_csv2NRML', '-m', metadata_file, '-i', input_file,
+                    '-b', self.mapping_file, '-o', output_file] + list(args)
+        try:
+            eqrm_csv2NRML.main()
+        finally:
+            sys.argv = argv
+        return output_file
+
+    def test_read_the_mapping_back_from_the_cache(self):
+        mapping = eqrm_csv2NRML.read_bldg_mapping(self.mapping_file)
+        self.assertEqual(BLDG_MAPPING, mapping)
+        self.assertTrue(os.path.isfile(self.cache_file))
+
+        self._pickle({'W1TIMBERMETAL': 'CACHED'})
+
+        self.assertEqual({'W1TIMBERMETAL': 'CACHED'},
+                         eqrm_csv2NRML.read_bldg_mapping(self.mapping_file))
+
+    def test_parse_the_csv_again_when_its_size_changes(self):
+        eqrm_csv2NRML.read_bldg_mapping(self.mapping_file)
+        self._write('mapping.csv', self.MAPPING_CSV + 'URMLOAD,URML\n')
+
+        self.assertEqual(dict(BLDG_MAPPING, URMLOAD='URML'),
+                         eqrm_csv2NRML.read_bldg_mapping(self.mapping_file))
+
+    def test_parse_the_csv_again_when_its_mtime_changes(self):
+        eqrm_csv2NRML.read_bldg_mapping(self.mapping_file)
+        mtime = os.stat(self.mapping_file).st_mtime
+        # the same size, but another mapping
+        self._write('mapping.csv', self.MAPPING_CSV.replace('W1TM', 'W1XX'))
+        os.utime(self.mapping_file, (mtime + 10, mtime + 10))
+
+        self.assertEqual({'W1TIMBERMETAL': 'W1XX'},
+                         eqrm_csv2NRML.read_bldg_mapping(self.mapping_file))
+
+    def test_neither_read_nor_write_the_cache_when_disabled(self):
+        self.assertEqual(BLDG_MAPPING, eqrm_csv2NRML.read_bldg_mapping(
+            self.mapping_file, cache=False))
+        self.assertFalse(os.path.exists(self.cache_file))
+
+        self._pickle({'W1TIMBERMETAL': 'CACHED'})
+
+        self.assertEqual(BLDG_MAPPING, eqrm_csv2NRML.read_bldg_mapping(
+            self.mapping_file, cache=False))
+
+    def test_not_cache_the_mapping_with_no_mapping_cache(self):
+        output_file = self._main('--no-mapping-cache')
+
+        self.assertTrue(os.path.isfile(output_file))
+        self.assertFalse(os.path.exists(self.cache_file))
+
+    def test_convert_when_the_cache_cannot_be_written(self):
+        # a directory in its place fails the write even for root, for
+        # whom a read-only directory is still writable
+        os.mkdir(self.cache_file)
+
+        self.assertEqual(BLDG_MAPPING,
+                         eqrm_csv2NRML.read_bldg_mapping(self.mapping_file))
+        output_file = self._main()
+
+        with open(output_file) as xmlfile:
+            self.assertIn('taxonomy="W1TIMBERMETAL_Post1945"',
+                          xmlfile.read())
+        self.assertTrue(os.path.isdir(self.cache_file))
+
+
+class TheSidecarShould(unittest.TestCase):
+
+    NEXIS_MAPPING = {'URMLDBTILE': 'URML', 'W1TIMBERMETAL': 'W1TM'}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _serialize(self, name, input_file, mapping=BLDG_MAPPING):
+        filename = os.path.join(self.tmpdir, name)
+        reader = ExposureTxtReader(StringIO(METADATA), input_file)
+        ExposureWriter(mapping).serialize_chunks(
+            filename, reader.metadata, reader.iter_chunks())
+        return filename
+
+    def _read(self, filename):
+        with open(filename) as sidecar_file:
+            return sidecar_file.read()
+
+    def test_write_the_columns_of_the_data_frame(self):
+        with open(os.path.join(DATA_DIR, 'example_NEXIS.csv')) as nexis:
+            filename = self._serialize('exposure.xml', nexis,
+                                       self.NEXIS_MAPPING)
+
+        self.assertEqual(
+            self._read(os.path.join(DATA_DIR, 'example_NEXIS.xml.csv')),
+            self._read(filename + '.csv'))
+
+    def test_leave_the_cost_of_an_asset_without_costs_empty(self):
+        filename = self._serialize('exposure.xml', eqrm_csv(
+            [eqrm_row(1), eqrm_row(2, BUILDING_COST_DENSITY='')]))
+
+        self.assertEqual(
+            'LID,SA1_CODE,SUBURB,REPL_COST,POPULATION\n'
+            'LID001,10101,SUBURB1,152300.75,2.5\n'
+            'LID002,10102,SUBURB2,,2.5\n', self._read(filename + '.csv'))
+
+    def test_name_the_sidecar_of_a_compressed_exposure_after_its_stem(self):
+        filename = self._serialize('exposure.xml.gz', eqrm_csv(
+            [eqrm_row(1)]))
+
+        self.assertEqual(['exposure.xml.csv', 'exposure.xml.gz'],
+                         sorted(os.listdir(self.tmpdir)))
+        self.assertEqual(
+            'LID,SA1_CODE,SUBURB,REPL_COST,POPULATION\n'
+            'LID001,10101,SUBURB1,152300.75,2.5\n',
+            self._read(os.path.join(self.tmpdir, 'exposure.xml.csv')))
+        self.assertEqual(eqrm_csv2NRML.sidecar_name(filename),
+                         os.path.join(self.tmpdir, 'exposure.xml.csv'))
+
+
+class APreviousConversionShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.metadata = ExposureTxtReader(StringIO(METADATA), None).metadata
+        self.rows = [eqrm_row(i) for i in range(6)]
+        self.previous_input, self.previous_output = self._convert(
+            'previous', self.rows)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _convert(self, name, rows, previous=None):
+        input_filename = os.path.join(self.tmpdir, name + '.csv')
+        output_filename = os.path.join(self.tmpdir, name + '.xml')
+        with open(input_filename, 'w') as input_file:
+            input_file.write(eqrm_csv(rows).getvalue())
+        with open(input_filename) as input_file:
+            ExposureWriter(BLDG_MAPPING).serialize_chunks(
+                output_filename, self.metadata,
+                ExposureTxtReader(None, input_file).iter_chunks(2),
+                previous=previous)
+        return input_filename, output_filename
+
+    def _convert_incrementally(self, rows):
+        previous = PreviousConversion(self.previous_input,
+                                      self.previous_output)
+        try:
+            _, output_filename = self._convert('next', rows, previous)
+        finally:
+            previous.close()
+        with open(output_filename, 'rb') as output_file:
+            return previous, output_file.read()
+
+    def _read(self, filename):
+        with open(filename, 'rb') as input_file:
+            return input_file.read()
+
+    def test_count_the_added_removed_and_changed_assets(self):
+        rows = list(self.rows)
+        del rows[1]
+        rows[1] = eqrm_row(2, POPULATION='3.5')
+        rows.append(eqrm_row(9))
+
+        previous, output = self._convert_incrementally(rows)
+
+        self.assertEqual((1, 1, 1, 4), (previous.added, previous.removed,
+                                        previous.changed, previous.unchanged))
+        _, output_filename = self._convert('whole', rows)
+        self.assertEqual(self._read(output_filename), output)
+
+    def test_copy_the_assets_of_the_unchanged_rows(self):
+        # edited by hand, so the copied assets can be told apart
+        previous_output = self._read(self.previous_output)
+        with open(self.previous_output, 'wb') as output_file:
+            output_file.write(previous_output.replace(
+                b'area="100.50"', b'area="100.50000"').replace(
+                b'area="101.50"', b'area="101.50000"'))
+        rows = list(self.rows)
+        rows[1] = eqrm_row(1, SUBURB='ALBURY')
+
+        previous, output = self._convert_incrementally(rows)
+
+        self.assertEqual((0, 0, 1, 5), (previous.added, previous.removed,
+                                        previous.changed, previous.unchanged))
+        self.assertIn(b'area="100.50000"', output)
+        self.assertIn(b'area="101.50"', output)
+
+    def test_serialize_again_a_number_written_differently(self):
+        # the same float, but the NRML repeats the text of the input
+        rows = list(self.rows)
+        rows[3] = eqrm_row(3, FLOOR_AREA='103.5')
+
+        previous, output = self._convert_incrementally(rows)
+
+        self.assertEqual(1, previous.changed)
+        self.assertIn(b'area="103.5"', output)
+        self.assertNotIn(b'area="103.50"', output)
+
+    def test_compare_the_rows_whatever_the_chunks(self):
+        with open(self.previous_input) as input_file:
+            chunks = list(ExposureTxtReader(None, input_file).iter_chunks(2))
+        with open(self.previous_input) as input_file:
+            whole, = ExposureTxtReader(None, input_file).iter_chunks()
+
+        lids, rows = eqrm_csv2NRML.row_digests(whole)
+        digests = [eqrm_csv2NRML.row_digests(chunk) for chunk in chunks]
+
+        self.assertEqual(lids.tolist(), [lid for chunk_lids, _ in digests
+                                         for lid in chunk_lids.tolist()])
+        self.assertEqual(rows.tolist(), [row for _, chunk_rows in digests
+                                         for row in chunk_rows.tolist()])
+        self.assertEqual(len(rows), len(set(rows.tolist())))
+
+    def test_index_the_assets_across_the_blocks_read(self):
+        output = self._read(self.previous_output)
+        for block_size in (7, 64, len(output)):
+            self._patch('INDEX_BLOCK_SIZE', block_size)
+            offsets, lengths = PreviousConversion._index_assets(
+                self.previous_output)
+
+            self.assertEqual(len(self.rows), len(offsets))
+            for i, (offset, length) in enumerate(zip(offsets, lengths)):
+                asset = output[offset:offset + length]
+                self.assertTrue(asset.startswith(
+                    b'\n      <asset id="LID%03d" ' % i))
+                self.assertTrue(asset.endswith(b'\n      </asset>'))
+            # the assets are contiguous
+            self.assertEqual(offsets[1:].tolist(),
+                             (offsets + lengths)[:-1].tolist())
+
+    def test_index_an_exposure_without_assets(self):
+        _, output_filename = self._convert('empty', [])
+
+        offsets, lengths = PreviousConversion._index_assets(output_filename)
+
+        self.assertEqual(([], []), (offsets.tolist(), lengths.tolist()))
+
+    def _patch(self, name, value):
+        self.addCleanup(setattr, eqrm_csv2NRML, name,
+                        getattr(eqrm_csv2NRML, name))
+        setattr(eqrm_csv2NRML, name, value)
+
+
+class ABatchConversionShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.tmpdir, 'nexis')
+        self.output_dir = os.path.join(self.tmpdir, 'exposures')
+        os.mkdir(self.input_dir)
+        os.mkdir(self.output_dir)
+        self.metadata = ExposureTxtReader(StringIO(METADATA), None).metadata
+        self.inputs = [
+            self._write('LGA_1.csv', eqrm_csv(
+                [eqrm_row(i) for i in range(3)]).getvalue()),
+            self._write('LGA_2.csv', eqrm_csv(
+                [eqrm_row(i) for i in range(3, 8)]).getvalue())]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, text):
+        filename = os.path.join(self.input_dir, name)
+        with open(filename, 'w') as output_file:
+            output_file.write(text)
+        return filename
+
+    def _read(self, filename):
+        with open(filename, 'rb') as input_file:
+            return input_file.read()
+
+    def _batch(self, inputs, workers=1, merged_filename=None):
+        return eqrm_csv2NRML.convert_batch(
+            inputs, self.metadata, BLDG_MAPPING, output_dir=self.output_dir,
+            merged_filename=merged_filename, workers=workers)
+
+    def test_merge_the_inputs_in_order(self):
+        whole = self._write('whole.txt', eqrm_csv(
+            [eqrm_row(i) for i in range(8)]).getvalue())
+        expected = os.path.join(self.tmpdir, 'expected.xml')
+        with open(whole) as input_file:
+            ExposureWriter(BLDG_MAPPING).serialize_chunks(
+                expected, self.metadata,
+                ExposureTxtReader(None, input_file).iter_chunks())
+
+        for workers in (1, 2):
+            merged = os.path.join(self.tmpdir, 'merged%d.xml' % workers)
+            results = self._batch(self.inputs, workers, merged)
+
+            self.assertEqual([(self.inputs[0], 3, None),
+                              (self.inputs[1], 5, None)],
+                             [(input_filename, assets, error) for
+                              input_filename, assets, _, error in results])
+            self.assertEqual(self._read(expected), self._read(merged))
+            self.assertEqual(self._read(expected + '.csv'),
+                             self._read(merged + '.csv'))
+        # no part is left behind
+        self.assertEqual(
+            ['expected.xml', 'expected.xml.csv', 'exposures', 'merged1.xml',
+             'merged1.xml.csv', 'merged2.xml', 'merged2.xml.csv', 'nexis'],
+            sorted(os.listdir(self.tmpdir)))
+
+    def test_report_the_inputs_it_cannot_convert(self):
+        inputs = [
+            self.inputs[0],
+            self._write('malformed.csv', eqrm_csv(
+                [eqrm_row(8, FLOOR_AREA='n/a')]).getvalue()),
+            os.path.join(self.input_dir, 'missing.csv'),
+            self._write('binary.csv', eqrm_csv(
+                [eqrm_row(9, SUBURB='\0')]).getvalue()),
+            self.inputs[1]]
+        merged = os.path.join(self.tmpdir, 'merged.xml')
+
+        for workers in (1, 2):
+            results = self._batch(inputs, workers)
+            errors = [error for _, _, _, error in results]
+
+            self.assertEqual([3, 0, 0, 0, 5],
+                             [assets for _, assets, _, _ in results])
+            self.assertEqual(None, errors[0])
+            self.assertIn('asset 1: FLOOR_AREA', errors[1])
+            self.assertIn('missing.csv', errors[2])
+            self.assertIn('NUL', errors[3].upper())
+            self.assertEqual(None, errors[4])
+            self.assertEqual(
+                ['LGA_1.xml', 'LGA_1.xml.csv', 'LGA_2.xml', 'LGA_2.xml.csv'],
+                sorted(os.listdir(self.output_dir)))
+
+        results = self._batch(inputs, merged_filename=merged)
+        self.assertEqual(3, sum(error is not None
+                                for _, _, _, error in results))
+        self.assertFalse(os.path.exists(merged))
+
+        stdout = sys.stdout
+        sys.stdout = summary = StringIO()
+        try:
+            eqrm_csv2NRML.print_batch_summary(results, 1.0)
+        finally:
+            sys.stdout = stdout
+        self.assertIn('{}: [Errno 2]'.format(inputs[2]), summary.getvalue())
+        self.assertIn('2 files converted, 3 failed: 8 assets',
+                      summary.getvalue())
+
+    def test_leave_the_metadata_and_the_mapping_out(self):
+        metadata_file = self._write('header.csv', METADATA)
+        mapping_file = self._write(
+            'mapping.csv', 'NEXIS_CONS,MAPPING2\nW1TIMBERMETAL,W1TM\n')
+        args = eqrm_csv2NRML.cmd_parser().parse_args(
+            ['--batch', self.input_dir, '-m', metadata_file,
+             '-b', mapping_file, '-d', self.output_dir])
+
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            eqrm_csv2NRML.main_batch(args, BLDG_MAPPING)
+        finally:
+            sys.stdout = stdout
+
+        self.assertEqual(
+            ['LGA_1.xml', 'LGA_1.xml.csv', 'LGA_2.xml', 'LGA_2.xml.csv'],
+            sorted(os.listdir(self.output_dir)))
@@ -0,0 +1,654 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+import numpy
+from lxml import etree
+
+INPUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         os.pardir, os.pardir)
+sys.path.insert(0, INPUT_DIR)
+
+import esri2nrml
+from esri2nrml import (GML, NRML, ExposureModelWriter, Polygon,
+                       asset_blocks, asset_iterator, convert_tiles,
+                       grid_window, read_binary_data, read_georeference,
+                       read_metadata, read_window, tile_filename,
+                       tile_windows)
+
+# the grids of the tests: cells of 0.5 degrees from 10E 50N, so that the
+# coordinates of the cell centres are exact
+XMIN = 10.0
+YMAX = 50.0
+CELLSIZE = 0.5
+NODATA = -9999
+
+
+def population(nrows, ncols, dtype='int32'):
+    """
+    A nrows x ncols grid of people, with empty, nodata and negative
+    cells.
+    """
+    values = (numpy.arange(nrows * ncols).reshape(nrows, ncols) * 37 %
+              400).astype(dtype)
+    values[0, 0] = 0
+    values[1, :2] = NODATA
+    values[-1, -1] = -5
+    return values
+
+
+def expected_assets(values, threshold=0, rows=slice(None), cols=slice(None),
+                    inside=lambda lon, lat: True):
+    """
+    The (lon, lat, number) of the cells of values, in the rows and the
+    columns given, with a number above threshold, going through all of
+    them.
+    """
+    nrows, ncols = values.shape
+    assets = []
+    for row in range(nrows)[rows]:
+        for col in range(ncols)[cols]:
+            lon = XMIN + (col + 0.5) * CELLSIZE
+            lat = YMAX - (row + 0.5) * CELLSIZE
+            number = values[row, col]
+            if (number > threshold and number != NODATA and
+                    inside(lon, lat)):
+                assets.append((lon, lat, number.tolist()))
+    return assets
+
+
+def expected_blocks(values, k, threshold=0, rows=slice(None),
+                    cols=slice(None)):
+    """
+    The (lon, lat, number) of the k x k blocks of the cells of values,
+    from the first of the rows and columns given, with a total number
+    above threshold, summing their cells one by one.
+    """
+    nrows, ncols = values.shape
+    rows, cols = range(nrows)[rows], range(ncols)[cols]
+    blocks = []
+    for first_row in range(0, len(rows), k):
+        for first_col in range(0, len(cols), k):
+            number = lon_sum = lat_sum = 0
+            for row in rows[first_row:first_row + k]:
+                for col in cols[first_col:first_col + k]:
+                    value = values[row, col].tolist()
+                    if value > 0 and value != NODATA:
+                        number += value
+                        lon_sum += value * (XMIN + (col + 0.5) * CELLSIZE)
+                        lat_sum += value * (YMAX - (row + 0.5) * CELLSIZE)
+            if number > threshold:
+                blocks.append((lon_sum / number, lat_sum / number, number))
+    return blocks
+
+
+def exposure_assets(filename):
+    """
+    The (lon, lat, number, taxonomy) strings of the assets of an
+    exposure written by esri2nrml.
+    """
+    assets = []
+    for asset in etree.parse(filename).iter('%sassetDefinition' % NRML):
+        lon, lat = asset.find('.//%spos' % GML).text.split()
+        assets.append((lon, lat, asset.find('%snumber' % NRML).text,
+                       asset.find('%staxonomy' % NRML).text))
+    return assets
+
+
+def ring_contains(ring, lon, lat):
+    """
+    Whether a point is inside ring, an edge at a time (even-odd rule,
+    the points with y0 <= lat < y1 or y1 <= lat < y0 crossing an edge).
+    """
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        if min(y0, y1) <= lat < max(y0, y1) and (
+                lon < x0 + (lat - y0) * (x1 - x0) / (y1 - y0)):
+            inside = not inside
+    return inside
+
+
+class GridFiles(object):
+    """
+    Binary grids and their metadata, written to a temporary directory.
+    """
+
+    def __init__(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def close(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def write_data(self, values, order='<', skip=0):
+        filename = self.path('grid.bil')
+        with open(filename, 'wb') as data_file:
+            data_file.write(b'\0' * skip)
+            values.astype(values.dtype.newbyteorder(order)).tofile(
+                data_file)
+        return filename
+
+    def write_hdr(self, values, byteorder='I', **header):
+        nrows, ncols = values.shape
+        header = dict(dict(
+            BYTEORDER=byteorder, LAYOUT='BIL', NROWS=nrows, NCOLS=ncols,
+            NBANDS=1, NBITS=values.dtype.itemsize * 8,
+            PIXELTYPE={'f': 'FLOAT', 'i': 'SIGNEDINT',
+                       'u': 'UNSIGNEDINT'}[values.dtype.kind],
+            ULXMAP=XMIN + CELLSIZE / 2, ULYMAP=YMAX - CELLSIZE / 2,
+            XDIM=CELLSIZE, YDIM=CELLSIZE, NODATA=NODATA), **header)
+        filename = self.path('grid.hdr')
+        with open(filename, 'w') as hdr:
+            for key, value in sorted(header.items()):
+                hdr.write('%-14s%s\n' % (key, value))
+        return filename
+
+    def write_ini(self, values, **data):
+        nrows, ncols = values.shape
+        filename = self.path('grid.ini')
+        with open(filename, 'w') as ini:
+            ini.write('[georeference]\nnrows = %d\nncols = %d\n'
+                      'xmin = %r\nymin = %r\nxmax = %r\nymax = %r\n' % (
+                          nrows, ncols, XMIN, YMAX - nrows * CELLSIZE,
+                          XMIN + ncols * CELLSIZE, YMAX))
+            if data:
+                ini.write('[data]\n')
+                for option, value in sorted(data.items()):
+                    ini.write('%s = %s\n' % (option, value))
+        return filename
+
+
+class TheGridReaderShould(unittest.TestCase):
+
+    def setUp(self):
+        self.files = GridFiles()
+        self.values = numpy.arange(12).reshape(3, 4) * 100 - 300
+
+    def tearDown(self):
+        self.files.close()
+
+    def _read(self, values, metadata_filename, order='<', skip=0):
+        data_filename = self.files.write_data(values, order, skip)
+        return read_binary_data(data_filename,
+                                read_metadata(metadata_filename))
+
+    def test_map_the_cells_of_the_hdr_type(self):
+        for dtype, byteorder in [('int16', 'I'), ('int32', 'M'),
+                                 ('uint8', 'I'), ('float32', 'M'),
+                                 ('float64', 'I')]:
+            values = self.values.astype(dtype)
+            order = '>' if byteorder == 'M' else '<'
+
+            data = self._read(values, self.files.write_hdr(values,
+                                                           byteorder),
+                              order)
+
+            self.assertTrue(isinstance(data, numpy.memmap))
+            self.assertEqual(numpy.dtype(dtype).newbyteorder(order),
+                             data.dtype)
+            self.assertEqual((3, 4), data.shape)
+            numpy.testing.assert_array_equal(values, data)
+
+    def test_read_landscan_cells_without_a_data_section(self):
+        values = self.values.astype('int16')
+
+        data = self._read(values, self.files.write_ini(values))
+
+        self.assertEqual(numpy.dtype('<i2'), data.dtype)
+        numpy.testing.assert_array_equal(values, data)
+
+    def test_read_the_cells_of_the_ini_type(self):
+        values = self.values.astype('float32')
+        metadata_filename = self.files.write_ini(
+            values, pixeltype='float', nbits=32, byteorder='msb',
+            skipbytes=6)
+
+        data = self._read(values, metadata_filename, '>', skip=6)
+
+        self.assertEqual(numpy.dtype('>f4'), data.dtype)
+        numpy.testing.assert_array_equal(values, data)
+
+    def test_locate_the_grid_of_an_hdr_as_the_one_of_an_ini(self):
+        values = self.values.astype('int16')
+        hdr = read_metadata(self.files.write_hdr(values))
+        ini = read_metadata(self.files.write_ini(values))
+
+        self.assertEqual((3, 4, XMIN, YMAX, CELLSIZE, CELLSIZE),
+                         read_georeference(hdr))
+        self.assertEqual(read_georeference(ini), read_georeference(hdr))
+
+    def test_reject_a_grid_of_another_size(self):
+        values = self.values.astype('int16')
+        metadata_filename = self.files.write_hdr(values[:2])
+
+        self.assertRaisesRegexp(
+            RuntimeError, '24 bytes of cells, 2 x 4 cells of 2 bytes',
+            self._read, values, metadata_filename)
+
+    def test_reject_the_cells_it_cannot_map(self):
+        values = self.values.astype('int16')
+        for header in (dict(NBITS=12), dict(NBITS=16, PIXELTYPE='FLOAT'),
+                       dict(PIXELTYPE='COMPLEX'), dict(BYTEORDER='X')):
+            metadata_filename = self.files.write_hdr(values, **header)
+
+            self.assertRaisesRegexp(RuntimeError, 'unsupported cells',
+                                    self._read, values, metadata_filename)
+
+
+class TheCellsToAssetsShould(unittest.TestCase):
+
+    def setUp(self):
+        self.files = GridFiles()
+
+    def tearDown(self):
+        self.files.close()
+
+    def _assets(self, values, **kwargs):
+        config = read_metadata(self.files.write_hdr(values))
+        data = read_binary_data(self.files.write_data(values), config)
+        return list(asset_iterator(config, data, **kwargs))
+
+    def _patch(self, name, value):
+        self.addCleanup(setattr, esri2nrml, name, getattr(esri2nrml, name))
+        setattr(esri2nrml, name, value)
+
+    def test_skip_the_empty_and_nodata_cells(self):
+        values = population(4, 5)
+
+        assets = self._assets(values)
+
+        self.assertEqual(expected_assets(values), assets)
+        # one empty, two nodata and one negative cell
+        self.assertEqual(values.size - 4, len(assets))
+
+    def test_skip_the_cells_not_above_the_threshold(self):
+        values = population(4, 5)
+        values[2, 2], values[2, 3] = 150, 151
+
+        assets = self._assets(values, threshold=150)
+
+        self.assertEqual(expected_assets(values, threshold=150), assets)
+        self.assertIn((11.75, 48.75, 151), assets)
+        self.assertNotIn((11.25, 48.75, 150), assets)
+        # a negative threshold keeps the empty cells, not the nodata ones
+        self.assertEqual(expected_assets(values, threshold=-1),
+                         self._assets(values, threshold=-1))
+
+    def test_skip_the_nan_cells_of_a_float_grid(self):
+        values = population(4, 5, dtype='float32') + 0.5
+        values[1, :2] = NODATA
+        values[3, 1] = numpy.nan
+
+        assets = self._assets(values, threshold=0.5)
+
+        self.assertEqual(expected_assets(values, threshold=0.5), assets)
+        self.assertEqual(values.size - 5, len(assets))
+
+    def test_yield_the_same_assets_whatever_the_blocks_read(self):
+        values = population(7, 5)
+        for block_cells in (1, 5, 6, 11, 35):
+            self._patch('BLOCK_CELLS', block_cells)
+
+            self.assertEqual(expected_assets(values), self._assets(values))
+
+
+class TheGridWindowShould(unittest.TestCase):
+
+    def setUp(self):
+        self.files = GridFiles()
+        self.values = population(6, 8)
+        self.config = read_metadata(self.files.write_hdr(self.values))
+        self.data = read_binary_data(self.files.write_data(self.values),
+                                     self.config)
+
+    def tearDown(self):
+        self.files.close()
+
+    def _assets(self, **kwargs):
+        return list(asset_iterator(self.config, self.data, **kwargs))
+
+    def test_take_the_cells_whose_centre_is_in_the_bbox(self):
+        # the edges go through the centres of the columns 2 and 5 and
+        # of the rows 1 and 3
+        bbox = (11.25, 48.25, 12.75, 49.25)
+
+        self.assertEqual((slice(1, 4), slice(2, 6)),
+                         grid_window(self.config, bbox))
+        self.assertEqual(expected_assets(self.values, rows=slice(1, 4),
+                                         cols=slice(2, 6)),
+                         self._assets(bbox=bbox))
+        # and just inside them
+        self.assertEqual(
+            (slice(2, 3), slice(3, 5)),
+            grid_window(self.config, (11.2500001, 48.2500001, 12.7499999,
+                                      49.2499999)))
+
+    def test_clip_the_bbox_to_the_grid(self):
+        self.assertEqual((slice(0, 6), slice(0, 8)),
+                         grid_window(self.config, (0, 0, 90, 90)))
+        self.assertEqual((slice(0, 2), slice(6, 8)),
+                         grid_window(self.config, (13, 49, 20, 60)))
+        for bbox in [(0, 0, 9.9, 90), (14.1, 0, 20, 90), (0, 50.1, 20, 60),
+                     (0, 0, 20, 46.9), (10.3, 0, 10.4, 90)]:
+            rows, cols = grid_window(self.config, bbox)
+
+            self.assertEqual(0, (rows.stop - rows.start) *
+                             (cols.stop - cols.start))
+            self.assertEqual([], self._assets(bbox=bbox))
+
+    def test_read_the_window_of_the_bbox_and_of_the_polygon(self):
+        polygon = Polygon([[(11.2, 48.2), (14, 48.2), (14, 52)]])
+
+        self.assertEqual((slice(0, 4), slice(2, 8)),
+                         read_window(self.config, polygon=polygon))
+        self.assertEqual(
+            (slice(1, 4), slice(2, 5)),
+            read_window(self.config, (0, 0, 12.5, 49.5), polygon))
+
+    def test_take_the_cells_whose_centre_is_in_the_polygon(self):
+        # a concave polygon, with a vertex and an edge through centres
+        ring = [(10.25, 47.75), (13.6, 47.9), (11.75, 48.75), (13.9, 49.8),
+                (10.1, 49.75)]
+        polygon = Polygon([ring])
+
+        assets = self._assets(polygon=polygon)
+
+        self.assertEqual(expected_assets(
+            self.values, inside=lambda lon, lat: ring_contains(
+                ring, lon, lat)), assets)
+        self.assertTrue(0 < len(assets) < len(expected_assets(self.values)))
+        self.assertEqual(
+            expected_assets(self.values, cols=slice(0, 3),
+                            inside=lambda lon, lat: ring_contains(
+                                ring, lon, lat)),
+            self._assets(polygon=polygon, bbox=(0, 0, 11.3, 90)))
+
+
+class APolygonShould(unittest.TestCase):
+
+    def setUp(self):
+        self.random = numpy.random.RandomState(7)
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _contains(self, polygon, points):
+        lons, lats = numpy.array(points, dtype=float).T
+        return polygon.contains(lons, lats).tolist()
+
+    def _write(self, name, text):
+        filename = os.path.join(self.tmpdir, name)
+        with open(filename, 'w') as output_file:
+            output_file.write(text)
+        return filename
+
+    def test_agree_with_the_crossings_of_each_edge(self):
+        angles = numpy.sort(self.random.uniform(0, 2 * numpy.pi, 12))
+        radii = self.random.uniform(0.2, 1, 12)
+        ring = list(zip((radii * numpy.cos(angles)).tolist(),
+                        (radii * numpy.sin(angles)).tolist()))
+        points = self.random.uniform(-1, 1, (2000, 2)).tolist()
+
+        self.assertEqual([ring_contains(ring, lon, lat)
+                          for lon, lat in points],
+                         self._contains(Polygon([ring]), points))
+
+    def test_put_the_points_of_a_shared_edge_in_one_polygon(self):
+        # four unit squares around (1, 1)
+        squares = [Polygon([[(x, y), (x + 1, y), (x + 1, y + 1),
+                             (x, y + 1)]])
+                   for x in (0, 1) for y in (0, 1)]
+        points = [(1, 0.5), (1, 1.5), (0.5, 1), (1.5, 1), (1, 1),
+                  (0.25, 1), (1, 1.75)]
+
+        owners = numpy.array([self._contains(square, points)
+                              for square in squares])
+
+        self.assertEqual([1] * len(points), owners.sum(axis=0).tolist())
+        # the left and bottom edges are inside, the others outside
+        self.assertEqual([False, True, False, True, True, False, True],
+                         owners[3].tolist())
+
+    def test_leave_the_holes_out(self):
+        outer = [(0, 0), (4, 0), (4, 4), (0, 4)]
+        hole = [(1, 1), (3, 1), (3, 3), (1, 3)]
+        other = [(5, 5), (6, 5), (6, 6)]
+
+        self.assertEqual(
+            [True, False, True, True, False, False],
+            self._contains(Polygon([outer, hole, other]),
+                           [(0.5, 0.5), (2, 2), (3.5, 2), (5.9, 5.5),
+                            (5.1, 5.5), (7, 7)]))
+
+    def test_read_the_rings_of_geojson(self):
+        square = [[0, 0], [2, 0], [2, 2], [0, 2], [0, 0]]
+        shifted = [[x + 3, y] for x, y in square]
+        for geometry in [
+                dict(type='Polygon', coordinates=[square]),
+                dict(type='MultiPolygon',
+                     coordinates=[[square], [shifted]])]:
+            for document in [geometry,
+                             dict(type='Feature', geometry=geometry),
+                             dict(type='FeatureCollection', features=[
+                                 dict(type='Feature', geometry=geometry)])]:
+                polygon = Polygon.from_file(self._write(
+                    'mask.geojson', json.dumps(document)))
+
+                self.assertEqual(
+                    [True, geometry['type'] == 'MultiPolygon', False],
+                    self._contains(polygon, [(1, 1), (4, 1), (2.5, 1)]))
+
+    def test_read_the_vertices_of_a_text_file(self):
+        polygon = Polygon.from_file(self._write(
+            'mask.txt', '# lon lat\n0 0\n2,0\n\n 2 2\n0, 2\n'))
+
+        self.assertEqual((0, 0, 2, 2), polygon.bbox)
+        self.assertEqual([True, False],
+                         self._contains(polygon, [(1, 1), (3, 1)]))
+        self.assertRaisesRegexp(RuntimeError, "invalid vertex '2'",
+                                Polygon.from_file,
+                                self._write('bad.txt', '0 0\n2\n2 2\n'))
+        self.assertRaisesRegexp(RuntimeError, 'no ring of 3 vertices',
+                                Polygon.from_file,
+                                self._write('short.txt', '0 0\n2 2\n'))
+
+
+class TheCoarsenedCellsShould(unittest.TestCase):
+
+    def setUp(self):
+        self.files = GridFiles()
+        self.values = population(11, 13)
+
+    def tearDown(self):
+        self.files.close()
+
+    def _assets(self, values, **kwargs):
+        config = read_metadata(self.files.write_hdr(values))
+        data = read_binary_data(self.files.write_data(values), config)
+        return list(asset_iterator(config, data, **kwargs))
+
+    def _patch(self, name, value):
+        self.addCleanup(setattr, esri2nrml, name, getattr(esri2nrml, name))
+        setattr(esri2nrml, name, value)
+
+    def assertBlocksEqual(self, expected, assets):
+        self.assertEqual([number for _, _, number in expected],
+                         [number for _, _, number in assets])
+        numpy.testing.assert_allclose(
+            [(lon, lat) for lon, lat, _ in expected],
+            [(lon, lat) for lon, lat, _ in assets], rtol=0, atol=1e-9)
+
+    def test_sum_the_cells_of_each_block(self):
+        for k in (2, 3, 5, 13, 20):
+            assets = self._assets(self.values, coarsen=k)
+
+            self.assertBlocksEqual(expected_blocks(self.values, k), assets)
+            self.assertEqual(
+                sum(number for _, _, number in expected_assets(
+                    self.values)),
+                sum(number for _, _, number in assets))
+
+    def test_sum_the_integer_cells_exactly(self):
+        values = numpy.zeros((4, 4), dtype='int32') + 2 ** 30
+
+        (_, _, number), = self._assets(values, coarsen=4)
+
+        self.assertEqual(16 * 2 ** 30, number)
+
+    def test_locate_a_block_at_the_centroid_of_its_cells(self):
+        values = numpy.zeros((2, 2), dtype='int16')
+        values[0, 0], values[1, 1], values[0, 1] = 1, 3, NODATA
+
+        (lon, lat, number), = self._assets(values, coarsen=2)
+
+        # a quarter of the way from the centre of the first cell to
+        # the one of the last cell
+        self.assertEqual((10.625, 49.375, 4), (lon, lat, number))
+
+    def test_apply_the_threshold_to_the_block_totals(self):
+        values = numpy.zeros((4, 4), dtype='int16') + 10
+        values[:2, :2] = [[5, NODATA], [0, 5]]
+
+        assets = self._assets(values, coarsen=2, threshold=10)
+
+        # the total of the first block is 10, even with a nodata cell
+        self.assertEqual([40, 40, 40], [number for _, _, number in assets])
+        self.assertBlocksEqual(expected_blocks(self.values, 3, 1000),
+                               self._assets(self.values, coarsen=3,
+                                            threshold=1000))
+
+    def test_leave_out_the_blocks_without_cells(self):
+        values = numpy.zeros((4, 6), dtype='float32')
+        values[:2, :2] = NODATA
+        values[2:, 2:4] = numpy.nan
+        values[3, 5] = 2.5
+
+        self.assertEqual([(12.75, 48.25, 2.5)],
+                         self._assets(values, coarsen=2))
+
+    def test_coarsen_from_the_corner_of_the_window(self):
+        bbox = (10.75, 45.5, 12.75, 49.25)
+        # rows 1 to 8 and columns 1 to 5
+        expected = expected_blocks(self.values, 3, rows=slice(1, 9),
+                                   cols=slice(1, 6))
+
+        self.assertBlocksEqual(expected, self._assets(
+            self.values, coarsen=3, bbox=bbox))
+
+    def test_sum_the_same_blocks_whatever_the_rows_read(self):
+        for block_cells in (1, 13, 14, 40, 200):
+            self._patch('BLOCK_CELLS', block_cells)
+
+            self.assertBlocksEqual(expected_blocks(self.values, 3),
+                                   self._assets(self.values, coarsen=3))
+
+
+class TheTiledConversionShould(unittest.TestCase):
+
+    def setUp(self):
+        self.files = GridFiles()
+        self.values = population(17, 23)
+        self.metadata_filename = self.files.write_hdr(self.values)
+        self.data_filename = self.files.write_data(self.values)
+        self.config = read_metadata(self.metadata_filename)
+        self.data = read_binary_data(self.data_filename, self.config)
+
+    def tearDown(self):
+        self.files.close()
+
+    def _single_run(self, name, **kwargs):
+        filename = self.files.path(name)
+        ExposureModelWriter('POP').serialize_blocks(
+            filename, asset_blocks(self.config, self.data, **kwargs))
+        return exposure_assets(filename)
+
+    def _tiles(self, nx, ny, workers=1, **kwargs):
+        filename = self.files.path('tiles.xml')
+        tiles = convert_tiles(self.data_filename, self.metadata_filename,
+                              'POP', filename, nx, ny, workers=workers,
+                              **kwargs)
+        assets = []
+        for tile, count in tiles:
+            tile_assets = exposure_assets(tile)
+            self.assertEqual(count, len(tile_assets))
+            assets.extend(tile_assets)
+            os.remove(tile)
+        return tiles, assets
+
+    def test_write_the_assets_of_the_single_run(self):
+        polygon = Polygon([[(10.3, 49.9), (21, 46), (13, 41.6)]])
+        for kwargs in [dict(), dict(threshold=200),
+                       dict(bbox=(11.1, 43.3, 19.2, 49.1)),
+                       dict(polygon=polygon),
+                       dict(coarsen=3, bbox=(11.1, 43.3, 19.2, 49.1)),
+                       dict(coarsen=4, threshold=1000, polygon=polygon)]:
+            expected = self._single_run('single.xml', **kwargs)
+            for nx, ny, workers in [(1, 1, 1), (2, 3, 1), (4, 2, 2),
+                                    (30, 1, 1)]:
+                _, assets = self._tiles(nx, ny, workers, **kwargs)
+
+                self.assertEqual(sorted(expected), sorted(assets))
+
+    def test_leave_out_the_tiles_without_assets(self):
+        bbox = (10, 41.5, 21.5, 50)
+        values = numpy.asarray(self.data).copy()
+        values[:, :12] = 0
+        self.files.write_data(values)
+
+        tiles, assets = self._tiles(2, 2, bbox=bbox)
+
+        self.assertEqual([tile_filename(self.files.path('tiles.xml'), 0, 1),
+                          tile_filename(self.files.path('tiles.xml'), 1, 1)],
+                         [tile for tile, _ in tiles])
+        self.assertEqual([], [name for name in os.listdir(self.files.tmpdir)
+                              if name.startswith('tiles')])
+        self.assertEqual(len(expected_assets(values)), len(assets))
+
+    def test_start_the_tiles_on_whole_blocks(self):
+        window = (slice(1, 17), slice(2, 23))
+        for coarsen in (1, 3, 4):
+            tiles = tile_windows(window, 3, 2, coarsen)
+
+            self.assertEqual([1, 1, 1], [rows.start for rows, _ in tiles[0]])
+            for row in tiles:
+                self.assertEqual(2, row[0][1].start)
+                self.assertEqual(23, row[-1][1].stop)
+                for (_, left), (_, right) in zip(row, row[1:]):
+                    self.assertEqual(left.stop, right.start)
+                    self.assertEqual(0, (right.start - 2) % coarsen)
+            self.assertEqual(17, tiles[-1][0][0].stop)
+            self.assertEqual(0, (tiles[1][0][0].start - 1) % coarsen)
+
+    def test_stream_the_document_of_the_tree_writer(self):
+        tree_writer = ExposureModelWriter('POP')
+        for asset in asset_iterator(self.config, self.data):
+            tree_writer.add(asset)
+        tree_writer.serialize(self.files.path('tree.xml'))
+        ExposureModelWriter('POP').serialize_blocks(
+            self.files.path('stream.xml'),
+            asset_blocks(self.config, self.data))
+
+        with open(self.files.path('tree.xml')) as tree:
+            with open(self.files.path('stream.xml')) as stream:
+                self.assertEqual(tree.read(), stream.read())
@@ -0,0 +1,98 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from nrml_utils.reader import ExposureNRMLReader, ExposureTxtReader
+from nrml_utils.writer import ExposureWriter
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+EXPOSURE_TXT = os.path.join(DATA_DIR, 'example_exposure.txt')
+EXPOSURE_XML = os.path.join(DATA_DIR, 'example_exposure.xml')
+NEXIS_XML = os.path.join(DATA_DIR, 'example_NEXIS.xml')
+
+
+class AnExposureNRMLReaderShould(unittest.TestCase):
+
+    def setUp(self):
+        with open(EXPOSURE_TXT) as txtfile:
+            reader = ExposureTxtReader(txtfile)
+            self.metadata = reader.metadata
+            self.assets = reader.readassets()
+
+    def test_read_back_what_the_writer_wrote(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output_filename = os.path.join(tmpdir, 'pippo_read_back.xml')
+        ExposureWriter().serialize(output_filename, self.metadata,
+                                   self.assets)
+
+        with open(output_filename) as xmlfile:
+            reader = ExposureNRMLReader(xmlfile)
+            self.assertEqual(self.metadata, reader.metadata)
+            assets = reader.readassets()
+
+        self.assertEqual(['asset_%s' % i for i in range(1, 8)],
+                         [asset.pop('id') for asset in assets])
+        self.assertEqual(self.assets, assets)
+
+    def test_read_asset_definitions(self):
+        with open(EXPOSURE_XML) as xmlfile:
+            reader = ExposureNRMLReader(xmlfile)
+            self.assertEqual('PAV01', reader.metadata['expModId'])
+            self.assertEqual('bla bla bla', reader.metadata['description'])
+            assets = reader.iter_assets()
+            first_asset = next(assets)
+            self.assertEqual(6, len(list(assets)))
+
+        self.assertEqual('asset_1', first_asset['id'])
+        self.assertEqual(('28.6925', '40.9775'),
+                         (first_asset['lon'], first_asset['lat']))
+        self.assertEqual('10', first_asset['occupantNight'])
+        self.assertEqual('32000', first_asset['limit'])
+
+    def test_read_assets(self):
+        with open(NEXIS_XML) as xmlfile:
+            reader = ExposureNRMLReader(xmlfile)
+            metadata = reader.metadata
+            table = reader.readtable()
+            xmlfile.seek(0)
+            first_asset = next(reader.iter_assets())
+
+        self.assertEqual('OQ_exposure', metadata['expModId'])
+        self.assertEqual('buildings', metadata['assetCategory'])
+        self.assertEqual('per_area', metadata['stcoType'])
+        self.assertEqual('SQM', metadata['areaUnit'])
+        self.assertEqual('GNAF_GAWA_146963068', first_asset['id'])
+        self.assertEqual('URMLDBTILE_Post1945', first_asset['taxonomy'])
+        self.assertEqual('1868.4467', first_asset['stco'])
+        self.assertEqual('2.20576790', first_asset['occupantNight'])
+        self.assertEqual(2, len(table))
+        self.assertEqual(1920.9167, table['stco'][1])
+
+    def test_report_the_line_of_an_invalid_asset(self):
+        with open(EXPOSURE_XML) as xmlfile:
+            content = xmlfile.read().replace(
+                '<taxonomy>RC_MR_LC</taxonomy>\n      </assetDefinition>\n'
+                '    </exposureList>', '</assetDefinition>\n'
+                '    </exposureList>')
+        assets = ExposureNRMLReader(StringIO(content)).iter_assets()
+
+        self.assertRaisesRegexp(RuntimeError, 'line 101: taxonomy',
+                                list, assets)
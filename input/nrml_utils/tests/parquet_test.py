@@ -0,0 +1,54 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from nrml_utils.parquet import ParquetExport, pyarrow
+
+FIELDS = [('id', 'string'), ('lon', 'float64'), ('occupants', 'float64')]
+
+
+@unittest.skipIf(pyarrow is None, 'the Parquet export needs pyarrow')
+class AParquetExportShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'assets.parquet')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_read_back_the_row_groups_it_wrote(self):
+        export = ParquetExport(self.filename, FIELDS)
+        export.write(dict(id=['asset_1', 'asset_2'], lon=[1.5, 2.5],
+                          occupants=[10.0, None]))
+        export.write(dict(id=numpy.array(['asset_3']),
+                          lon=numpy.array([3.5]),
+                          occupants=numpy.array([numpy.nan])))
+        export.close()
+
+        parquet_file = pyarrow.parquet.ParquetFile(self.filename)
+        self.assertEqual(2, parquet_file.num_row_groups)
+        self.assertEqual([name for name, _ in FIELDS],
+                         parquet_file.schema_arrow.names)
+        self.assertEqual(
+            dict(id=['asset_1', 'asset_2', 'asset_3'],
+                 lon=[1.5, 2.5, 3.5], occupants=[10.0, None, None]),
+            parquet_file.read().to_pydict())
@@ -0,0 +1,149 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import numpy
+
+from nrml_utils import cache
+from nrml_utils.parquet import pyarrow
+from nrml_utils.pipeline import convert_exposure, split_in_chunks
+
+HEADER = ('expModId,assetCategory,description,stcoType,stcoUnit,areaType,'
+          'areaUnit,cocoType,cocoUnit,recoType,recoUnit,taxonomySource\n'
+          'PAV01,buildings,bla bla bla,aggregated,USD,per_asset,GBP,'
+          'per_area,CHF,aggregated,EUR,pavia taxonomy\n\n'
+          'lon,lat,taxonomy,stco,number,area,reco,coco,occupantDay,'
+          'occupantNight,deductible,limit\n')
+
+
+class AnExposurePipelineShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.input_filename = os.path.join(self.tmpdir, 'exposure.txt')
+        with open(self.input_filename, 'w') as txtfile:
+            txtfile.write(HEADER)
+            for i in range(1000):
+                txtfile.write('28.%04d,40.9775,RC_MR_LC,%s,50,,,,10,,,\n'
+                              % (i, i * 1000))
+                if i % 97 == 0:
+                    txtfile.write('\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _patch(self, owner, name, value):
+        self.addCleanup(setattr, owner, name, getattr(owner, name))
+        setattr(owner, name, value)
+
+    def _read(self, filename):
+        with open(filename, 'rb') as xmlfile:
+            return xmlfile.read()
+
+    def test_split_in_chunks_on_line_boundaries(self):
+        chunks = split_in_chunks(self.input_filename, len(HEADER), 1,
+                                 chunk_size=1000)
+        data = self._read(self.input_filename)
+
+        self.assertEqual(len(HEADER), chunks[0][0])
+        self.assertEqual(len(data), chunks[-1][1])
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(b'\n', data[end - 1:end])
+
+    def test_parallel_output_is_identical_to_serial(self):
+        serial = os.path.join(self.tmpdir, 'serial.xml')
+        parallel = os.path.join(self.tmpdir, 'parallel.xml')
+
+        convert_exposure(self.input_filename, serial)
+        convert_exposure(self.input_filename, parallel, workers=3)
+
+        self.assertIn(b'gml:id="asset_1000"', self._read(parallel))
+        self.assertEqual(self._read(serial), self._read(parallel))
+
+    def test_report_input_line_numbers(self):
+        with open(self.input_filename, 'a') as txtfile:
+            txtfile.write('28.6925,40.9775,,,,,,,,,,\n')
+
+        output = os.path.join(self.tmpdir, 'parallel.xml')
+        self.assertRaisesRegexp(RuntimeError, 'line 1016: taxonomy',
+                                convert_exposure, self.input_filename,
+                                output, workers=2)
+
+    def test_report_line_numbers_of_a_chunk_in_the_middle(self):
+        with open(self.input_filename) as txtfile:
+            lines = txtfile.readlines()
+        lines[500] = '28.6925,40.9775,RC_MR_LC,x,,,,,,,,\n'
+        with open(self.input_filename, 'w') as txtfile:
+            txtfile.writelines(lines)
+
+        output = os.path.join(self.tmpdir, 'parallel.xml')
+        self.assertRaisesRegexp(RuntimeError, 'line 501: stco',
+                                convert_exposure, self.input_filename,
+                                output, workers=3)
+
+    @unittest.skipIf(pyarrow is None, 'the Parquet export needs pyarrow')
+    def test_export_the_same_parquet_rows_in_parallel(self):
+        serial = os.path.join(self.tmpdir, 'serial.parquet')
+        parallel = os.path.join(self.tmpdir, 'parallel.parquet')
+
+        convert_exposure(self.input_filename, None, parquet_filename=serial)
+        convert_exposure(self.input_filename, None, workers=3,
+                         parquet_filename=parallel)
+
+        serial = pyarrow.parquet.read_table(serial).to_pydict()
+        parallel = pyarrow.parquet.read_table(parallel).to_pydict()
+        self.assertEqual('asset_1000', parallel['id'][-1])
+        self.assertEqual(serial, parallel)
+
+    def test_load_the_cached_columns_on_a_second_run(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        first = os.path.join(self.tmpdir, 'first.xml')
+        second = os.path.join(self.tmpdir, 'second.xml')
+        convert_exposure(self.input_filename, first, cache_dir=cache_dir)
+
+        class NoParsing(object):
+            def __init__(self, txtfile):
+                raise AssertionError('the input should not be parsed')
+        self._patch(cache, 'ExposureTxtReader', NoParsing)
+        loaded = []
+        load = cache.ExposureCache.load
+
+        def spy(self, key):
+            cached = load(self, key)
+            loaded.append(cached[1]['stco'])
+            return cached
+        self._patch(cache.ExposureCache, 'load', spy)
+        convert_exposure(self.input_filename, second, cache_dir=cache_dir)
+
+        self.assertEqual(1, len(loaded))
+        self.assertIsInstance(loaded[0].base, numpy.memmap)
+        self.assertEqual(self._read(first), self._read(second))
+
+    def test_parse_a_changed_input_again(self):
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        output = os.path.join(self.tmpdir, 'cached.xml')
+        convert_exposure(self.input_filename, output, cache_dir=cache_dir)
+        with open(self.input_filename, 'a') as txtfile:
+            txtfile.write('28.6925,40.9775,RC_MR_LC,7,,,,,,,,\n')
+
+        convert_exposure(self.input_filename, output, cache_dir=cache_dir)
+
+        self.assertIn(b'gml:id="asset_1001"', self._read(output))
+        self.assertIn(b'<stco>7</stco>', self._read(output))
@@ -0,0 +1,82 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy
+
+from nrml_utils.reader import ExposureTxtReader
+from nrml_utils.table import ExposureTable
+from nrml_utils.writer import ExposureWriter
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+EXPOSURE_TXT = os.path.join(DATA_DIR, 'example_exposure.txt')
+
+
+class AnExposureTableShould(unittest.TestCase):
+
+    def setUp(self):
+        with open(EXPOSURE_TXT) as txtfile:
+            reader = ExposureTxtReader(txtfile)
+            self.assets = reader.readassets()
+            self.table = reader.readtable()
+
+    def test_read_columns(self):
+        self.assertEqual(7, len(self.table))
+        self.assertEqual(numpy.float64, self.table['stco'].dtype)
+        self.assertEqual(40000.0, self.table['stco'][0])
+        self.assertTrue(numpy.isnan(self.table['stco'][-1]))
+        self.assertEqual(['RC_MR_LC'], self.table.taxonomies)
+        self.assertEqual([0] * 7, self.table['taxonomy'].tolist())
+
+    def test_match_the_assets_read_as_dicts(self):
+        table = ExposureTable.from_assets(self.assets)
+
+        for name in ExposureTable.FLOAT_FIELDNAMES:
+            numpy.testing.assert_array_equal(self.table[name], table[name])
+
+    def test_summary(self):
+        stats = self.table.summary()
+
+        self.assertEqual(5, stats['stco']['count'])
+        self.assertEqual(1452000.0, stats['stco']['sum'])
+        self.assertEqual({'RC_MR_LC': 7}, stats['taxonomy'])
+
+    def test_validate(self):
+        self.table.validate()
+        self.table['lat'][3] = 95.0
+
+        self.assertRaisesRegexp(RuntimeError, 'starting from asset_4',
+                                self.table.validate)
+
+    def test_serialize_like_the_assets(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        output_filename = os.path.join(tmpdir, 'pippo_table.xml')
+        expected_filename = os.path.join(tmpdir, 'pippo_assets.xml')
+        with open(EXPOSURE_TXT) as txtfile:
+            metadata = ExposureTxtReader(txtfile).metadata
+        for asset in self.assets:
+            asset['deductible'] = asset['deductible'].replace('0.10', '0.1')
+
+        ExposureWriter().serialize(expected_filename, metadata, self.assets)
+        ExposureWriter().serialize(output_filename, metadata, self.table,
+                                   streaming=True)
+
+        with open(expected_filename) as expected, \
+                open(output_filename) as output:
+            self.assertEqual(expected.read(), output.read())
@@ -0,0 +1,99 @@
+# Copyright (c) 2010-2012, GEM Foundation.
+#
+# NRML is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# NRML is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with NRML.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+from lxml import etree
+
+from nrml_utils.reader import ExposureTxtReader
+from nrml_utils.validation import NRML_SCHEMA_FILE, validate, validate_files
+from nrml_utils.writer import ExposureWriter
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+EXPOSURE_TXT = os.path.join(DATA_DIR, 'example_exposure.txt')
+
+
+def whole_document_errors(xml_filename, xml_schema_path=NRML_SCHEMA_FILE):
+    """
+    The lines of the errors found validating the document as a whole,
+    None if it is valid.
+    """
+    xml_doc = etree.parse(xml_filename)
+    xmlschema = etree.XMLSchema(etree.parse(xml_schema_path))
+    if xmlschema.validate(xml_doc):
+        return None
+    return sorted(set(error.line for error in xmlschema.error_log))
+
+
+class AStreamingValidatorShould(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        with open(EXPOSURE_TXT) as txtfile:
+            reader = ExposureTxtReader(txtfile)
+            metadata = reader.metadata
+            assets = reader.readassets()
+        self.assets = len(assets)
+        self.valid_filename = os.path.join(self.tmpdir, 'pippo_valid.xml')
+        ExposureWriter().serialize(self.valid_filename, metadata, assets)
+
+        # asset_3 and asset_6 get a negative stco
+        assets[2]['stco'] = assets[5]['stco'] = '-1'
+        self.invalid_filename = os.path.join(self.tmpdir, 'pippo_invalid.xml')
+        ExposureWriter().serialize(self.invalid_filename, metadata, assets)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_accept_a_valid_document(self):
+        for batch_size in (1, 2, 100):
+            self.assertEqual(
+                [], validate(self.valid_filename, batch_size=batch_size))
+
+    def test_report_errors_with_their_lines(self):
+        for batch_size in (1, 2, 100):
+            errors = validate(self.invalid_filename, batch_size=batch_size)
+
+            self.assertEqual([56, 99], [line for line, _ in errors])
+            self.assertTrue('stco' in errors[0][1])
+
+    def test_agree_with_the_validation_of_the_whole_document(self):
+        # a batch is checked once it holds more than batch_size assets:
+        # around self.assets the last batch is checked inside the loop,
+        # right at its end or after it
+        batch_sizes = [1, 2, self.assets - 1, self.assets, self.assets + 1]
+        for filename in (self.valid_filename, self.invalid_filename):
+            expected = whole_document_errors(filename)
+            for batch_size in batch_sizes:
+                errors = validate(filename, batch_size=batch_size)
+
+                self.assertEqual(expected, sorted(
+                    line for line, _ in errors) or None)
+        self.assertEqual([56, 99],
+                         whole_document_errors(self.invalid_filename))
+
+    def test_report_the_first_errors_only(self):
+        errors = validate(self.invalid_filename, max_errors=1, batch_size=1)
+
+        self.assertEqual([56], [line for line, _ in errors])
+
+    def test_validate_files_in_parallel(self):
+        filenames = [self.valid_filename, self.invalid_filename]
+
+        self.assertEqual(validate_files(filenames),
+                         validate_files(filenames, workers=2))
@@ -8,6 +8,7 @@ Required libraries are:
 - matplotlib
 """
 
+import os
 import sys
 import argparse
 from lxml import etree
@@ -15,6 +16,11 @@ import numpy
 import matplotlib.pyplot as plt
 import pylab
 
+# the shared nrml_utils package is kept with the input scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'input', 'nrml_utils'))
+from nrml_utils.compression import open_file
+
 xmlNRML = '{http://openquake.org/xmlns/nrml/0.3}'
 xmlGML = '{http://www.opengis.net/gml}'
 
@@ -33,21 +39,22 @@ def parse_and_print_hazard_curves(hazard_curves_file,file_format):
     """
     Parse NRML hazard curves file. Plot each curve in a .PNG figure. 
     """
-    parse_args = dict(source=hazard_curves_file)
-    idx = 0
-    hc_list = []
-    min_poes = +1e10
-    max_poes = -1e10
-    for _, element in etree.iterparse(**parse_args):
+    with open_file(hazard_curves_file, 'rb') as nrml_file:
+        parse_args = dict(source=nrml_file)
+        idx = 0
+        hc_list = []
+        min_poes = +1e10
+        max_poes = -1e10
+        for _, element in etree.iterparse(**parse_args):
 
-        if element.tag == '%sIML' % xmlNRML:
-            imls = numpy.array(element.text.split(),dtype=float)
-        if element.tag == '%sHCNode' % xmlNRML:
-            lon,lat,poes = parse_hazard_curve(element)
-            hc_list.append({'idx':idx,'lon':lon,'lat':lat,'imls':imls,'poes':poes})
-            min_poes = min(min_poes,min(poes))
-            max_poes = max(max_poes,max(poes))
-            idx += 1
+            if element.tag == '%sIML' % xmlNRML:
+                imls = numpy.array(element.text.split(),dtype=float)
+            if element.tag == '%sHCNode' % xmlNRML:
+                lon,lat,poes = parse_hazard_curve(element)
+                hc_list.append({'idx':idx,'lon':lon,'lat':lat,'imls':imls,'poes':poes})
+                min_poes = min(min_poes,min(poes))
+                max_poes = max(max_poes,max(poes))
+                idx += 1
 
     if min_poes < 1e-20:
         min_poes = 1.0e-6 
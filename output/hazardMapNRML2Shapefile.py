@@ -8,11 +8,17 @@ Required libraries are:
 - pyshp
 """
 
+import os
 import sys
 import argparse
 import shapefile
 from lxml import etree
 
+# the shared nrml_utils package is kept with the input scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'input', 'nrml_utils'))
+from nrml_utils.compression import open_file
+
 
 def set_up_arg_parser():
     """
@@ -28,19 +34,20 @@ def parse_hazard_map_file(hazard_map_file):
     """
     Parse NRML hazard map file.
     """
-    parse_args = dict(source=hazard_map_file)
+    with open_file(hazard_map_file, 'rb') as nrml_file:
+        parse_args = dict(source=nrml_file)
 
-    lons = []
-    lats = []
-    data = []
+        lons = []
+        lats = []
+        data = []
 
-    for _, element in etree.iterparse(**parse_args):
+        for _, element in etree.iterparse(**parse_args):
 
-        if element.tag.find('node') > 0:
-            for e in element.iter():
-                lons.append(float(e.get('lon')))
-                lats.append(float(e.get('lat')))
-                data.append(float(e.get('iml')))
+            if element.tag.find('node') > 0:
+                for e in element.iter():
+                    lons.append(float(e.get('lon')))
+                    lats.append(float(e.get('lat')))
+                    data.append(float(e.get('iml')))
 
     return lons, lats, data
 
@@ -8,12 +8,18 @@ Required libraries are:
 - matplotlib
 """
 
+import os
 import sys
 import argparse
 from lxml import etree
 import numpy
 import matplotlib.pyplot as plt
 
+# the shared nrml_utils package is kept with the input scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'input', 'nrml_utils'))
+from nrml_utils.compression import open_file
+
 xmlNRML = '{http://openquake.org/xmlns/nrml/0.3}'
 xmlGML = '{http://www.opengis.net/gml}'
 
@@ -31,14 +37,15 @@ def parse_and_print_loss_curves(loss_curves_file):
 	"""
 	Parse NRML loss curves file. Plot each curve in a .PNG figure. 
 	"""
-	parse_args = dict(source=loss_curves_file)
+	with open_file(loss_curves_file, 'rb') as nrml_file:
+		parse_args = dict(source=nrml_file)
 
-	for _, element in etree.iterparse(**parse_args):
+		for _, element in etree.iterparse(**parse_args):
 
-		if element.tag == '%sasset' % xmlNRML:
-			ID,x_label,lon,lat,loss,poe = parse_asset(element)
-			print loss, poe
-			plot_curve(ID,x_label,lon,lat,loss,poe)
+			if element.tag == '%sasset' % xmlNRML:
+				ID,x_label,lon,lat,loss,poe = parse_asset(element)
+				print loss, poe
+				plot_curve(ID,x_label,lon,lat,loss,poe)
 
 def parse_asset(element):
 	"""
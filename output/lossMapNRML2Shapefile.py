@@ -8,12 +8,18 @@ Required libraries are:
 - pyshp
 """
 
+import os
 import sys
 import math
 import argparse
 import shapefile
 from lxml import etree
 
+# the shared nrml_utils package is kept with the input scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'input', 'nrml_utils'))
+from nrml_utils.compression import open_file
+
 xmlNRML = '{http://openquake.org/xmlns/nrml/0.3}'
 xmlGML = '{http://www.opengis.net/gml}'
 
@@ -33,19 +39,20 @@ def parse_loss_map_file(loss_map_file):
 	"""
 	Parse NRML loss map file.
 	"""
-	parse_args = dict(source=loss_map_file)
+	with open_file(loss_map_file, 'rb') as nrml_file:
+		parse_args = dict(source=nrml_file)
 
-	lons = []
-	lats = []
-	data = []
+		lons = []
+		lats = []
+		data = []
 
-	for _, element in etree.iterparse(**parse_args):
+		for _, element in etree.iterparse(**parse_args):
 
-		if element.tag == '%sLMNode' % xmlNRML:
-			lon,lat,value = parse_loss_map_node(element)
-			lons.append(lon)
-			lats.append(lat)
-			data.append(value)
+			if element.tag == '%sLMNode' % xmlNRML:
+				lon,lat,value = parse_loss_map_node(element)
+				lons.append(lon)
+				lats.append(lat)
+				data.append(value)
 	
 	return lons,lats,data
 